@@ -0,0 +1,70 @@
+"""
+    Small reads of an object the way readers of zip and columnar files make
+    them: the footer, the index it points to and then scattered records,
+    followed by a scan in small reads. Run with and without a block cache.
+
+    Usage: python -m benchmarks.bench_blocks [records] [size]
+
+    See COPYING for license information
+"""
+import random
+import sys
+import time
+
+import object_storage
+from benchmarks.server import Server
+from object_storage.cache import BlockCache
+
+LATENCY = 0.002
+READ_SIZE = 8 * 1024
+
+
+def run(client, records, size):
+    """ Returns ms per read of the lookups and of the scan """
+    obj = client['bench']['object']
+    rand = random.Random(0)
+    timings = []
+
+    start = time.time()
+    obj.read(-1024)
+    obj.read(64 * 1024, size - 64 * 1024)
+    for _ in xrange(records):
+        offset = rand.randrange(size - 1024)
+        obj.read(1024, offset)
+    timings.append((time.time() - start) * 1000 / (records + 2))
+
+    start = time.time()
+    reads = 0
+    for offset in xrange(0, size, READ_SIZE):
+        obj.read(READ_SIZE, offset)
+        reads += 1
+    timings.append((time.time() - start) * 1000 / reads)
+    return timings
+
+
+def main(records=500, size=4 * 1024 * 1024):
+    server = Server().start()
+    server.store.objects[('bench', 'object')] = 'x' * size
+    server.store.latency = lambda: LATENCY
+    print '%-12s %12s %12s %10s' % ('cache', 'lookup ms', 'scan ms',
+                                    'hit ratio')
+    try:
+        for label, cache in [('off', None), ('blocks', BlockCache())]:
+            kwargs = {}
+            if cache is not None:
+                kwargs['block_cache'] = cache
+            client = object_storage.get_httplib2_client(
+                'user', 'key', auth_url=server.auth_url, **kwargs)
+            lookup, scan = run(client, records, size)
+            ratio = '-'
+            if cache is not None:
+                ratio = '%.2f' % cache.stats(
+                    client['bench']['object'].url)['hit_ratio']
+            print '%-12s %12.2f %12.2f %10s' % (label, lookup, scan, ratio)
+            client.conn.pool.clear()
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
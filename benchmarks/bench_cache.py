@@ -0,0 +1,57 @@
+"""
+    Reading the same object over and over, without caches, with the
+    metadata and content caches revalidating every read, and with a
+    freshness window.
+
+    Usage: python -m benchmarks.bench_cache [count] [size]
+
+    See COPYING for license information
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+import object_storage
+from benchmarks.server import Server
+from object_storage.cache import ContentCache, MetadataCache
+
+LATENCY = 0.002
+
+
+def run(client, count):
+    """ Returns ms per load() and per read() """
+    timings = []
+    for method in ('load', 'read'):
+        start = time.time()
+        for _ in xrange(count):
+            getattr(client['bench']['object'], method)()
+        timings.append((time.time() - start) * 1000 / count)
+    return timings
+
+
+def main(count=200, size=4 * 1024 * 1024):
+    server = Server().start()
+    server.store.objects[('bench', 'object')] = 'x' * size
+    server.store.latency = lambda: LATENCY
+    tmp = tempfile.mkdtemp()
+    print '%-12s %10s %10s' % ('caches', 'load ms', 'read ms')
+    try:
+        for label, fresh in [('off', None), ('revalidate', 0),
+                             ('fresh 60s', 60)]:
+            kwargs = {}
+            if fresh is not None:
+                kwargs = {'metadata_cache': MetadataCache(),
+                          'content_cache': ContentCache(tmp, fresh=fresh)}
+            client = object_storage.get_httplib2_client(
+                'user', 'key', auth_url=server.auth_url, **kwargs)
+            print '%-12s %10.2f %10.2f' % tuple([label] +
+                                                run(client, count))
+            client.conn.pool.clear()
+    finally:
+        shutil.rmtree(tmp)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
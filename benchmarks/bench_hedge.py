@@ -0,0 +1,61 @@
+"""
+    Read latency with and without hedging when a few requests hit a slow
+    node.
+
+    Usage: python -m benchmarks.bench_hedge [count]
+
+    See COPYING for license information
+"""
+import random
+import sys
+import time
+
+import object_storage
+from benchmarks.server import Server
+from object_storage.hedge import HedgePolicy
+
+SLOW_FRACTION = 0.02
+SLOW_SECONDS = 0.2
+
+
+def latency():
+    if random.random() < SLOW_FRACTION:
+        return SLOW_SECONDS
+    return 0.001
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return [samples[int(len(samples) * p)] * 1000 for p in (0.5, 0.99)] + \
+        [samples[-1] * 1000]
+
+
+def run(client, count):
+    obj = client['bench']['object']
+    samples = []
+    for _ in xrange(count):
+        start = time.time()
+        obj.read()
+        samples.append(time.time() - start)
+    return percentiles(samples)
+
+
+def main(count=2000):
+    server = Server().start()
+    server.store.objects[('bench', 'object')] = 'x' * 1024
+    server.store.latency = latency
+    print '%-10s %8s %8s %8s %8s' % ('hedging', 'p50 ms', 'p99 ms', 'max ms',
+                                     'hedged')
+    for label, policy in [('off', None), ('p90', HedgePolicy(percentile=90))]:
+        random.seed(1)
+        client = object_storage.get_httplib2_client(
+            'user', 'key', auth_url=server.auth_url, hedge_policy=policy)
+        results = run(client, count)
+        hedged = policy.counts['hedged'] if policy else 0
+        row = [label] + results + [hedged]
+        print '%-10s %8.2f %8.2f %8.2f %8d' % tuple(row)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,65 @@
+"""
+    CPU time and memory per listing row for full StorageObjects versus
+    lightweight StorageObjectEntry instances.
+
+    Usage: python -m benchmarks.bench_listing [count]
+
+    See COPYING for license information
+"""
+import gc
+import os
+import sys
+import time
+
+from object_storage.client import Client
+from object_storage.storage_object import StorageObjectEntry
+
+
+class Connection(object):
+    storage_url = 'https://dal05.objectstorage.softlayer.net/v1/AUTH_bench'
+
+
+def listing(count):
+    return [{'name': 'path/to/object-%08d.dat' % i,
+             'bytes': i,
+             'hash': '%032x' % i,
+             'content_type': 'application/octet-stream',
+             'last_modified': '2012-01-01T00:00:00.000000'}
+            for i in xrange(count)]
+
+
+def resident_bytes():
+    """ Current RSS of this process (Linux only) """
+    try:
+        return int(open('/proc/self/statm').read().split()[1]) * \
+            os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError):
+        return 0
+
+
+def measure(label, build, count):
+    items = listing(count)
+    gc.collect()
+    before = resident_bytes()
+    start = time.time()
+    objects = [build(item) for item in items]
+    elapsed = time.time() - start
+    gc.collect()
+    used = resident_bytes() - before
+    print '%-20s %8.2f us/entry  %6d bytes/entry' % (
+        label, elapsed * 1e6 / count, used / count)
+    return objects
+
+
+def main(count=200000):
+    client = Client('user', 'key', connection=Connection())
+    container = client['bench']
+    measure('StorageObject', container._listing_object, count)
+    measure('StorageObjectEntry',
+            lambda item: StorageObjectEntry.from_listing('bench', item,
+                                                         client=client),
+            count)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,57 @@
+"""
+    Throughput of the synchronous transports (httplib2 and requests) for
+    small HEAD, GET and PUT requests and a large streamed download.
+
+    Usage: python -m benchmarks.bench_transports [count]
+
+    See COPYING for license information
+"""
+import sys
+import time
+
+import object_storage
+from benchmarks.server import Server
+
+LARGE_SIZE = 32 * 1024 * 1024
+
+
+def rate(func, count):
+    start = time.time()
+    for i in xrange(count):
+        func(i)
+    return count / (time.time() - start)
+
+
+def run(client, count):
+    container = client['bench']
+    results = []
+    results.append(rate(lambda i: container['object-%d' % i].send('x' * 1024),
+                        count))
+    results.append(rate(
+        lambda i: client.make_request('HEAD', ['bench', 'object-%d' % i]),
+        count))
+    results.append(rate(lambda i: container['object-%d' % i].read(), count))
+    start = time.time()
+    for _ in container['large'].chunk_download(chunk_size=64 * 1024):
+        pass
+    results.append(LARGE_SIZE / (time.time() - start) / 1024 / 1024)
+    return results
+
+
+def main(count=2000):
+    server = Server().start()
+    server.store.objects[('bench', 'large')] = 'x' * LARGE_SIZE
+    print '%-10s %10s %10s %10s %12s' % (
+        'transport', 'PUT/s', 'HEAD/s', 'GET/s', 'stream MB/s')
+    for label, factory in [('httplib2', object_storage.get_httplib2_client),
+                           ('requests', object_storage.get_requests_client)]:
+        client = factory('user', 'key', auth_url=server.auth_url)
+        before = server.store.connections
+        results = run(client, count)
+        print '%-10s %10.0f %10.0f %10.0f %12.0f  (%d connections)' % tuple(
+            [label] + results + [server.store.connections - before])
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,54 @@
+"""
+    Small request throughput of the Twisted transport, with and without
+    persistent connections.
+
+    Usage: python -m benchmarks.bench_twisted [count] [concurrency]
+
+    See COPYING for license information
+"""
+import sys
+import time
+
+from twisted.internet import defer, reactor, task
+from twisted.web.client import HTTPConnectionPool
+
+import object_storage
+from benchmarks.server import Server
+
+
+@defer.inlineCallbacks
+def run(client, count, concurrency):
+    requests = iter(xrange(count))
+
+    def _worker():
+        for _ in requests:
+            yield client.make_request('HEAD', ['bench', 'object'])
+    start = time.time()
+    cooperator = task.Cooperator()
+    yield defer.DeferredList([cooperator.coiterate(_worker())
+                              for _ in range(concurrency)])
+    defer.returnValue(count / (time.time() - start))
+
+
+@defer.inlineCallbacks
+def main(count=5000, concurrency=10):
+    server = Server().start()
+    server.store.objects[('bench', 'object')] = 'x'
+    for label, persistent in [('new connection per request', False),
+                              ('persistent pool', True)]:
+        pool = HTTPConnectionPool(reactor, persistent=persistent)
+        pool.maxPersistentPerHost = concurrency
+        client = yield object_storage.get_twisted_client(
+            'user', 'key', auth_url=server.auth_url, pool=pool)
+        before = server.store.connections
+        rate = yield run(client, count, concurrency)
+        print '%-28s %8.0f requests/s  %5d connections' % (
+            label, rate, server.store.connections - before)
+        yield client.conn.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    d = main(*[int(arg) for arg in sys.argv[1:]])
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
@@ -0,0 +1,40 @@
+"""
+    Small object upload throughput, with and without connection reuse.
+
+    Usage: python -m benchmarks.bench_upload [count] [size]
+
+    See COPYING for license information
+"""
+import sys
+import time
+
+import object_storage
+from benchmarks.server import Server
+
+
+def run(client, count, size):
+    data = 'x' * size
+    container = client['bench']
+    start = time.time()
+    for i in xrange(count):
+        container['object-%d' % i].send(data)
+    return count / (time.time() - start)
+
+
+def main(count=2000, size=1024):
+    server = Server().start()
+    # idle_timeout=0 closes every connection after use, as before pooling
+    for label, idle_timeout in [('new connection per PUT', 0),
+                                ('pooled keep-alive', 60)]:
+        client = object_storage.get_client('user', 'key',
+                                           auth_url=server.auth_url,
+                                           pool_idle_timeout=idle_timeout)
+        before = server.store.connections
+        rate = run(client, count, size)
+        print '%-24s %8.0f objects/s  %5d connections' % (
+            label, rate, server.store.connections - before)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
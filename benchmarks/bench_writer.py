@@ -0,0 +1,72 @@
+"""
+    Uploading data as it is produced, by driving chunk_upload() by hand and
+    by writing to StorageObject.open('wb'), over a link of limited upload
+    bandwidth. The producer compresses every piece it writes.
+
+    Usage: python -m benchmarks.bench_writer [size_mb] [rate_mb]
+
+    See COPYING for license information
+"""
+import random
+import sys
+import time
+import zlib
+from hashlib import md5
+
+import object_storage
+from benchmarks.server import Server
+
+PIECE = 64 * 1024
+
+
+def pieces(size):
+    """ Yields compressed pieces of size bytes in total """
+    rand = random.Random(0)
+    raw = ''.join(chr(rand.randrange(256)) for _ in xrange(PIECE * 4))
+    produced = 0
+    while produced < size:
+        offset = rand.randrange(PIECE * 3)
+        piece = zlib.compress(raw[offset:offset + PIECE], 6)
+        produced += len(piece)
+        yield piece
+
+
+def by_hand(obj, size):
+    conn = obj.chunk_upload()
+    checksum = md5()
+    for piece in pieces(size):
+        conn.send(piece)
+        checksum.update(piece)
+    assert conn.finish().headers['etag'] == checksum.hexdigest()
+
+
+def writer(obj, size):
+    with obj.open('wb') as f:
+        for piece in pieces(size):
+            f.write(piece)
+
+
+def main(size_mb=16, rate_mb=20):
+    size = size_mb * 1024 * 1024
+    server = Server().start()
+    server.store.upload_rate = rate_mb * 1024 * 1024
+    client = object_storage.get_httplib2_client('user', 'key',
+                                                auth_url=server.auth_url)
+    obj = client['bench']['object']
+    try:
+        start = time.time()
+        for _ in pieces(size):
+            pass
+        print '%-22s %8.2f s' % ('producing only', time.time() - start)
+        for label, upload in [('chunk_upload by hand', by_hand),
+                              ("open('wb')", writer)]:
+            start = time.time()
+            upload(obj, size)
+            print '%-22s %8.2f s' % (label, time.time() - start)
+        client.conn.pool.clear()
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,196 @@
+"""
+    Minimal in-process Object Storage server used by the benchmarks.
+
+    Speaks just enough of the Swift API (auth, object GET/HEAD/PUT/DELETE and
+    JSON container listings) over keep-alive HTTP/1.1 to exercise the client
+    transports without a real cluster.
+
+    See COPYING for license information
+"""
+import BaseHTTPServer
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from object_storage.utils import json
+
+
+class Store(object):
+    def __init__(self):
+        self.objects = {}
+        self.connections = 0
+        # Callable returning the seconds an object GET/HEAD is delayed by
+        self.latency = None
+        # Bytes per second chunked PUT bodies are read at, or None
+        self.upload_rate = None
+        self.lock = threading.Lock()
+        self._etags = {}
+
+    def etag(self, data):
+        """ MD5 of data, cached so large objects are only hashed once """
+        key = id(data), len(data)
+        if key not in self._etags:
+            self._etags[key] = md5(data).hexdigest()
+        return self._etags[key]
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.store.lock:
+            self.server.store.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body='', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def split_path(self):
+        url = urlparse.urlparse(self.path)
+        parts = [urllib.unquote(p) for p in url.path.split('/', 4)[3:]]
+        return parts, dict(urlparse.parse_qsl(url.query))
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            if not size:
+                self.rfile.readline()
+                return ''.join(chunks)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+            if self.server.store.upload_rate:
+                time.sleep(float(size) / self.server.store.upload_rate)
+
+    def do_GET(self):
+        if self.path.startswith('/auth'):
+            host, port = self.server.server_address
+            storage_url = 'http://%s:%s/v1/AUTH_bench' % (host, port)
+            body = json.dumps({'storage': {'default': 'public',
+                                           'public': storage_url}})
+            return self.respond(200, body, {'X-Auth-Token': 'token',
+                                            'X-Storage-Url': storage_url})
+        if self.path == '/info':
+            info = {'bulk_delete': {'max_deletes_per_request': 1000}}
+            return self.respond(200, json.dumps(info))
+        parts, params = self.split_path()
+        if len(parts) == 1:
+            return self.listing(parts[0], params)
+        if self.server.store.latency:
+            time.sleep(self.server.store.latency())
+        data = self.server.store.objects.get(tuple(parts))
+        if data is None:
+            return self.respond(404)
+        headers = {'ETag': self.server.store.etag(data),
+                   'Content-Type': 'application/octet-stream'}
+        if self.headers.get('If-None-Match') == headers['ETag']:
+            return self.respond(304, '', headers)
+        status = 200
+        if self.headers.get('Range'):
+            start, end = self.headers['Range'][len('bytes='):].split('-')
+            if not start:
+                start, end = max(0, len(data) - int(end)), ''
+            start = int(start)
+            end = min(len(data) - 1, int(end or len(data) - 1))
+            headers['Content-Range'] = 'bytes %s-%s/%s' % (start, end,
+                                                           len(data))
+            data, status = data[start:end + 1], 206
+        self.respond(status, data, headers)
+    do_HEAD = do_GET
+
+    def listing(self, container, params):
+        names = sorted(name for (c, name) in self.server.store.objects
+                       if c == container and
+                       name.startswith(params.get('prefix', '')) and
+                       name > params.get('marker', ''))
+        items = []
+        for name in names[:int(params.get('limit', 10000))]:
+            data = self.server.store.objects[(container, name)]
+            items.append({'name': name, 'bytes': len(data),
+                          'hash': self.server.store.etag(data),
+                          'content_type': 'application/octet-stream',
+                          'last_modified': '2012-01-01T00:00:00.000000'})
+        self.respond(200, json.dumps(items))
+
+    def do_PUT(self):
+        parts, params = self.split_path()
+        data = self.read_body()
+        if len(parts) > 1:
+            self.server.store.objects[tuple(parts)] = data
+        self.respond(201, '', {'ETag': self.server.store.etag(data)})
+
+    def do_POST(self):
+        parts, params = self.split_path()
+        body = self.read_body()
+        if 'bulk-delete' not in params:
+            return self.respond(204)
+        result = {'Number Deleted': 0, 'Number Not Found': 0, 'Errors': []}
+        for path in body.splitlines():
+            key = tuple(urllib.unquote(path).lstrip('/').split('/', 1))
+            if self.server.store.objects.pop(key, None) is None:
+                result['Number Not Found'] += 1
+            else:
+                result['Number Deleted'] += 1
+        self.respond(200, json.dumps(result))
+
+    def do_COPY(self):
+        parts, params = self.split_path()
+        self.read_body()
+        data = self.server.store.objects.get(tuple(parts))
+        if data is None:
+            return self.respond(404)
+        destination = urllib.unquote(self.headers['Destination'])
+        self.server.store.objects[
+            tuple(destination.lstrip('/').split('/', 1))] = data
+        self.respond(201, '', {'ETag': self.server.store.etag(data)})
+
+    def do_DELETE(self):
+        parts, params = self.split_path()
+        if self.server.store.objects.pop(tuple(parts), None) is None:
+            return self.respond(404)
+        self.respond(204)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.store = Store()
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose, e.g. when a hedged request lost
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   client_address)
+
+    @property
+    def auth_url(self):
+        return 'http://%s:%s/auth/v1.0' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
@@ -7,6 +7,22 @@ import object_storage.consts
 
 __version__ = object_storage.consts.__version__
 
+# Keyword arguments meant for the connection rather than the authentication
+CONNECTION_KWARGS = ('pool_size', 'pool_idle_timeout', 'pool',
+                     'refresh_interval', 'retry_policy', 'hedge_policy',
+                     'connect_timeout', 'read_timeout')
+# Keyword arguments meant for the client
+CLIENT_KWARGS = ('metadata_cache', 'content_cache', 'block_cache')
+
+
+def _connection_kwargs(kwargs, keys=CONNECTION_KWARGS):
+    """ Pops connection options out of kwargs and returns them """
+    conn_kwargs = {}
+    for key in keys:
+        if key in kwargs:
+            conn_kwargs[key] = kwargs.pop(key)
+    return conn_kwargs
+
 
 def get_client(*args, **kwargs):
     """ Returns an Object Storage client (using httplib2)
@@ -30,16 +46,35 @@ def get_httplib2_client(username, password,
     @param auth_url: Auth URL for Object Storage
     @param auth_token: If provided, bypasses authentication and uses the given
                        auth_token
+    @param pool_size: max number of persistent connections per host
+    @param pool_idle_timeout: seconds before an idle connection is closed
+    @param refresh_interval: seconds after which the auth token is replaced
+                             before it expires
+    @param retry_policy: `object_storage.retry.RetryPolicy` for failed
+                         requests
+    @param hedge_policy: `object_storage.hedge.HedgePolicy` that duplicates
+                         slow reads
+    @param connect_timeout: seconds to wait for a connection to be opened
+    @param read_timeout: seconds to wait for the server to send or accept
+                         data
+    @param token_cache: `object_storage.tokencache.TokenCache` to share auth
+                        tokens with other clients and processes
+    @param metadata_cache: `object_storage.cache.MetadataCache` that
+                           repeated HEAD requests are served from
+    @param content_cache: `object_storage.cache.ContentCache` that object
+                          content is served from
     @return: `object_storage.client.Client`
     """
     from object_storage.client import Client
     from object_storage.transport.httplib2conn import (
         AuthenticatedConnection, Authentication)
 
+    conn_kwargs = _connection_kwargs(kwargs)
+    client_kwargs = _connection_kwargs(kwargs, CLIENT_KWARGS)
     auth = Authentication(username, password,
                           auth_url=auth_url, auth_token=auth_token, **kwargs)
-    conn = AuthenticatedConnection(auth)
-    client = Client(username, password, connection=conn)
+    conn = AuthenticatedConnection(auth, **conn_kwargs)
+    client = Client(username, password, connection=conn, **client_kwargs)
     return client
 
 
@@ -50,11 +85,13 @@ def get_requests_client(username, password,
     from object_storage.transport.requestsconn import (
         AuthenticatedConnection, Authentication)
 
+    conn_kwargs = _connection_kwargs(kwargs)
+    client_kwargs = _connection_kwargs(kwargs, CLIENT_KWARGS)
     auth = Authentication(username, password,
                           auth_url=auth_url,
                           auth_token=auth_token, **kwargs)
-    conn = AuthenticatedConnection(auth)
-    client = Client(username, password, connection=conn)
+    conn = AuthenticatedConnection(auth, **conn_kwargs)
+    client = Client(username, password, connection=conn, **client_kwargs)
     return client
 
 
@@ -65,10 +102,38 @@ def get_twisted_client(username, password,
     from object_storage.transport.twist import (
         AuthenticatedConnection, Authentication)
 
+    conn_kwargs = _connection_kwargs(kwargs)
     auth = Authentication(username, password,
                           auth_url=auth_url, auth_token=auth_token, **kwargs)
-    conn = AuthenticatedConnection(auth)
+    conn = AuthenticatedConnection(auth, **conn_kwargs)
     client = Client(username, password, connection=conn)
 
     d = conn.authenticate().addCallback(lambda r: client)
     return d
+
+
+def get_asyncio_client(username, password,
+                       auth_url=None, auth_token=None, loop=None, **kwargs):
+    """ Returns an Object Storage client (using asyncio). Requires Python 3.
+
+    Client requests return asyncio Futures, so they can be awaited:
+        client = await get_asyncio_client(username, password, auth_url)
+        obj = await client['container']['object'].load()
+        await obj.send(data)
+
+    StorageObject.open() raises NotImplementedError, as file objects read
+    and write synchronously; upload with send() or load_from_filename().
+
+    @param loop: event loop; defaults to the current one
+    @return: Future for an `object_storage.client.Client`
+    """
+    from object_storage.client import Client
+    from object_storage.transport.asyncioconn import (
+        AuthenticatedConnection, Authentication, then)
+
+    conn_kwargs = _connection_kwargs(kwargs)
+    auth = Authentication(username, password,
+                          auth_url=auth_url, auth_token=auth_token, **kwargs)
+    conn = AuthenticatedConnection(auth, loop=loop, **conn_kwargs)
+    client = Client(username, password, connection=conn)
+    return then(conn.authenticate(), lambda r: client)
@@ -0,0 +1,149 @@
+"""
+    Bulk operations
+
+    See COPYING for license information
+"""
+import logging
+
+from object_storage import errors
+from object_storage.retry import RetryPolicy
+from object_storage.utils import get_path, imap_unordered, json
+
+logger = logging.getLogger(__name__)
+
+
+class BulkDeleter(object):
+    """
+        Deletes many objects concurrently.
+
+        Objects are consumed lazily from any iterable (typically a streaming
+        container listing) and deleted on a bounded pool of workers. Objects
+        that are already gone are counted as not_found rather than treated as
+        errors. Server errors and dropped connections are retried according
+        to a `RetryPolicy`. When the cluster runs the bulk middleware, many
+        paths are packed into each request.
+    """
+    def __init__(self, client, workers=8, retries=3, backoff=0.5,
+                 use_bulk=None, bulk_size=None, progress=None,
+                 retry_policy=None):
+        """ constructor for BulkDeleter
+
+        @param client: `object_storage.client` instance.
+        @param workers: number of concurrent delete requests
+        @param retries: times a failed delete is retried
+        @param backoff: seconds to wait before the first retry
+        @param use_bulk: use the bulk-delete middleware. The default of None
+            uses it when the cluster advertises it.
+        @param bulk_size: max paths per bulk request. Defaults to the
+            cluster's max_deletes_per_request.
+        @param progress: callable that is handed the counts after every
+            completed delete
+        @param retry_policy: `object_storage.retry.RetryPolicy` to use
+            instead of one built from retries and backoff
+        """
+        self.client = client
+        self.workers = workers
+        self.retry_policy = retry_policy or RetryPolicy(retries=retries,
+                                                        backoff=backoff)
+        self.use_bulk = use_bulk
+        self.bulk_size = bulk_size
+        self.progress = progress
+        self.counts = {'deleted': 0, 'not_found': 0, 'failed': 0}
+
+    def delete(self, objects):
+        """ Deletes the given objects
+
+        @param objects: iterable of objects with container and name
+            attributes (StorageObject, StorageObjectEntry)
+        @return: dict with counts of deleted, not_found and failed objects
+        """
+        bulk_size = self._bulk_size()
+        if bulk_size:
+            results = imap_unordered(self._delete_batch,
+                                     self._batches(objects, bulk_size),
+                                     workers=self.workers, backlog=1)
+        else:
+            results = imap_unordered(self._delete_one, objects,
+                                     workers=self.workers)
+        for counts in results:
+            for key, value in counts.iteritems():
+                self.counts[key] += value
+            if self.progress:
+                self.progress(dict(self.counts))
+        return dict(self.counts)
+
+    def _bulk_size(self):
+        """ Returns the number of paths per bulk request, or 0 if the bulk
+            middleware is not used """
+        if self.use_bulk is False:
+            return 0
+        info = self.client.get_capabilities().get('bulk_delete')
+        if not info:
+            if self.use_bulk:
+                raise errors.ObjectStorageError(
+                    'Bulk delete is not supported by the cluster')
+            return 0
+        return self.bulk_size or info.get('max_deletes_per_request', 10000)
+
+    def _batches(self, objects, size):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _delete_one(self, obj):
+        """ Deletes a single object """
+        def _delete():
+            try:
+                self.client.delete_object(obj.container, obj.name)
+            except errors.NotFound:
+                return {'not_found': 1}
+            return {'deleted': 1}
+        try:
+            return self.retry_policy.call(_delete, method='DELETE')
+        except errors.ResponseError, ex:
+            logger.warning("Could not delete %s/%s: %s",
+                           obj.container, obj.name, ex)
+            return {'failed': 1}
+
+    def _delete_batch(self, batch):
+        """ Deletes a batch of objects with one bulk-delete request. Objects
+            the middleware could not delete are retried one by one. """
+        paths = dict(('/' + get_path([obj.container, obj.name]), obj)
+                     for obj in batch)
+        body = '\n'.join(paths.keys())
+        headers = {'Content-Type': 'text/plain',
+                   'Accept': 'application/json',
+                   'Content-Length': str(len(body))}
+
+        def _formatter(res):
+            return json.loads(res.content)
+
+        def _bulk_delete():
+            return self.client.make_request('POST', params={'bulk-delete': 1},
+                                            headers=headers, data=body,
+                                            formatter=_formatter)
+        try:
+            # Deleting the same paths twice is harmless
+            result = self.retry_policy.call(_bulk_delete, idempotent=True)
+        except errors.ResponseError, ex:
+            logger.warning("Bulk delete failed, deleting one by one: %s", ex)
+            result = {'Errors': [[path, ''] for path in paths]}
+
+        counts = {'deleted': int(result.get('Number Deleted', 0)),
+                  'not_found': int(result.get('Number Not Found', 0)),
+                  'failed': 0}
+        for path, status in result.get('Errors', []):
+            if status.startswith('404'):
+                counts['not_found'] += 1
+            elif path not in paths:
+                logger.warning("Could not delete %s: %s", path, status)
+                counts['failed'] += 1
+            else:
+                for key, value in self._delete_one(paths[path]).iteritems():
+                    counts[key] += value
+        return counts
@@ -0,0 +1,617 @@
+"""
+    Client-side caches
+
+    See COPYING for license information
+"""
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from object_storage.tokencache import FileLock
+from object_storage.utils import json
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache(object):
+    """
+        Keeps the headers of HEAD responses, so that loading the same
+        account, container or object again does not cost a round trip.
+
+        Entries are keyed by URL and expire after `ttl` seconds. Once there
+        are more than `maxsize`, the least recently used ones are dropped.
+        `object_storage.client.Client` invalidates the entries a request of
+        its own may have changed; changes made by other clients show up
+        once the entry expires.
+
+        self.counts holds the number of hits, misses and evictions.
+    """
+    def __init__(self, maxsize=1000, ttl=30):
+        """ constructor for MetadataCache
+
+        @param maxsize: max number of entries
+        @param ttl: seconds an entry is used for
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.counts = {'hits': 0, 'misses': 0, 'evictions': 0}
+        # Bumped on every invalidation, so that a HEAD that was sent before
+        # a change does not store what it saw after it
+        self.version = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns a copy of the headers cached for key, or None """
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.counts['misses'] += 1
+                return None
+            self._entries[key] = entry
+            self.counts['hits'] += 1
+            return dict(entry[1])
+        finally:
+            self._lock.release()
+
+    def set(self, key, headers, version=None):
+        """ Caches headers for key
+
+        @param version: self.version from before the request was sent. The
+            headers are dropped if anything was invalidated since.
+        """
+        self._lock.acquire()
+        try:
+            if version is not None and version != self.version:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, dict(headers))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.counts['evictions'] += 1
+        finally:
+            self._lock.release()
+
+    def invalidate(self, key, prefix=False):
+        """ Drops the entry for key
+
+        @param prefix: also drop every entry whose key starts with key + '/'
+        """
+        self._lock.acquire()
+        try:
+            self.version += 1
+            self._entries.pop(key, None)
+            if prefix:
+                below = key + '/'
+                for other in [k for k in self._entries
+                              if k.startswith(below)]:
+                    del self._entries[other]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self.version += 1
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ContentCache(object):
+    """
+        Keeps object content in a directory that every process on the host
+        can share.
+
+        Each object is one file: a JSON line with its URL and response
+        headers, followed by the content. Files are written under a
+        temporary name and renamed into place, so a reader never sees a
+        partial entry. An entry is used as is for `fresh` seconds after it
+        was last validated, which is the mtime of its file. After that a GET
+        with If-None-Match is sent, which costs a 304 if the object is
+        unchanged. The atime of a file is set whenever it is used; once the
+        files take up more than `max_size` bytes, the least recently used
+        ones are removed.
+
+        self.counts holds the number of hits, revalidations, misses and
+        evictions.
+    """
+    def __init__(self, directory=None, max_size=1024 * 1024 * 1024,
+                 fresh=0):
+        """ constructor for ContentCache
+
+        @param directory: where content is kept. Defaults to
+            ~/.object_storage/content
+        @param max_size: max bytes kept in the directory
+        @param fresh: seconds an entry is used without asking the server
+            whether it changed
+        """
+        self.directory = directory or os.path.join(
+            os.path.expanduser('~'), '.object_storage', 'content')
+        self.max_size = max_size
+        self.fresh = fresh
+        self.counts = {'hits': 0, 'revalidated': 0, 'misses': 0,
+                       'evictions': 0}
+        self._lock = threading.Lock()
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory, 0700)
+            except OSError:
+                # Another process created it first
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def get(self, key, fetch, chunk_size=64 * 1024):
+        """ Returns the content for key, from the cache while it is current
+
+        @param key: URL of the object
+        @param fetch: callable(etag) that GETs the object, with If-None-Match
+            when etag is not None. Returns None if the server answered 304,
+            otherwise a (headers, iterable of chunks) tuple.
+        @param chunk_size: size of the chunks read from the cache
+        @return: (headers, iterator of chunks) tuple
+        """
+        path = self._path(key)
+        entry = self._open(path, key)
+        try:
+            if entry is None:
+                result = fetch(None)
+            elif self._is_fresh(entry[0]):
+                result = None
+                self._count('hits')
+                self._touch(path)
+            else:
+                result = fetch(entry[1].get('etag'))
+                if result is None:
+                    self._count('revalidated')
+                    self._touch(path, validated=True)
+        except Exception:
+            if entry is not None:
+                entry[0].close()
+            raise
+
+        if result is None:
+            f, headers = entry
+            return headers, self._read(f, chunk_size)
+        if entry is not None:
+            entry[0].close()
+        self._count('misses')
+        headers, chunks = result
+        headers = dict((k.lower(), v) for k, v in headers.items())
+        return headers, self._store(path, key, headers, chunks)
+
+    def invalidate(self, key):
+        """ Removes the entry for key """
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.obj')
+
+    def _open(self, path, key):
+        """ Returns (file, headers) for the entry at path with the file
+            positioned at the content, or None """
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            meta = json.loads(f.readline().decode('utf-8'))
+        except ValueError:
+            logger.warning("Ignoring corrupt cache entry %s", path)
+            meta = {}
+        if meta.get('key') != key:
+            f.close()
+            return None
+        return f, meta['headers']
+
+    def _is_fresh(self, f):
+        mtime = os.fstat(f.fileno()).st_mtime
+        return time.time() - mtime < self.fresh
+
+    def _touch(self, path, validated=False):
+        """ Marks an entry as used, and as validated just now """
+        try:
+            now = time.time()
+            if validated:
+                os.utime(path, (now, now))
+            else:
+                os.utime(path, (now, os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    def _read(self, f, chunk_size):
+        try:
+            while True:
+                buff = f.read(chunk_size)
+                if not buff:
+                    break
+                yield buff
+        finally:
+            f.close()
+
+    def _store(self, path, key, headers, chunks):
+        """ Yields chunks while writing them to a new entry. Objects without
+            an ETag, or larger than max_size, are passed through. """
+        f = tmp = None
+        if headers.get('etag'):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            f = os.fdopen(fd, 'wb')
+            meta = {'key': key, 'headers': headers}
+            f.write(json.dumps(meta).encode('utf-8') + b'\n')
+        size = 0
+        stored = False
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if f is not None and size > self.max_size:
+                    f.close()
+                    os.remove(tmp)
+                    f = None
+                if f is not None:
+                    f.write(chunk)
+                yield chunk
+            if f is not None:
+                f.close()
+                os.rename(tmp, path)
+                stored = True
+        finally:
+            if f is not None and not stored:
+                f.close()
+                os.remove(tmp)
+        if stored:
+            self._evict()
+
+    def _evict(self):
+        """ Removes the least recently used entries until the cache fits in
+            max_size """
+        lock = FileLock(os.path.join(self.directory, 'evict.lock'))
+        lock.acquire()
+        try:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith('.obj'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+                total += st.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+                self._count('evictions')
+        finally:
+            lock.release()
+
+    def _count(self, key):
+        self._lock.acquire()
+        try:
+            self.counts[key] += 1
+        finally:
+            self._lock.release()
+
+
+def parse_content_range(value):
+    """ Returns (first, last, total) from a Content-Range header, or None """
+    try:
+        unit, spec = value.split(' ', 1)
+        span, total = spec.split('/')
+        first, last = span.split('-')
+        return int(first), int(last), int(total)
+    except (AttributeError, ValueError):
+        return None
+
+
+class _BlockedObject(object):
+    """ What a `BlockCache` knows about one object """
+    def __init__(self):
+        self.size = None
+        self.etag = None
+        # When a response last showed the blocks to be current
+        self.checked = 0
+        self.blocks = set()
+        # Span of the last read and how many reads in a row moved forward
+        self.start = None
+        self.next_offset = None
+        self.streak = 0
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+
+
+class BlockCache(object):
+    """
+        Keeps ranges of objects in memory in fixed-size blocks, for readers
+        that jump around a file and read small overlapping pieces of it,
+        such as the index at the end of a zip or columnar file.
+
+        Reads are widened to whole blocks. Blocks that are missing next to
+        each other are fetched with one Range request. Once reads of an
+        object keep moving forward from where the previous one ended,
+        `readahead` more blocks are fetched along with the next miss.
+        Blocks of all objects share an LRU budget of `max_bytes`. A block
+        is dropped once a response shows that its object has a new ETag.
+
+        Every response checks the ETag of the object. A read served from
+        blocks alone more than `fresh` seconds after the last check first
+        sends a GET of its first block with If-None-Match, which costs a
+        round trip but no body while the object is unchanged. A block is
+        thus never served more than `fresh` seconds after its object was
+        last seen unchanged.
+
+        self.counts holds the number of block hits and misses, Range
+        requests, revalidations, prefetched blocks and evictions; stats()
+        returns the counts of one object.
+    """
+    def __init__(self, block_size=64 * 1024, max_bytes=64 * 1024 * 1024,
+                 readahead=8, max_objects=1000, fresh=1):
+        """ constructor for BlockCache
+
+        @param block_size: bytes per block
+        @param max_bytes: max bytes of blocks kept
+        @param readahead: blocks fetched ahead during sequential reads
+        @param max_objects: max number of objects whose size, ETag and
+            counts are remembered
+        @param fresh: seconds blocks are served without asking the server
+            whether their object changed
+        """
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.readahead = readahead
+        self.max_objects = max_objects
+        self.fresh = fresh
+        self.counts = {'hits': 0, 'misses': 0, 'requests': 0,
+                       'revalidated': 0, 'prefetched': 0, 'evictions': 0}
+        self._blocks = collections.OrderedDict()
+        self._objects = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def read(self, key, first, last, fetch):
+        """ Returns a range of an object, like a Range header selects it
+
+        @param key: URL of the object
+        @param first: first byte, or None for the last `last` bytes
+        @param last: last byte, or None to read to the end
+        @param fetch: callable(range, etag=None) that GETs the object with
+            the given Range header value and returns (headers, content).
+            With an etag it sends If-None-Match and returns None if the
+            server answered 304 Not Modified.
+        @return: content
+        """
+        obj = self._object(key)
+        size = obj.size
+        bs = self.block_size
+        if size is None and (first is None or last is None):
+            # Not known where the object ends until a response tells
+            if first is None:
+                return self._fetch(key, obj, fetch, first, last)[1]
+            offset, content = self._fetch(key, obj, fetch,
+                                          first - first % bs, None)
+            return content[first - offset:]
+
+        if first is None:
+            start, end = max(0, size - last), size
+        elif last is None:
+            start, end = first, size
+        else:
+            start, end = first, last + 1
+            if size is not None:
+                end = min(end, size)
+        if start >= end:
+            return self._fetch(key, obj, fetch, first, last)[1]
+
+        indexes = range(start // bs, (end - 1) // bs + 1)
+        self._lock.acquire()
+        try:
+            cached = {}
+            for index in indexes:
+                block = self._blocks.pop((key, index), None)
+                if block is not None:
+                    self._blocks[(key, index)] = block
+                    cached[index] = block
+            missing = [i for i in indexes if i not in cached]
+            # Moving forward from within or the end of the previous read
+            forward = obj.next_offset is not None and \
+                obj.start < start <= obj.next_offset
+            obj.streak = obj.streak + 1 if forward else 0
+            obj.start, obj.next_offset = start, end
+            obj.hits += len(cached)
+            obj.misses += len(missing)
+            self.counts['hits'] += len(cached)
+            self.counts['misses'] += len(missing)
+        finally:
+            self._lock.release()
+
+        etag = obj.etag
+        if not missing and etag is not None and \
+                time.time() - obj.checked >= self.fresh:
+            if not self._revalidate(key, obj, fetch, indexes[0]):
+                return self.read(key, first, last, fetch)
+        for run in self._runs(missing):
+            run_first, run_last = run[0], run[-1]
+            if run_last == indexes[-1] and obj.streak >= 2:
+                ahead = self.readahead
+                if size is not None:
+                    ahead = min(ahead, (size - 1) // bs - run_last)
+                run_last += ahead
+                self._count('prefetched', ahead)
+            run_end = (run_last + 1) * bs
+            if size is not None:
+                run_end = min(size, run_end)
+            offset, content = self._fetch(key, obj, fetch, run_first * bs,
+                                          run_end - 1)
+            for index in run:
+                block_offset = index * bs - offset
+                cached[index] = content[block_offset:block_offset + bs]
+        if etag is not None and obj.etag != etag:
+            # Changed while it was read; the blocks are from two versions
+            return self.read(key, first, last, fetch)
+
+        data = ''.join(cached[index] for index in indexes)
+        offset = indexes[0] * bs
+        return data[start - offset:end - offset]
+
+    def stats(self, key):
+        """ Returns the block hits, misses, Range requests and hit ratio
+            for an object """
+        obj = self._objects.get(key) or _BlockedObject()
+        total = obj.hits + obj.misses
+        return {'hits': obj.hits, 'misses': obj.misses,
+                'requests': obj.requests,
+                'hit_ratio': total and float(obj.hits) / total or 0.0}
+
+    def invalidate(self, key):
+        """ Drops the blocks of an object """
+        self._lock.acquire()
+        try:
+            obj = self._objects.get(key)
+            if obj is not None:
+                self._drop(key, obj)
+                obj.size = obj.etag = None
+        finally:
+            self._lock.release()
+
+    def _object(self, key):
+        self._lock.acquire()
+        try:
+            obj = self._objects.pop(key, None)
+            if obj is None:
+                obj = _BlockedObject()
+            self._objects[key] = obj
+            while len(self._objects) > self.max_objects:
+                old_key, old = self._objects.popitem(last=False)
+                self._drop(old_key, old)
+            return obj
+        finally:
+            self._lock.release()
+
+    def _runs(self, indexes):
+        """ Splits sorted block indexes into runs of adjacent ones """
+        runs = []
+        for index in indexes:
+            if runs and runs[-1][-1] == index - 1:
+                runs[-1].append(index)
+            else:
+                runs.append([index])
+        return runs
+
+    def _revalidate(self, key, obj, fetch, index):
+        """ Asks the server whether an object changed, with a conditional
+            GET of one of its blocks
+
+        @return: True if it has not
+        """
+        etag = obj.etag
+        bs = self.block_size
+        last = (index + 1) * bs - 1
+        if obj.size is not None:
+            last = min(last, obj.size - 1)
+        return self._fetch(key, obj, fetch, index * bs, last, etag) is None \
+            or obj.etag == etag
+
+    def _fetch(self, key, obj, fetch, first, last, etag=None):
+        """ Fetches a range and keeps the whole blocks it covers
+
+        @param etag: only fetch it if the object no longer has this ETag
+        @return: (offset, content), or None if it still has the ETag
+        """
+        if first is None:
+            spec = 'bytes=-%s' % last
+        else:
+            spec = 'bytes=%s-%s' % (first, '' if last is None else last)
+        if etag is None:
+            result = fetch(spec)
+        else:
+            result = fetch(spec, etag)
+        if result is None:
+            self._lock.acquire()
+            try:
+                obj.requests += 1
+                obj.checked = time.time()
+                self.counts['requests'] += 1
+                self.counts['revalidated'] += 1
+            finally:
+                self._lock.release()
+            return None
+        headers, content = result
+        headers = dict((k.lower(), v) for k, v in headers.items())
+        span = parse_content_range(headers.get('content-range'))
+        if span is None:
+            # The server sent all of it
+            span = (0, len(content) - 1, len(content))
+        start, _, size = span
+
+        self._lock.acquire()
+        try:
+            obj.requests += 1
+            obj.checked = time.time()
+            self.counts['requests'] += 1
+            etag = headers.get('etag')
+            if obj.etag != etag or obj.size != size:
+                self._drop(key, obj)
+                obj.etag, obj.size = etag, size
+            bs = self.block_size
+            index = (start + bs - 1) // bs
+            while index * bs < start + len(content):
+                block_end = min(size, (index + 1) * bs)
+                if block_end > start + len(content):
+                    break
+                if (key, index) not in self._blocks:
+                    offset = index * bs - start
+                    self._add(key, obj, index,
+                              content[offset:offset + block_end - index * bs])
+                index += 1
+        finally:
+            self._lock.release()
+        return start, content
+
+    def _add(self, key, obj, index, block):
+        """ Stores a block. Must be called with the lock held. """
+        self._blocks[(key, index)] = block
+        obj.blocks.add(index)
+        self._size += len(block)
+        while self._size > self.max_bytes and self._blocks:
+            (old_key, old_index), old = self._blocks.popitem(last=False)
+            self._size -= len(old)
+            old_obj = self._objects.get(old_key)
+            if old_obj is not None:
+                old_obj.blocks.discard(old_index)
+            self.counts['evictions'] += 1
+
+    def _drop(self, key, obj):
+        """ Removes the blocks of an object. Must be called with the lock
+            held. """
+        for index in obj.blocks:
+            block = self._blocks.pop((key, index), None)
+            if block is not None:
+                self._size -= len(block)
+        obj.blocks = set()
+
+    def _count(self, key, value=1):
+        self._lock.acquire()
+        try:
+            self.counts[key] += value
+        finally:
+            self._lock.release()
@@ -10,8 +10,11 @@ from object_storage.storage_object import StorageObject
 from object_storage.utils import get_path
 
 from object_storage import errors
+from object_storage.transport import Response
 
 import logging
+import re
+import urlparse
 logger = logging.getLogger(__name__)
 
 
@@ -74,16 +77,27 @@ class Client(object):
             for objects.
         @param container_class: factory or class for Container constructing
         @param object_class: factory or class for StorageObject constructing
+        @param metadata_cache: `object_storage.cache.MetadataCache` that HEAD
+            responses are served from. Only for synchronous connections.
+        @param content_cache: `object_storage.cache.ContentCache` that object
+            content is served from. Only for synchronous connections.
+        @param block_cache: `object_storage.cache.BlockCache` that ranged
+            reads of objects are served from. Only for synchronous
+            connections.
         """
         self.username = username
         self.api_key = api_key
         self.delimiter = delimiter
         self.container_class = kwargs.get('container_class', Container)
         self.object_class = kwargs.get('object_class', StorageObject)
+        self.metadata_cache = kwargs.get('metadata_cache')
+        self.content_cache = kwargs.get('content_cache')
+        self.block_cache = kwargs.get('block_cache')
         self.storage_url = None
         self.conn = connection
 
         self.model = None
+        self._capabilities = None
 
     def load(self, cdn=True):
         """ load data for the account
@@ -198,6 +212,21 @@ class Client(object):
                                  params=params,
                                  formatter=_formatter)
 
+    def get_capabilities(self):
+        """ Returns the capabilities the cluster publishes at /info, such as
+            whether the bulk-delete middleware is installed. Returns an empty
+            dict if the cluster does not publish them.
+        """
+        if self._capabilities is None:
+            scheme, netloc = urlparse.urlparse(self.get_url())[:2]
+            url = '%s://%s/info' % (scheme, netloc)
+            try:
+                self._capabilities = self.conn.make_request(
+                    'GET', url, formatter=lambda r: json.loads(r.content))
+            except (errors.ObjectStorageError, ValueError):
+                self._capabilities = {}
+        return self._capabilities
+
     def set_delimiter(self, delimiter):
         """ Sets the delimiter for pseudo hierarchical directory structure.
         @param delimiter: delimiter to use
@@ -344,15 +373,184 @@ class Client(object):
         return url
 
     def make_request(self, method, path=None, *args, **kwargs):
-        """ Make an HTTP request
+        """ Make an HTTP request. Plain and ranged GETs of objects and HEADs
+            are served from the content, block and metadata caches, if there
+            are any, and changes invalidate them.
 
         @param method: HTTP method (GET, HEAD, POST, PUT, ...)
         @param path: path
         @raises ResponseError
         """
         url = self.get_url(path)
-        result = self.conn.make_request(method, url, *args, **kwargs)
-        return result
+        plain = not (args or kwargs.get('headers') or kwargs.get('params'))
+        if method == 'GET':
+            if self.content_cache is not None and plain and \
+                    self._is_object(url):
+                return self._cached_get(url, **kwargs)
+            span = self._range(args, kwargs)
+            if self.block_cache is not None and span is not None and \
+                    self._is_object(url):
+                return self._cached_range(url, span, **kwargs)
+        elif method == 'HEAD':
+            if self.metadata_cache is not None and plain:
+                return self._cached_head(url, **kwargs)
+        elif self._caching():
+            # Also invalidated afterwards, in case a read got in before the
+            # change was made
+            self._invalidate_request(method, url, kwargs)
+            try:
+                return self.conn.make_request(method, url, *args, **kwargs)
+            finally:
+                self._invalidate_request(method, url, kwargs)
+        return self.conn.make_request(method, url, *args, **kwargs)
+
+    def invalidate(self, path=None):
+        """ Drops cached metadata of a resource that was changed and of the
+            container and account it is in
+
+        @param path: path of the resource
+        """
+        if self._caching():
+            self._invalidate('PUT', self.get_url(path))
+
+    def _caching(self):
+        return self.metadata_cache is not None or \
+            self.content_cache is not None or self.block_cache is not None
+
+    def _invalidate_request(self, method, url, kwargs):
+        """ Invalidates what a request may change, which for a bulk delete
+            is every path listed in its body """
+        self._invalidate(method, url, kwargs.get('headers'))
+        if 'bulk-delete' in (kwargs.get('params') or {}):
+            base = self.get_url()
+            for line in (kwargs.get('data') or '').splitlines():
+                if line.strip():
+                    self._invalidate('DELETE',
+                                     '%s/%s' % (base, line.strip('/')))
+
+    def _invalidate(self, method, url, headers=None):
+        cache = self.metadata_cache
+        base = self.get_url()
+        destination = (headers or {}).get('Destination')
+        if destination:
+            # A COPY leaves its source alone
+            url = '%s/%s' % (base, destination.lstrip('/'))
+        if self.content_cache is not None:
+            self.content_cache.invalidate(url)
+        if self.block_cache is not None:
+            self.block_cache.invalidate(url)
+        if cache is None:
+            return
+        cache.invalidate(url, prefix=method == 'DELETE')
+        cache.invalidate(base)
+        path = url[len(base):].strip('/')
+        if '/' in path:
+            cache.invalidate('%s/%s' % (base, path.split('/')[0]))
+
+    def _is_object(self, url):
+        return '/' in url[len(self.get_url()):].strip('/')
+
+    def _cached_get(self, url, formatter=None, **kwargs):
+        """ Serves a GET of an object from the content cache """
+        headers, chunks = self.content_cache.get(url,
+                                                 self._fetch_content(url))
+        res = Response()
+        res.status_code = 200
+        res.headers = headers
+        res.content = ''.join(chunks)
+        if formatter:
+            return formatter(res)
+        return res
+
+    def _range(self, args, kwargs):
+        """ Returns (first, last) of a GET with a single Range header and
+            nothing else, or None """
+        headers = kwargs.get('headers') or {}
+        if args or kwargs.get('params') or list(headers) != ['Range']:
+            return None
+        match = re.match(r'^bytes=(\d*)-(\d*)$', headers['Range'])
+        if match is None or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if not first:
+            # The last bytes of the object
+            if not last or not int(last):
+                return None
+            return None, int(last)
+        return int(first), int(last) if last else None
+
+    def _cached_range(self, url, span, formatter=None, **kwargs):
+        """ Serves a ranged GET of an object from the block cache """
+        def _formatter(res):
+            if res.status_code == 304:
+                return None
+            return res.headers, res.content
+
+        def _fetch(spec, etag=None):
+            headers = {'Range': spec}
+            if etag:
+                headers['If-None-Match'] = etag
+            try:
+                return self.conn.make_request('GET', url, headers=headers,
+                                              formatter=_formatter)
+            except errors.ResponseError, ex:
+                if ex.status == 304:
+                    return None
+                raise
+
+        res = Response()
+        res.status_code = 206
+        res.headers = {}
+        res.content = self.block_cache.read(url, span[0], span[1], _fetch)
+        if formatter:
+            return formatter(res)
+        return res
+
+    def _fetch_content(self, url, chunk_size=64 * 1024):
+        """ Returns the fetch callable for `ContentCache.get` """
+        def _formatter(res):
+            if res.status_code == 304:
+                # Reading the empty body first hands a streamed connection
+                # back to the pool rather than closing it
+                if hasattr(res, 'close'):
+                    res.content
+                    res.close()
+                return None
+            if hasattr(res, 'iter_content'):
+                return res.headers, res.iter_content(chunk_size)
+            return res.headers, [res.content]
+
+        def _fetch(etag):
+            headers = {}
+            if etag:
+                headers['If-None-Match'] = etag
+            try:
+                # Streamed by connections that can
+                return self.conn.make_request('GET', url, headers=headers,
+                                              formatter=_formatter,
+                                              stream=True)
+            except errors.ResponseError, ex:
+                # The transport has released the response already
+                if ex.status == 304:
+                    return None
+                raise
+        return _fetch
+
+    def _cached_head(self, url, formatter=None, **kwargs):
+        """ Serves a HEAD request from the metadata cache """
+        cache = self.metadata_cache
+        headers = cache.get(url)
+        if headers is None:
+            version = cache.version
+            res = self.conn.make_request('HEAD', url, **kwargs)
+            cache.set(url, res.headers, version=version)
+        else:
+            res = Response()
+            res.status_code = 200
+            res.headers = headers
+        if formatter:
+            return formatter(res)
+        return res
 
     def chunk_download(self, path, chunk_size=10 * 1024, headers=None):
         """ Returns a chunk download generator
@@ -363,7 +561,11 @@ class Client(object):
         @raises ResponseError
         """
         url = self.get_url(path)
-        return self.conn.chunk_download(url, chunk_size=chunk_size)
+        if self.content_cache is not None and not headers:
+            return self.content_cache.get(
+                url, self._fetch_content(url, chunk_size), chunk_size)[1]
+        return self.conn.chunk_download(url, chunk_size=chunk_size,
+                                        headers=headers)
 
     def chunk_upload(self, path, size=None, headers=None):
         """ Returns a chunkable connection object at the given path
@@ -374,6 +576,7 @@ class Client(object):
         """
         url = self.get_url(path)
         logger.debug("%s %s %s" % ('PUT', url, headers))
+        self.invalidate(path)
         return self.conn.chunk_upload('PUT', url, size=size, headers=headers)
 
     def __getitem__(self, name):
@@ -3,11 +3,16 @@
 
     See COPYING for license information
 """
+import functools
 import os
 from object_storage.utils import json, Model
 from object_storage import errors
-from object_storage.storage_object import StorageObject
-from object_storage.utils import get_path
+from object_storage.bulk import BulkDeleter
+from object_storage.sync import Sync, UPLOAD
+from object_storage.storage_object import StorageObject, \
+    StorageObjectEntry, md5_file
+from object_storage.utils import get_path, call_in_background, \
+    imap_unordered, not_found_as
 
 
 class ContainerModel(Model):
@@ -80,7 +85,8 @@ class Container:
             self.model = ContainerModel(self, self.name, res.headers)
             return True
         try:
-            return self.make_request('HEAD', formatter=_formatter)
+            return not_found_as(
+                self.make_request('HEAD', formatter=_formatter), False)
         except errors.NotFound:
             return False
 
@@ -174,17 +180,23 @@ class Container:
         @raises ResponseError
         @return: True
         """
-        return self.client.delete_container(self.name, recursive=recursive)
+        if recursive:
+            self.delete_all_objects()
+        return self.client.delete_container(self.name)
 
-    def delete_all_objects(self):
-        """ Deletes all objects in the container
+    def delete_all_objects(self, prefix=None, **kwargs):
+        """ Deletes all objects in the container, streaming the listing into
+            a pool of concurrent deletes.
 
+        @param prefix: only delete objects whose names start with prefix
+        @param **kwargs: options for `object_storage.bulk.BulkDeleter`
+            (workers, retries, backoff, use_bulk, bulk_size, progress)
         @raises ResponseError
+        @return: dict with counts of deleted, not_found and failed objects
         """
-        resps = []
-        for item in self.objects():
-            resps.append(item.delete())
-        return resps
+        deleter = BulkDeleter(self.client, **kwargs)
+        return deleter.delete(self.iter_objects(prefix=prefix,
+                                                lightweight=True))
 
     def delete_object(self, obj):
         """ Deletes an object in the container
@@ -205,17 +217,74 @@ class Container:
         self.delete()
         new_container.create()
 
-    def objects(self, limit=None, marker=None, base_only=False, headers=None):
-        """ Lists objects in the container.
+    def objects(self, limit=None, marker=None, base_only=False, headers=None,
+                prefix=None):
+        """ Lists objects in the container. Returns a single page of results;
+            use iter_objects() to walk the whole container.
 
         @param limit: limit of results to return.
         @param marker: start listing after this object name
         @param base_only: only return the base objects.
             container/object not container/dir/object
         @param headers: extra headers to use in the request
+        @param prefix: only list objects whose names start with prefix
         @raises ResponseError
         @return: list of StorageObject instances
         """
+        def _formatter(res):
+            objects = {}
+            for item in self._parse_listing(res):
+                objects[item['name']] = self._listing_object(item)
+            return objects.values()
+        return self._list(limit=limit, marker=marker, base_only=base_only,
+                          headers=headers, prefix=prefix, formatter=_formatter)
+
+    def iter_objects(self, marker=None, base_only=False, headers=None,
+                     prefix=None, page_size=None, prefetch=True,
+                     lightweight=False):
+        """ Iterates over every object in the container, following the
+            listing marker from page to page. Objects are yielded as each
+            page is parsed, and the next page is requested in the background
+            while the current one is consumed.
+
+        @param marker: start listing after this object name
+        @param base_only: only return the base objects.
+            container/object not container/dir/object
+        @param headers: extra headers to use in the requests
+        @param prefix: only list objects whose names start with prefix
+        @param page_size: number of objects to request per page
+        @param prefetch: fetch the next page while the current one is used
+        @param lightweight: yield StorageObjectEntry instances, which take a
+            fraction of the memory and CPU of full StorageObjects
+        @raises ResponseError
+        @return: generator of StorageObject instances
+        """
+        def _fetch(marker):
+            return self._list(limit=page_size, marker=marker,
+                              base_only=base_only, headers=headers,
+                              prefix=prefix, formatter=self._parse_listing)
+
+        page = _fetch(marker)
+        while page:
+            next_page = None
+            if not page_size or len(page) >= page_size:
+                last = page[-1]
+                marker = last.get('subdir', last['name'])
+                if prefetch:
+                    next_page = call_in_background(_fetch, marker)
+                else:
+                    next_page = functools.partial(_fetch, marker)
+            for item in page:
+                if lightweight:
+                    yield StorageObjectEntry.from_listing(
+                        self.name, item, client=self.client)
+                else:
+                    yield self._listing_object(item)
+            page = next_page and next_page()
+
+    def _list(self, limit=None, marker=None, base_only=False, headers=None,
+              prefix=None, formatter=None):
+        """ Makes a single listing request """
         params = {'format': 'json'}
         if base_only:
             params['delimiter'] = self.client.delimiter
@@ -223,25 +292,28 @@ class Container:
             params['limit'] = limit
         if marker:
             params['marker'] = marker
-
-        def _formatter(res):
-            objects = {}
-            if res.content:
-                items = json.loads(res.content)
-                for item in items:
-                    if 'name' in item:
-                        objects[item['name']] = self.storage_object(
-                            item['name'], item)
-                    elif 'subdir' in item:
-                        item['name'] = item['subdir'].rstrip('/')
-                        item['content_type'] = 'application/directory'
-                        objects[item['name']] = self.storage_object(
-                            item['name'], item)
-            return objects.values()
+        if prefix:
+            params['prefix'] = prefix
         return self.make_request('GET',
                                  params=params,
                                  headers=headers,
-                                 formatter=_formatter)
+                                 formatter=formatter)
+
+    def _parse_listing(self, res):
+        """ Returns the items of a JSON listing response. Pseudo-directories
+            are given a name and a directory content type. """
+        items = []
+        if res.content:
+            items = json.loads(res.content)
+        for item in items:
+            if 'name' not in item and 'subdir' in item:
+                item['name'] = item['subdir'].rstrip('/')
+                item['content_type'] = 'application/directory'
+        return [item for item in items if 'name' in item]
+
+    def _listing_object(self, item):
+        """ Creates a StorageObject from a listing item """
+        return self.storage_object(item['name'], item)
 
     def set_ttl(self, ttl):
         """ Set time to live for CDN
@@ -311,6 +383,79 @@ class Container:
         name = os.path.basename(filename)
         return self.storage_object(name).load_from_filename(filename)
 
+    def download_directory(self, directory, prefix=None, workers=4,
+                           skip_unchanged=True):
+        """ Downloads every object below prefix into a local directory.
+
+        The listing is streamed into a pool of `workers` downloads, so
+        transfers start while later pages are still being listed. Object
+        names are split on the client's delimiter to recreate the directory
+        structure, with prefix removed from the front.
+
+        @param directory: local directory to download into
+        @param prefix: only download objects whose names start with prefix
+        @param workers: number of concurrent downloads
+        @param skip_unchanged: skip objects whose local copy already has
+            the same size and MD5
+        @raises ResponseError
+        @return: dict with counts of downloaded and skipped objects
+        """
+        prefix = prefix or ''
+        directory = os.path.abspath(directory)
+
+        def _makedirs(path):
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # Another worker created it first
+                    if not os.path.isdir(path):
+                        raise
+
+        def _download(entry):
+            parts = entry.name[len(prefix):].split(self.client.delimiter)
+            path = os.path.abspath(os.path.join(directory, *parts))
+            if not path.startswith(directory + os.sep):
+                return 'skipped'
+            if entry.is_dir():
+                _makedirs(path)
+                return 'skipped'
+            if skip_unchanged and os.path.isfile(path) and \
+                    os.path.getsize(path) == entry.bytes and \
+                    md5_file(path) == entry.hash:
+                return 'skipped'
+            _makedirs(os.path.dirname(path))
+            entry.get_object().save_to_filename(path + '.part')
+            os.rename(path + '.part', path)
+            return 'downloaded'
+
+        counts = {'downloaded': 0, 'skipped': 0}
+        listing = self.iter_objects(prefix=prefix, lightweight=True)
+        for result in imap_unordered(_download, listing, workers=workers):
+            counts[result] += 1
+        return counts
+
+    def sync(self, directory, direction=UPLOAD, prefix=None, delete=False,
+             dry_run=False, state_file=None, workers=4):
+        """ Syncs a local directory with the objects below prefix
+
+        @param directory: local directory
+        @param direction: 'upload' to make the container match the
+            directory, 'download' for the reverse
+        @param prefix: object name prefix the directory maps to
+        @param delete: also delete what no longer exists on the source side
+        @param dry_run: only compute and log the changes
+        @param state_file: path of the file that caches local MD5 sums
+            between runs
+        @param workers: number of concurrent transfers
+        @raises ResponseError
+        @return: `object_storage.sync.SyncPlan` with the new, changed and
+            deleted object names
+        """
+        sync = Sync(self, directory, prefix=prefix, state_file=state_file,
+                    workers=workers)
+        return sync.run(direction, delete=delete, dry_run=dry_run)
+
     def make_request(self, method, path=None, *args, **kwargs):
         """ Makes a request on the resource. """
         path = [self.name]
@@ -327,7 +472,5 @@ class Container:
         return 'Container(%s)' % (self.name.encode("utf-8"), )
 
     def __iter__(self):
-        """ Returns an interator based on results of self.objects() """
-        listing = self.objects()
-        for obj in listing:
-            yield obj
+        """ Returns an interator based on results of self.iter_objects() """
+        return self.iter_objects()
@@ -0,0 +1,111 @@
+"""
+    Deadlines
+
+    See COPYING for license information
+"""
+import threading
+import time
+
+from object_storage import errors
+
+_local = threading.local()
+
+
+def current():
+    """ Returns the innermost active deadline of this thread, or None """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        return stack[-1]
+    return None
+
+
+def remaining():
+    """ Returns the seconds left before the current deadline, or None """
+    active = current()
+    if active is None:
+        return None
+    return active.remaining()
+
+
+def clamp(timeout):
+    """ Limits a socket timeout to the time left before the current deadline
+
+    @param timeout: seconds, or None to wait for as long as it takes
+    @raises DeadlineExceeded: if the deadline has passed already
+    @return: timeout, or the seconds left if that is less
+    """
+    active = current()
+    if active is None:
+        return timeout
+    left = active.remaining()
+    if left <= 0:
+        raise active.error()
+    if timeout is None:
+        return left
+    return min(timeout, left)
+
+
+def bind(func):
+    """ Returns func wrapped so that it runs under the current deadline, for
+        handing work to other threads """
+    active = current()
+    if active is None:
+        return func
+
+    def _bound(*args, **kwargs):
+        active.__enter__()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            active.__exit__(None, None, None)
+    return _bound
+
+
+class Deadline(object):
+    """
+        A time budget shared by every request made inside of it:
+
+            with Deadline(30):
+                objects = container.objects()
+                BulkDeleter(client).delete(objects)
+
+        The connect and read timeouts of each request are cut down to the
+        time that is left, retries are not started once they would end
+        past it and requests fail with DeadlineExceeded once it has passed.
+        A nested deadline can only shorten the one around it. Work that
+        `object_storage.utils.imap_unordered` hands to other threads runs
+        under the deadline of the caller.
+    """
+    def __init__(self, seconds):
+        """ constructor for Deadline
+
+        @param seconds: time budget in seconds
+        """
+        self.seconds = seconds
+        self.expires = time.time() + seconds
+        outer = current()
+        if outer is not None:
+            self.expires = min(self.expires, outer.expires)
+
+    def remaining(self):
+        """ Returns the seconds left, which is negative once it passed """
+        return self.expires - time.time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def error(self):
+        """ Returns the exception raised once the deadline has passed """
+        return errors.DeadlineExceeded('Deadline of %ss exceeded'
+                                       % self.seconds)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.stack.pop()
+        return False
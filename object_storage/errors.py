@@ -3,6 +3,7 @@
 
     See COPYING for license information
 """
+import socket
 
 
 class ObjectStorageError(Exception):
@@ -49,9 +50,11 @@ class ContainerNotFound(NotFound):
 
 class ResponseError(ObjectStorageError):
     """ Response error """
-    def __init__(self, status, reason):
+    def __init__(self, status, reason, retry_after=None):
         self.status = status or 0
         self.reason = reason or 'Unknown'
+        # Value of the Retry-After header, if the server sent one
+        self.retry_after = retry_after
         ObjectStorageError.__init__(self)
 
     def __str__(self):
@@ -59,3 +62,13 @@ class ResponseError(ObjectStorageError):
 
     def __repr__(self):
         return '%d: %s' % (self.status, self.reason)
+
+
+class TimeoutError(ObjectStorageError, socket.timeout):
+    """ The server did not answer in time """
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    """ The deadline of an operation has passed """
+    pass
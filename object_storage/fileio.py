@@ -0,0 +1,412 @@
+"""
+    File-like access to objects
+
+    See COPYING for license information
+"""
+import io
+import os
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from object_storage import deadline
+
+import logging
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+_ABORT = object()
+
+
+class ObjectReader(io.RawIOBase):
+    """
+        Reads an object through Range GETs, for code that wants a seekable
+        file. `object_storage.storage_object.StorageObject.open` wraps it in
+        an io.BufferedReader.
+
+        Sequential reads are served from one streaming response, which is
+        kept open between calls and read `readahead` bytes at a time.
+        Seeking forward by up to `readahead` bytes reads through that
+        response; other seeks close it and the next read opens a new one at
+        the new offset.
+
+        self.requests holds the number of GETs made.
+    """
+    def __init__(self, obj, readahead=256 * 1024):
+        """ constructor for ObjectReader
+
+        @param obj: `object_storage.storage_object.StorageObject` to read
+        @param readahead: max bytes read from the response at once
+        """
+        self.obj = obj
+        self.name = obj.name
+        self.readahead = readahead
+        self.requests = 0
+        self._pos = 0
+        self._size = None
+        self._stream = None
+        self._chunk = None
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """ Moves to a new position
+
+        @param offset: bytes relative to whence
+        @param whence: os.SEEK_SET, os.SEEK_CUR or os.SEEK_END. Seeking
+            relative to the end loads the size of the object.
+        @return: the new position
+        """
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self._length() + offset
+        else:
+            raise ValueError('Invalid whence (%r)' % whence)
+        if pos < 0:
+            raise ValueError('Negative seek position %d' % pos)
+        skip = pos - self._pos
+        if self._stream is not None and 0 < skip <= self.readahead:
+            while skip and self._fill():
+                count = min(skip, len(self._chunk) - self._offset)
+                self._offset += count
+                self._pos += count
+                skip -= count
+        elif skip:
+            self._close_stream()
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        """ Reads into b, straight from the response buffers
+
+        @return: bytes read, which is less than len(b) if the response has
+            no more buffered and 0 at the end of the object
+        """
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        if not self._fill():
+            return 0
+        view = memoryview(b)
+        count = min(len(view), len(self._chunk) - self._offset)
+        view[:count] = self._chunk[self._offset:self._offset + count]
+        self._offset += count
+        self._pos += count
+        return count
+
+    def close(self):
+        self._close_stream()
+        io.RawIOBase.close(self)
+
+    def _length(self):
+        if self._size is None:
+            self._size = len(self.obj)
+        return self._size
+
+    def _fill(self):
+        """ Makes sure there are unread bytes in self._chunk
+
+        @return: False at the end of the object
+        """
+        if self._chunk is not None and self._offset < len(self._chunk):
+            return True
+        self._chunk, self._offset = None, 0
+        if self._stream is None:
+            if self._size is not None and self._pos >= self._size:
+                return False
+            self._open()
+        try:
+            chunk = next(self._stream)
+        except StopIteration:
+            self._stream = None
+            self._size = self._pos
+            return False
+        except Exception, ex:
+            # Reading from past the end
+            if 416 not in (getattr(ex, 'status', None),
+                           getattr(ex, 'code', None)):
+                raise
+            self._stream = None
+            return False
+        self._chunk = memoryview(chunk)
+        return len(chunk) > 0 or self._fill()
+
+    def _open(self):
+        headers = None
+        if self._pos:
+            headers = {'Range': 'bytes=%d-' % self._pos}
+        logger.debug("Reading %s from %d", self.name, self._pos)
+        self.requests += 1
+        self._stream = iter(self.obj.client.chunk_download(
+            [self.obj.container, self.obj.name], chunk_size=self.readahead,
+            headers=headers))
+
+    def _close_stream(self):
+        stream, self._stream = self._stream, None
+        self._chunk, self._offset = None, 0
+        if stream is not None and hasattr(stream, 'close'):
+            stream.close()
+
+
+class ObjectWriter(io.BufferedIOBase):
+    """
+        Uploads what is written to it, for code that writes to a file:
+
+            with obj.open('wb') as f:
+                f.write(data)
+
+        Writes are collected into chunks of `chunk_size` bytes, which a
+        background thread streams to the server while the caller goes on
+        writing. Up to `backlog` chunks wait for it before write() blocks.
+        The MD5 of each upload is worked out as it is sent and checked
+        against the ETag the server returns.
+
+        The object itself is only written by close(), so an upload that
+        fails or is aborted leaves it as it was. What close() finds in the
+        buffer, up to one chunk, is uploaded to the object directly. Larger
+        uploads are streamed to the segment container, in segments of
+        `segment_size` bytes. close() then copies a single segment to the
+        object, or writes the manifest of several. Segments that are no
+        longer needed are deleted, as well as possible.
+
+        close() returns the uploaded StorageObject. Leaving a with block
+        because of an exception aborts the upload instead, and so does
+        dropping the writer without closing it.
+    """
+    def __init__(self, obj, chunk_size=1024 * 1024, segment_size=None,
+                 segment_container=None, check_md5=True, backlog=2):
+        """ constructor for ObjectWriter
+
+        @param obj: `object_storage.storage_object.StorageObject` to upload
+        @param chunk_size: bytes sent to the server at once
+        @param segment_size: size after which the object is uploaded as a
+            segmented object. If not defined uses obj.segment_size
+        @param segment_container: container the segments are uploaded to.
+            Defaults to '<container>_segments'
+        @param check_md5: check if hash of each upload matches
+        @param backlog: chunks that can wait to be sent
+        """
+        self.obj = obj
+        self.name = obj.name
+        self.chunk_size = chunk_size
+        self.segment_size = segment_size or obj.segment_size
+        self.segment_container = (segment_container or
+                                  '%s_segments' % (obj.container, ))
+        self.check_md5 = check_md5
+        self.size = 0
+        self._parts = []
+        self._buffered = 0
+        self._queue = queue.Queue(maxsize=backlog)
+        self._thread = None
+        self._error = None
+        # Set by close() if nothing was handed to the thread before
+        self._direct = False
+        # Used by the background thread only
+        self._content_type = obj._guess_content_type(None)
+        self._upload = None
+        self._checksum = None
+        self._part_size = 0
+        self._index = None
+        self._prefix = None
+        self._segments = []
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.size
+
+    def write(self, data):
+        """ Buffers data to be uploaded
+
+        @raises: ResponseError if the upload has failed
+        @return: len(data)
+        """
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        self._raise_error()
+        if not isinstance(data, bytes):
+            data = memoryview(data).tobytes()
+        self._parts.append(data)
+        self._buffered += len(data)
+        self.size += len(data)
+        if self._buffered >= self.chunk_size:
+            buff = b''.join(self._parts)
+            end = len(buff) - len(buff) % self.chunk_size
+            for offset in range(0, end, self.chunk_size):
+                self._put(buff[offset:offset + self.chunk_size])
+            self._parts = [buff[end:]]
+            self._buffered = len(buff) - end
+        return len(data)
+
+    def close(self):
+        """ Uploads what is left and waits for the upload to complete
+
+        @raises: ResponseError
+        @return: StorageObject
+        """
+        if self.closed:
+            return self.obj
+        try:
+            self._direct = self._thread is None
+            if self._buffered:
+                self._put(b''.join(self._parts))
+            self._parts, self._buffered = [], 0
+            self._put(_CLOSE)
+            self._thread.join()
+            self._raise_error()
+        finally:
+            io.BufferedIOBase.close(self)
+        return self.obj
+
+    def abort(self):
+        """ Stops the upload without finishing it and deletes its segments.
+            The object is left as it was. """
+        if self.closed:
+            return
+        self._parts, self._buffered = [], 0
+        if self._thread is not None:
+            self._queue.put(_ABORT)
+            self._thread.join()
+        io.BufferedIOBase.close(self)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def __del__(self):
+        # io.IOBase.__del__ would close(), uploading a partial write
+        if hasattr(self, '_thread') and not self.closed:
+            self.abort()
+
+    def _put(self, item):
+        if self._thread is None:
+            self._thread = threading.Thread(target=deadline.bind(self._run))
+            self._thread.setDaemon(True)
+            self._thread.start()
+        self._queue.put(item)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            raise error[1], None, error[2]
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _ABORT:
+                if self._upload is not None:
+                    self._upload.abort()
+                self._discard_segments()
+                return
+            if self._error is not None:
+                # Failed; only waiting to be closed
+                if item is _CLOSE:
+                    return
+                continue
+            try:
+                if item is _CLOSE:
+                    self._finish()
+                else:
+                    self._send(item)
+            except Exception:
+                self._error = sys.exc_info()
+                if self._upload is not None:
+                    self._upload.abort()
+                    self._upload = None
+                self._discard_segments()
+            if item is _CLOSE:
+                return
+
+    def _send(self, chunk):
+        while chunk:
+            # A full part is only finished once more data comes, so that
+            # objects of exactly segment_size stay single segments
+            if self._part_size >= self.segment_size:
+                self._next_segment()
+            if self._upload is None:
+                self._start()
+            room = self.segment_size - self._part_size
+            piece, chunk = chunk[:room], chunk[room:]
+            self._upload.send(piece)
+            if self._checksum is not None:
+                self._checksum.update(piece)
+            self._part_size += len(piece)
+
+    def _start(self):
+        """ Starts uploading the object or its next segment """
+        if self._direct:
+            target = self.obj
+        else:
+            if self._index is None:
+                logger.debug("Uploading %s in segments", self.name)
+                self._prefix = self.obj._segment_prefix(self.segment_size)
+                self.obj.client.container(self.segment_container).create()
+                self._index = 0
+            target = self._segment(self._index)
+        # A single segment is copied to the object with its content type
+        self._upload = target.chunk_upload(
+            headers={'Content-Type': self._content_type})
+        self._checksum = md5() if self.check_md5 else None
+        self._part_size = 0
+
+    def _finish_upload(self):
+        upload, self._upload = self._upload, None
+        res = upload.finish()
+        if self._direct:
+            self.obj.client.invalidate([self.obj.container, self.obj.name])
+        else:
+            self._segments.append(self._segment(self._index))
+        if self._checksum is not None:
+            assert self._checksum.hexdigest() == res.headers['etag'], \
+                'md5 hashes do not match'
+        return res
+
+    def _next_segment(self):
+        self._finish_upload()
+        self._index += 1
+
+    def _segment(self, index):
+        return self.obj.client.storage_object(
+            self.segment_container, '%s%08d' % (self._prefix, index))
+
+    def _finish(self):
+        if self._upload is None and self._index is None:
+            # Nothing was written
+            self._start()
+        res = self._finish_upload()
+        if self._direct:
+            self.obj._uploaded(res.headers, self.size)
+        elif self._index == 0:
+            self._segments[0].copy_to(self.obj)
+            self.obj._uploaded(res.headers, self.size)
+            self._discard_segments()
+        else:
+            self.obj._put_manifest(self.segment_container, self._prefix,
+                                   self.size, self._content_type)
+
+    def _discard_segments(self):
+        """ Deletes the segments uploaded so far """
+        segments, self._segments = self._segments, []
+        self.obj._delete_segments(segments)
@@ -0,0 +1,322 @@
+"""
+    Hedged requests
+
+    See COPYING for license information
+"""
+import collections
+import heapq
+import sys
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from object_storage import deadline
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+_HEDGE = object()
+
+
+class Timer(object):
+    """ Runs callbacks after a delay, all on one thread. The thread sleeps
+        until the next call is due, or until one that is due earlier is
+        added. """
+    def __init__(self):
+        self._pending = []
+        self._thread = None
+        self._cond = threading.Condition()
+        self._seq = 0
+        # When the thread wakes up next; None while nothing is pending, 0
+        # while it is awake
+        self._wake_at = 0
+
+    def call_later(self, delay, func, *args):
+        """ Calls func(*args) after delay seconds
+
+        @return: callable that cancels the call
+        """
+        self._cond.acquire()
+        try:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._seq += 1
+            entry = [time.time() + delay, self._seq, func, args]
+            heapq.heappush(self._pending, entry)
+            if self._wake_at is None or entry[0] < self._wake_at:
+                self._cond.notify()
+        finally:
+            self._cond.release()
+        return lambda: self._cancel(entry)
+
+    def _cancel(self, entry):
+        self._cond.acquire()
+        try:
+            # Cancelled entries are dropped once they come first
+            entry[2] = None
+            self._drop_cancelled()
+        finally:
+            self._cond.release()
+
+    def _drop_cancelled(self):
+        """ Must be called with the lock held """
+        while self._pending and self._pending[0][2] is None:
+            heapq.heappop(self._pending)
+
+    def _run(self):
+        self._cond.acquire()
+        try:
+            while True:
+                self._drop_cancelled()
+                if not self._pending:
+                    self._wake_at = None
+                    self._cond.wait()
+                    self._wake_at = 0
+                    continue
+                due = self._pending[0][0]
+                wait = due - time.time()
+                if wait > 0:
+                    self._wake_at = due
+                    self._cond.wait(wait)
+                    self._wake_at = 0
+                    continue
+                _, _, func, args = heapq.heappop(self._pending)
+                self._cond.release()
+                try:
+                    func(*args)
+                except Exception:
+                    logger.exception("Timer callback failed")
+                finally:
+                    self._cond.acquire()
+        finally:
+            self._cond.release()
+
+
+class Attempt(object):
+    """
+        One of the concurrent attempts of a hedged call. Transports register
+        a callback with on_cancel() that aborts the request, and call
+        finish() once it completed so that it is no longer aborted.
+    """
+    def __init__(self):
+        self.cancelled = False
+        self.finished = False
+        # Set by the hedging thread once the outcome was collected
+        self.done = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, callback):
+        self._lock.acquire()
+        try:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        callback()
+
+    def finish(self):
+        self._lock.acquire()
+        try:
+            self.finished = True
+            self._callbacks = []
+        finally:
+            self._lock.release()
+
+    def cancel(self):
+        self._lock.acquire()
+        try:
+            if self.cancelled or self.finished:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.debug("Could not cancel attempt", exc_info=True)
+        finally:
+            self._lock.release()
+
+
+class HedgePolicy(object):
+    """
+        Sends a second copy of a slow read and uses whichever response comes
+        back first.
+
+        The latency of recent calls is tracked per operation. Once a call
+        has taken longer than the given percentile of those, a duplicate is
+        started; the first successful response wins and the other attempt
+        is cancelled. Each operation earns `budget` hedges per call, so at
+        most budget * 100% extra requests are sent (plus a small burst).
+        A budget can be at most 1, where load is at most doubled.
+
+        Once an operation has enough samples, its attempts run on their own
+        threads, which costs a little for every call; hedging is meant for
+        latency-sensitive reads.
+
+        self.counts holds the number of calls, hedged calls and calls that
+        were won by the hedge.
+    """
+    def __init__(self, percentile=95, budget=0.1, budgets=None,
+                 min_delay=0.005, max_delay=2.0, min_samples=20, window=200,
+                 burst=10):
+        """ constructor for HedgePolicy
+
+        @param percentile: latency percentile after which a call is hedged
+        @param budget: hedges allowed per call of an operation
+        @param budgets: dict of budgets for specific operations, such as
+            'GET object' or 'GET container'
+        @param min_delay: minimum seconds to wait before hedging
+        @param max_delay: maximum seconds to wait before hedging
+        @param min_samples: calls of an operation observed before it is
+            hedged
+        @param window: number of recent latencies kept per operation
+        @param burst: max hedges that can be saved up
+        """
+        budgets = budgets or {}
+        for value in [budget] + budgets.values():
+            if not 0 <= value <= 1:
+                raise ValueError('Hedging budgets must be between 0 and 1')
+        self.percentile = percentile
+        self.budget = budget
+        self.budgets = budgets
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.burst = burst
+        self.counts = {'calls': 0, 'hedged': 0, 'hedge_wins': 0}
+        self._latencies = {}
+        self._recorded = {}
+        self._delays = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._timer = Timer()
+
+    def delay(self, operation):
+        """ Returns the seconds after which a call of operation is hedged,
+            or None while too few calls were observed """
+        return self._delays.get(operation)
+
+    def record(self, operation, seconds):
+        """ Records the latency of a completed call """
+        self._lock.acquire()
+        try:
+            latencies = self._latencies.get(operation)
+            if latencies is None:
+                latencies = self._latencies[operation] = collections.deque(
+                    maxlen=self.window)
+            latencies.append(seconds)
+            count = len(latencies)
+            recorded = self._recorded[operation] = \
+                self._recorded.get(operation, 0) + 1
+            # Sorting on every call would cost more than the hedging saves
+            if count >= self.min_samples and \
+                    (operation not in self._delays or recorded % 10 == 0):
+                ordered = sorted(latencies)
+                index = min(count - 1, int(count * self.percentile / 100.0))
+                self._delays[operation] = min(
+                    self.max_delay, max(self.min_delay, ordered[index]))
+        finally:
+            self._lock.release()
+
+    def call(self, func, operation):
+        """ Calls func(attempt), hedging it if it is slow
+
+        @param func: callable that makes the request. It is handed the
+            `Attempt` it runs as.
+        @param operation: name latencies and budgets are kept under
+        @return: result of the first attempt that succeeded
+        """
+        delay = self.delay(operation)
+        self._earn(operation)
+        if delay is None:
+            start = time.time()
+            result = func(Attempt())
+            self.record(operation, time.time() - start)
+            return result
+
+        # Waiting with a timeout polls on Python 2, which adds more latency
+        # than hedging saves; the timer thread posts _HEDGE instead.
+        func = deadline.bind(func)
+        outcomes = queue.Queue()
+        attempts = [self._start(func, outcomes)]
+        cancel_hedge = self._timer.call_later(delay, outcomes.put, _HEDGE)
+        error = None
+        try:
+            while True:
+                outcome = outcomes.get()
+                if outcome is _HEDGE:
+                    if len(attempts) == 1 and self._spend(operation):
+                        attempts.append(self._start(func, outcomes))
+                    continue
+                attempt, ok, value, elapsed = outcome
+                attempt.done = True
+                if ok:
+                    for other in attempts:
+                        if other is not attempt:
+                            other.cancel()
+                    self.record(operation, elapsed)
+                    if attempt is not attempts[0]:
+                        self._count('hedge_wins')
+                    return value
+                if error is None:
+                    error = value
+                if all(other.done for other in attempts):
+                    raise error[0], error[1], error[2]
+        finally:
+            cancel_hedge()
+
+    def _start(self, func, outcomes):
+        attempt = Attempt()
+
+        def _run():
+            start = time.time()
+            try:
+                outcome = (attempt, True, func(attempt))
+            except Exception:
+                outcome = (attempt, False, sys.exc_info())
+            outcomes.put(outcome + (time.time() - start,))
+
+        thread = threading.Thread(target=_run)
+        thread.setDaemon(True)
+        thread.start()
+        return attempt
+
+    def _earn(self, operation):
+        budget = self.budgets.get(operation, self.budget)
+        self._lock.acquire()
+        try:
+            self.counts['calls'] += 1
+            self._tokens[operation] = min(
+                self.burst, self._tokens.get(operation, 0) + budget)
+        finally:
+            self._lock.release()
+
+    def _spend(self, operation):
+        """ Takes a hedge from the budget of operation, if there is one """
+        self._lock.acquire()
+        try:
+            if self._tokens.get(operation, 0) < 1:
+                return False
+            self._tokens[operation] -= 1
+            self.counts['hedged'] += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def _count(self, key):
+        self._lock.acquire()
+        try:
+            self.counts[key] += 1
+        finally:
+            self._lock.release()
@@ -0,0 +1,179 @@
+"""
+    Retry policies
+
+    See COPYING for license information
+"""
+import email.utils
+import random
+import socket
+import threading
+import time
+
+from object_storage import deadline, errors
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Methods that can be sent again without changing the outcome
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+# Statuses that say the request may succeed when it is sent again. Status 0
+# is used for connections that were dropped before a response came in.
+RETRY_STATUSES = (0, 408, 429, 500, 502, 503, 504)
+# Statuses whose Retry-After header is honored
+RETRY_AFTER_STATUSES = (429, 503)
+
+
+def parse_retry_after(value, now=None):
+    """ Returns the seconds a Retry-After header asks to wait, or None
+
+    @param value: delay in seconds or an HTTP date
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, email.utils.mktime_tz(parsed) - now)
+
+
+class RetryPolicy(object):
+    """
+        Decides which failed requests are sent again and how long to wait
+        before doing so.
+
+        Dropped connections, timeouts and the statuses in RETRY_STATUSES are
+        retried for idempotent methods. Waits grow with decorrelated
+        jitter: each one is drawn between backoff and three times the
+        previous wait, capped at max_backoff, which spreads out clients
+        that failed at the same moment. A Retry-After header on a 429 or
+        503 is honored instead. No retry is started that would end past
+        the deadline, or past the `object_storage.deadline.Deadline` the
+        call runs under.
+
+        The policy keeps counts of what retrying cost in self.counts:
+        calls, retries, exhausted (calls that failed on a retryable error)
+        and backoff (seconds spent waiting). One policy can be shared by
+        many connections and threads.
+    """
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30,
+                 deadline=None, methods=IDEMPOTENT_METHODS,
+                 statuses=RETRY_STATUSES):
+        """ constructor for RetryPolicy
+
+        @param retries: max times a request is sent again
+        @param backoff: seconds to wait before the first retry
+        @param max_backoff: max seconds to wait between two attempts
+        @param deadline: max seconds from the first attempt until the last
+            one starts, or None
+        @param methods: methods that are retried
+        @param statuses: response statuses that are retried
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.methods = methods
+        self.statuses = statuses
+        self.counts = {'calls': 0, 'retries': 0, 'exhausted': 0,
+                       'backoff': 0.0}
+        self._lock = threading.Lock()
+
+    def is_retryable(self, exc):
+        """ Whether exc is a failure that may go away on another attempt """
+        if isinstance(exc, errors.DeadlineExceeded):
+            return False
+        if isinstance(exc, errors.ResponseError):
+            return exc.status in self.statuses
+        return isinstance(exc, socket.error)
+
+    def start(self, method=None, idempotent=None):
+        """ Starts tracking the attempts of one call
+
+        @param method: HTTP method of the request
+        @param idempotent: whether the call can safely be repeated. Defaults
+            to whether method is one of self.methods.
+        @return: `RetryState`
+        """
+        if idempotent is None:
+            idempotent = method is None or method.upper() in self.methods
+        self._count('calls')
+        return RetryState(self, idempotent)
+
+    def call(self, func, method=None, idempotent=None):
+        """ Calls func until it succeeds or the policy gives up
+
+        @param func: callable that makes the request
+        @param method: HTTP method of the request
+        @param idempotent: whether func can safely be called again
+        @return: what func returns
+        """
+        state = self.start(method, idempotent)
+        while True:
+            try:
+                return func()
+            except Exception, ex:
+                delay = state.next_delay(ex)
+                if delay is None:
+                    raise
+            self.sleep(delay)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def _count(self, key, value=1):
+        self._lock.acquire()
+        try:
+            self.counts[key] += value
+        finally:
+            self._lock.release()
+
+
+class RetryState(object):
+    """ The attempts of one call made under a `RetryPolicy` """
+    def __init__(self, policy, idempotent=True):
+        self.policy = policy
+        self.idempotent = idempotent
+        self.attempts = 1
+        self.started = time.time()
+        self._delay = policy.backoff
+
+    def next_delay(self, exc):
+        """ Returns the seconds to wait before retrying after exc, or None
+            if the call should fail with it """
+        policy = self.policy
+        if not self.idempotent or not policy.is_retryable(exc):
+            return None
+        if self.attempts > policy.retries:
+            policy._count('exhausted')
+            return None
+
+        self._delay = min(policy.max_backoff,
+                          random.uniform(policy.backoff, self._delay * 3))
+        delay = self._delay
+        if isinstance(exc, errors.ResponseError) and \
+                exc.status in RETRY_AFTER_STATUSES:
+            retry_after = parse_retry_after(exc.retry_after)
+            if retry_after is not None:
+                delay = retry_after
+
+        if policy.deadline is not None and \
+                time.time() + delay - self.started > policy.deadline:
+            policy._count('exhausted')
+            return None
+        left = deadline.remaining()
+        if left is not None and delay >= left:
+            policy._count('exhausted')
+            return None
+
+        self.attempts += 1
+        policy._count('retries')
+        policy._count('backoff', delay)
+        logger.debug("Retrying in %.2fs after %s (attempt %d)", delay, exc,
+                     self.attempts)
+        return delay
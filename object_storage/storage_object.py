@@ -4,9 +4,12 @@
     See COPYING for license information
 """
 from object_storage.utils import json, Model
+import io
 import mimetypes
 import os
 import logging
+import sys
+import time
 
 try:
     import StringIO
@@ -16,13 +19,78 @@ try:
     from hashlib import md5
 except ImportError:
     from md5 import md5
+try:
+    _file_types = (file,)
+except NameError:
+    _file_types = (io.BufferedReader, io.FileIO)
 
 from object_storage import errors
-from object_storage.utils import get_path
+from object_storage.fileio import ObjectReader, ObjectWriter
+from object_storage.utils import chain, get_path, imap_unordered, \
+    not_found_as, on_done
 
 logger = logging.getLogger(__name__)
 
 
+def md5_file(filename, chunk_size=1024 * 1024):
+    """ Returns the hex MD5 digest of a local file """
+    checksum = md5()
+    f = open(filename, 'rb')
+    try:
+        buff = f.read(chunk_size)
+        while buff:
+            checksum.update(buff)
+            buff = f.read(chunk_size)
+    finally:
+        f.close()
+    return checksum.hexdigest()
+
+
+class FileSegment(object):
+    """ File-like view of `length` bytes of a file, starting at `offset`.
+        The file is opened on the first read. """
+    def __init__(self, filename, offset, length):
+        self.name = filename
+        self.offset = offset
+        self.length = length
+        self.remaining = length
+        self._file = None
+
+    def read(self, size=-1):
+        if self._file is None:
+            self._file = open(self.name, 'rb')
+            self._file.seek(self.offset)
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        buff = self._file.read(size)
+        self.remaining -= len(buff)
+        return buff
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return self.length
+
+
+class ChecksumReader(object):
+    """ File-like wrapper that counts what is read from a file and, given
+        a checksum, adds it to that too """
+    def __init__(self, f, checksum=None):
+        self.file = f
+        self.checksum = checksum
+        self.size = 0
+
+    def read(self, size=-1):
+        buff = self.file.read(size)
+        if self.checksum is not None:
+            self.checksum.update(buff)
+        self.size += len(buff)
+        return buff
+
+
 class StorageObjectModel(Model):
     def __init__(self, controller, container, name, headers={}):
         self.container = container
@@ -47,7 +115,8 @@ class StorageObjectModel(Model):
                                         self.headers.get('last-modified'))
         _properties['hash'] = (self.headers.get('etag') or
                                self.headers.get('hash'))
-        _properties['manifest'] = self.headers.get('manifest')
+        _properties['manifest'] = (self.headers.get('x-object-manifest') or
+                                   self.headers.get('manifest'))
         _properties['content_encoding'] = (
             self.headers.get('content_encoding') or
             self.headers.get('content-encoding'))
@@ -71,11 +140,116 @@ class StorageObjectModel(Model):
         self.data = self.properties
 
 
+class StorageObjectEntry(object):
+    """
+        Lightweight representation of a row of a container listing.
+
+        Only the fields a listing returns are stored. The url, path and
+        properties are derived when asked for, and any other attribute
+        upgrades the entry to a full StorageObject (see get_object()).
+    """
+    __slots__ = ('container', 'name', 'bytes', 'hash', 'content_type',
+                 'last_modified', 'client', '_object')
+
+    def __init__(self, container, name, bytes=0, hash=None,
+                 content_type=None, last_modified=None, client=None):
+        """ constructor for StorageObjectEntry
+
+        @param container: container name
+        @param name: object name
+        @param bytes: size of the object
+        @param hash: ETag of the object
+        @param content_type: content type of the object
+        @param last_modified: last modified date from the listing
+        @param client: `object_storage.client` instance.
+        """
+        self.container = container
+        self.name = name
+        self.bytes = bytes
+        self.hash = hash
+        self.content_type = content_type
+        self.last_modified = last_modified
+        self.client = client
+        self._object = None
+
+    @classmethod
+    def from_listing(cls, container, item, client=None):
+        """ Creates an entry from an item of a JSON container listing """
+        return cls(container, item['name'],
+                   bytes=int(item.get('bytes') or 0),
+                   hash=item.get('hash'),
+                   content_type=item.get('content_type'),
+                   last_modified=item.get('last_modified'),
+                   client=client)
+
+    @property
+    def size(self):
+        return self.bytes
+
+    @property
+    def path(self):
+        """ Get the path of the object """
+        return get_path([self.container, self.name])
+
+    @property
+    def url(self):
+        """ Get the URL of the object """
+        return self.client.get_url([self.container, self.name])
+
+    @property
+    def properties(self):
+        """ Returns the listing fields in the same form as
+            StorageObject.properties. Metadata needs a full object. """
+        return {'container': self.container,
+                'name': self.name,
+                'size': self.bytes,
+                'hash': self.hash,
+                'content_type': self.content_type,
+                'last_modified': self.last_modified,
+                'path': self.path,
+                'url': self.url}
+    props = properties
+
+    def is_dir(self):
+        """ returns True if content_type is 'text/directory' or
+            'application/directory' """
+        return self.content_type in ['text/directory',
+                                     'application/directory']
+
+    def get_object(self):
+        """ Returns (and keeps) a full StorageObject for this entry """
+        if self._object is None:
+            headers = {'bytes': self.bytes,
+                       'hash': self.hash,
+                       'content_type': self.content_type,
+                       'last_modified': self.last_modified}
+            self._object = self.client.storage_object(
+                self.container, self.name, headers=headers)
+        return self._object
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get_object(), name)
+
+    def __len__(self):
+        return self.bytes
+
+    def __str__(self):
+        return 'StorageObject(%s, %s, %sB)' % (self.container.encode("utf-8"),
+                                               self.name.encode("utf-8"),
+                                               self.bytes)
+    __repr__ = __str__
+
+
 class StorageObject:
     """
         Representation of a Object Storage object.
     """
     chunk_size = 10 * 1024
+    upload_chunk_size = 64 * 1024
+    range_size = 8 * 1024 * 1024
+    segment_size = 256 * 1024 * 1024
 
     def __init__(self, container, name, headers=None, client=None):
         """ constructor for StorageObject
@@ -105,7 +279,8 @@ class StorageObject:
                 self, self.container, self.name, res.headers)
             return True
         try:
-            return self.make_request('HEAD', formatter=_formatter)
+            return not_found_as(
+                self.make_request('HEAD', formatter=_formatter), False)
         except errors.NotFound:
             return False
 
@@ -244,13 +419,26 @@ class StorageObject:
             return self
         return self.make_request('PUT', headers=headers, formatter=_formatter)
 
-    def delete(self, recursive=False):
+    def delete(self, recursive=False, **kwargs):
         """ Delete object
 
+        @param recursive: also delete every object below this one in the
+            pseudo-hierarchy (name + delimiter + ...)
+        @param **kwargs: options for `object_storage.bulk.BulkDeleter`,
+            used for recursive deletes
         @raises ResponseError
         @return: True
         """
-        return self.client.delete_object(self.container, self.name)
+        if recursive:
+            prefix = self.name + self.client.delimiter
+            self.client.container(self.container).delete_all_objects(
+                prefix=prefix, **kwargs)
+        try:
+            return self.client.delete_object(self.container, self.name)
+        except errors.NotFound:
+            if not recursive:
+                raise
+            return True
 
     def read(self, size=None, offset=None, headers=None):
         """ Reads object content
@@ -261,7 +449,7 @@ class StorageObject:
         @return: str, data
         """
         headers = headers or {}
-        if all([offset, size]):
+        if offset is not None and size:
             end = (offset + size) - 1
             headers['Range'] = 'bytes=%s-%s' % (offset, end)
         elif offset is None and size is not None and size < 0:
@@ -276,20 +464,60 @@ class StorageObject:
             return res.content
         return self.make_request('GET', headers=headers, formatter=_formatter)
 
-    def save_to_filename(self, filename):
+    def save_to_filename(self, filename, workers=1, range_size=None,
+                         check_md5=True):
         """ Reads object content into a file
 
         @param filename: filename
+        @param workers: number of ranged GETs to run in parallel. With the
+            default of 1 the object is streamed over a single connection.
+        @param range_size: size in bytes of each ranged GET.
+            If not defined uses self.range_size
+        @param check_md5: check if the hash of the downloaded file matches
+            the ETag (parallel downloads only)
         @raises ResponseError
         """
+        range_size = range_size or self.range_size
+        if workers > 1:
+            self.load()
+        if workers <= 1 or self.model['size'] <= range_size:
+            f = open(filename, 'wb')
+            conn = self.chunk_download()
+            try:
+                for data in conn:
+                    f.write(data)
+            finally:
+                f.close()
+            return
+
+        size = self.model['size']
         f = open(filename, 'wb')
-        conn = self.chunk_download()
         try:
-            for data in conn:
-                f.write(data)
+            f.truncate(size)
         finally:
             f.close()
 
+        def _download_range(offset):
+            length = min(range_size, size - offset)
+            data = self.read(size=length, offset=offset)
+            assert len(data) == length, 'short read at offset %s' % offset
+            f = open(filename, 'r+b')
+            try:
+                f.seek(offset)
+                f.write(data)
+            finally:
+                f.close()
+
+        for _ in imap_unordered(_download_range,
+                                xrange(0, size, range_size),
+                                workers=workers):
+            pass
+
+        # Manifest ETags are not an MD5 of the content
+        if check_md5 and not self.model['manifest']:
+            assert md5_file(filename) == self.model['hash'].strip('"'), \
+                'md5 hashes do not match'
+
     def chunk_download(self, chunk_size=None):
         """ Returns an iterator to read the object data.
 
@@ -304,6 +532,35 @@ class StorageObject:
     iter_content = chunk_download
     __iter__ = chunk_download
 
+    def open(self, mode='rb', readahead=256 * 1024, chunk_size=1024 * 1024,
+             segment_size=None, check_md5=True):
+        """ Opens the object as a file, either to read it with seeks or to
+            upload what is written to it
+
+        @param mode: 'rb' or 'wb'
+        @param readahead: bytes read from the server at once; smaller reads
+            are served from the buffer
+        @param chunk_size: bytes sent to the server at once when writing
+        @param segment_size: size after which a written object is uploaded
+            as a segmented object. If not defined uses self.segment_size
+        @param check_md5: check if hash of each upload matches
+        @return: io.BufferedReader over an `object_storage.fileio.ObjectReader`
+            for 'rb' and an `object_storage.fileio.ObjectWriter` for 'wb'
+        @raises: NotImplementedError with the twisted and asyncio transports
+        """
+        if getattr(self.client.conn, 'asynchronous', False) is True:
+            # File objects read and write synchronously
+            raise NotImplementedError(
+                "open() needs a blocking connection; use read() or send()")
+        if mode == 'rb':
+            return io.BufferedReader(ObjectReader(self, readahead=readahead),
+                                     buffer_size=readahead)
+        if mode == 'wb':
+            return ObjectWriter(self, chunk_size=chunk_size,
+                                segment_size=segment_size,
+                                check_md5=check_md5)
+        raise ValueError("Unsupported mode %r" % (mode,))
+
     def chunk_upload(self, size=None, headers=None):
         """ Returns a chunkable upload instance.
             This is needed for transient data uploads
@@ -324,10 +581,11 @@ class StorageObject:
         @param data: either a file-like object or a string.
         @param check_md5: check if hash of uploaded file matches
         @raises: ResponseError
-        @return: StorageObject, self
+        @return: StorageObject, self; a Deferred or a Future for it with the
+            twisted and asyncio transports
         """
         size = None
-        if isinstance(data, file):
+        if isinstance(data, _file_types):
             try:
                 data.flush()
             except IOError:
@@ -337,48 +595,203 @@ class StorageObject:
             if hasattr(data, '__len__'):
                 size = len(data)
 
-        if isinstance(data, basestring):
+        if isinstance(data, bytes):
+            data = io.BytesIO(data)
+        elif isinstance(data, basestring):
             data = StringIO.StringIO(data)
 
         headers = {}
-        content_type = self.content_type
-        if not content_type:
-            _type = None
-            if hasattr(data, 'name'):
-                _type = mimetypes.guess_type(data.name)[0]
-            content_type = (_type or
-                            mimetypes.guess_type(self.name)[0] or
-                            'application/octet-stream')
+        content_type = self._guess_content_type(data)
         headers['Content-Type'] = content_type
 
-        checksum = md5()
-        transfered = 0
+        reader = ChecksumReader(data, md5() if check_md5 else None)
         conn = self.chunk_upload(size=size, headers=headers)
-        buff = data.read(4096)
-        while len(buff) > 0:
-            conn.send(buff)
-            if check_md5:
-                checksum.update(buff)
-            transfered += len(buff)
-            buff = data.read(4096)
-        res = conn.finish()
-
-        if check_md5:
-            assert checksum.hexdigest() == res.headers['etag'], \
+        if hasattr(conn, 'send_file'):
+            # Twisted and asyncio uploads read the data as fast as the
+            # connection takes it and return a Deferred or a Future
+            sent = chain(conn.send_file(reader,
+                                        chunk_size=self.upload_chunk_size),
+                         lambda _: conn.finish(), conn.abort)
+            return chain(sent, lambda res: self._sent(res, reader))
+        try:
+            buff = reader.read(self.upload_chunk_size)
+            while len(buff) > 0:
+                conn.send(buff)
+                buff = reader.read(self.upload_chunk_size)
+            res = conn.finish()
+        except Exception:
+            # Hands the connection back; a no-op once it has been released
+            conn.abort()
+            raise
+        return self._sent(res, reader)
+
+    def _sent(self, res, reader):
+        """ Checks the response to send() and updates the model """
+        self.client.invalidate([self.container, self.name])
+
+        if reader.checksum is not None:
+            assert reader.checksum.hexdigest() == res.headers['etag'], \
                 'md5 hashes do not match'
-        res.headers['content-length'] = transfered
-        self.model = StorageObjectModel(
-            self, self.container, self.name, res.headers)
-        headers['Content-Type'] = content_type
+        self._uploaded(res.headers, reader.size)
         return self
 
+    def _uploaded(self, headers, size):
+        """ Updates the model from the response to an upload """
+        headers['content-length'] = size
+        self.model = StorageObjectModel(
+            self, self.container, self.name, headers)
+
     write = send
 
-    def upload_directory(self, directory):
+    def send_segmented(self, data, segment_size=None, workers=4,
+                       segment_container=None, check_md5=True):
+        """ Uploads object data as a segmented object
+
+        The data is split into segments which are uploaded in parallel to
+        the segment container. The manifest object is written last. Files
+        are read in place; other streams are read one segment at a time, so
+        up to workers + 2 segments are held in memory.
+
+        @param data: either a file-like object or a string.
+        @param segment_size: size of each segment in bytes.
+            If not defined uses self.segment_size
+        @param workers: number of segments to upload in parallel
+        @param segment_container: container the segments are uploaded to.
+            Defaults to '<container>_segments'
+        @param check_md5: check if hash of each uploaded segment matches
+        @raises: ResponseError
+        @return: StorageObject, self
+        """
+        segment_size = segment_size or self.segment_size
+        segment_container = (segment_container or
+                             '%s_segments' % (self.container, ))
+        content_type = self._guess_content_type(data)
+
+        backlog = None
+        if isinstance(data, file) and os.path.isfile(data.name):
+            data.flush()
+            size = int(os.fstat(data.fileno())[6])
+            segments = self._file_segments(data.name, size, segment_size)
+        else:
+            if isinstance(data, basestring):
+                data = StringIO.StringIO(data)
+            segments = self._stream_segments(data, segment_size)
+            backlog = 1
+
+        prefix = self._segment_prefix(segment_size)
+        self.client.container(segment_container).create()
+        uploaded = []
+
+        def _upload_segment(segment):
+            index, reader = segment
+            obj = self.client.storage_object(segment_container,
+                                             '%s%08d' % (prefix, index))
+            obj.content_type = 'application/octet-stream'
+            try:
+                obj.send(reader, check_md5=check_md5)
+            except AssertionError:
+                # Stored, but not as it was sent
+                uploaded.append(obj)
+                raise
+            finally:
+                reader.close()
+            uploaded.append(obj)
+            return obj.model['size']
+
+        transfered = 0
+        try:
+            for length in imap_unordered(_upload_segment, segments,
+                                         workers=workers, backlog=backlog):
+                transfered += length
+        except Exception:
+            error = sys.exc_info()
+            self._delete_segments(uploaded)
+            raise error[0], error[1], error[2]
+        return self._put_manifest(segment_container, prefix, transfered,
+                                  content_type)
+
+    def _delete_segments(self, segments):
+        """ Deletes the segments of an upload that did not complete, as
+            well as possible """
+        for segment in segments:
+            try:
+                segment.delete()
+            except Exception, ex:
+                logger.warning("Could not delete segment %s: %s",
+                               segment.name, ex)
+
+    def _segment_prefix(self, segment_size):
+        """ Returns a new name prefix for the segments of this object """
+        return '%s/%.6f/%s/' % (self.name, time.time(), segment_size)
+
+    def _put_manifest(self, segment_container, prefix, size, content_type):
+        """ Writes the manifest of a segmented object
+
+        @param size: total size of the segments
+        @return: StorageObject, self
+        """
+        manifest = get_path([segment_container, prefix])
+        headers = {'X-Object-Manifest': manifest,
+                   'Content-Type': content_type,
+                   'Content-Length': '0'}
+
+        def _formatter(res):
+            headers = dict(res.headers)
+            headers.pop('etag', None)
+            headers['content-length'] = size
+            headers['content-type'] = content_type
+            headers['x-object-manifest'] = manifest
+            self.model = StorageObjectModel(
+                self, self.container, self.name, headers)
+            return self
+        return self.make_request('PUT', headers=headers, formatter=_formatter)
+
+    def _file_segments(self, filename, size, segment_size):
+        """ Yields (index, FileSegment) pairs covering a local file """
+        for index, offset in enumerate(xrange(0, size, segment_size)):
+            length = min(segment_size, size - offset)
+            yield index, FileSegment(filename, offset, length)
+
+    def _stream_segments(self, data, segment_size):
+        """ Reads a stream into (index, StringIO) segments """
+        index = 0
+        while True:
+            parts = []
+            remaining = segment_size
+            while remaining:
+                buff = data.read(min(remaining, self.upload_chunk_size))
+                if not buff:
+                    break
+                parts.append(buff)
+                remaining -= len(buff)
+            if not parts:
+                return
+            yield index, StringIO.StringIO(''.join(parts))
+            index += 1
+
+    def _guess_content_type(self, data):
+        """ Returns the content type to upload data with """
+        if self.content_type:
+            return self.content_type
+        _type = None
+        if hasattr(data, 'name'):
+            _type = mimetypes.guess_type(data.name)[0]
+        return (_type or
+                mimetypes.guess_type(self.name)[0] or
+                'application/octet-stream')
+
+    def upload_directory(self, directory, workers=4, skip_unchanged=False):
         """ Uploads an entire directory
 
+        Files are uploaded on a pool of `workers` threads, largest first,
+        and each one is only kept open while it is being sent.
+
         @param directory: path of the directory to upload
+        @param workers: number of concurrent uploads
+        @param skip_unchanged: skip files whose size and MD5 match the
+            listing of the container
         @raises: ResponseError
+        @return: dict with counts of uploaded and skipped files
         """
         directories = []
         files = []
@@ -386,16 +799,62 @@ class StorageObject:
             for _dir in dirnames:
                 directories.append(os.path.relpath(os.path.join(root, _dir)))
             for _file in filenames:
-                files.append(os.path.relpath(os.path.join(root, _file)))
-
-        for _dir in directories:
+                _file = os.path.relpath(os.path.join(root, _file))
+                files.append((os.path.getsize(_file), _file))
+        files.sort(reverse=True)
+
+        remote = {}
+        if skip_unchanged:
+            # Names are relative to the working directory, like the paths
+            prefix = os.path.relpath(directory)
+            if prefix == os.curdir:
+                prefix = None
+            else:
+                prefix = os.path.join(prefix, '')
+            listing = self.client.container(self.container).iter_objects(
+                prefix=prefix, lightweight=True)
+            for entry in listing:
+                remote[entry.name] = entry
+
+        def _create_dir(_dir):
+            if _dir in remote:
+                return 'skipped'
             obj = self.__class__(self.container, _dir, client=self.client)
             obj.content_type = 'application/directory'
             obj.create()
-
-        for _file in files:
+            return 'uploaded'
+
+        def _upload_file(item):
+            size, _file = item
+            entry = remote.get(_file)
+            if entry is not None and entry.bytes == size and \
+                    entry.hash == md5_file(_file):
+                return 'skipped'
             obj = self.__class__(self.container, _file, client=self.client)
             obj.load_from_filename(_file)
+            return 'uploaded'
+
+        counts = {'uploaded': 0, 'skipped': 0}
+        for result in imap_unordered(_create_dir, directories,
+                                     workers=workers):
+            counts[result] += 1
+        for result in imap_unordered(_upload_file, files, workers=workers):
+            counts[result] += 1
+        return counts
+
+    def download_directory(self, directory, **kwargs):
+        """ Downloads every object below this one in the pseudo-hierarchy
+            into a local directory. The inverse of upload_directory().
+
+        @param directory: local directory to download into
+        @param **kwargs: workers and skip_unchanged, see
+            `object_storage.container.Container.download_directory`
+        @raises: ResponseError
+        @return: dict with counts of downloaded and skipped objects
+        """
+        container = self.client.container(self.container)
+        return container.download_directory(
+            directory, prefix=self.name + self.client.delimiter, **kwargs)
 
     def load_from_filename(self, filename):
         """ Uploads a file from the local filename
@@ -404,12 +863,15 @@ class StorageObject:
         @raises: ResponseError, IOError
         """
         if os.path.isdir(filename):
-            self.upload_directory(filename)
-        else:
-            try:
-                _file = open(filename, 'rb')
-            finally:
-                return self.send(_file)
+            return self.upload_directory(filename)
+        _file = open(filename, 'rb')
+        try:
+            result = self.send(_file)
+        except Exception:
+            _file.close()
+            raise
+        # An asynchronous upload is still reading the file
+        return on_done(result, _file.close)
 
     def copy_from(self, old_obj, *args, **kwargs):
         """ Copies content from an existing object
@@ -0,0 +1,259 @@
+"""
+    Sync between a local directory and a container
+
+    See COPYING for license information
+"""
+import logging
+import os
+
+from object_storage import errors
+from object_storage.storage_object import md5_file
+from object_storage.utils import imap_unordered, json
+
+logger = logging.getLogger(__name__)
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+DELETE_REMOTE = 'delete remote'
+DELETE_LOCAL = 'delete local'
+
+
+class SyncState(object):
+    """
+        Size, mtime and MD5 of the local files as of the last sync.
+
+        Keeping these in a state file means the MD5 of a file is only
+        recomputed when its size or mtime changed.
+    """
+    def __init__(self, filename=None):
+        """ constructor for SyncState
+
+        @param filename: path of the JSON state file. Without one the state
+            only lives as long as this instance.
+        """
+        self.filename = filename
+        self.files = {}
+        if filename and os.path.exists(filename):
+            f = open(filename)
+            try:
+                self.files = json.load(f)
+            except ValueError:
+                logger.warning("Ignoring corrupt sync state %s", filename)
+            finally:
+                f.close()
+
+    def md5(self, path, key):
+        """ Returns the MD5 of a local file, reusing the stored one when the
+            size and mtime did not change """
+        stat = os.stat(path)
+        known = self.files.get(key)
+        if known and known['size'] == stat.st_size and \
+                known['mtime'] == stat.st_mtime:
+            return known['hash']
+        checksum = md5_file(path)
+        self.update(path, key, checksum)
+        return checksum
+
+    def update(self, path, key, checksum):
+        """ Records the MD5 of a local file """
+        stat = os.stat(path)
+        self.files[key] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                           'hash': checksum}
+
+    def remove(self, key):
+        self.files.pop(key, None)
+
+    def save(self):
+        """ Writes the state file, replacing the old one atomically """
+        if not self.filename:
+            return
+        tmp = self.filename + '.tmp'
+        f = open(tmp, 'w')
+        try:
+            json.dump(self.files, f)
+        finally:
+            f.close()
+        os.rename(tmp, self.filename)
+
+
+class SyncPlan(object):
+    """ The changes needed to make the destination match the source """
+    def __init__(self, direction):
+        self.direction = direction
+        self.new = []
+        self.changed = []
+        self.deleted = []
+
+    def __len__(self):
+        return len(self.new) + len(self.changed) + len(self.deleted)
+
+    def actions(self, delete=False):
+        """ Returns a list of (action, name) tuples. Deletions are only
+            included when delete is True. """
+        actions = [(self.direction, name)
+                   for name in self.new + self.changed]
+        if delete:
+            if self.direction == UPLOAD:
+                action = DELETE_REMOTE
+            else:
+                action = DELETE_LOCAL
+            actions.extend((action, name) for name in self.deleted)
+        return actions
+
+    def __str__(self):
+        lines = []
+        for label, names in (('new', self.new), ('changed', self.changed),
+                             ('deleted', self.deleted)):
+            for name in names:
+                lines.append('%s %s: %s' % (self.direction, label, name))
+        return '\n'.join(lines)
+
+
+class Sync(object):
+    """
+        Mirrors a local directory and a container prefix in either direction.
+
+        The container listing is streamed and compared with the local tree
+        on size and MD5. The resulting plan is executed on a bounded pool
+        of workers.
+    """
+    def __init__(self, container, directory, prefix=None, state_file=None,
+                 workers=4):
+        """ constructor for Sync
+
+        @param container: `object_storage.container.Container` instance
+        @param directory: local directory
+        @param prefix: object name prefix the directory maps to
+        @param state_file: path of the file that caches local MD5 sums
+            between runs
+        @param workers: number of concurrent transfers
+        """
+        self.container = container
+        self.directory = os.path.abspath(directory)
+        self.prefix = prefix or ''
+        self.delimiter = container.client.delimiter
+        self.state = SyncState(state_file)
+        self.workers = workers
+
+    def plan(self, direction=UPLOAD):
+        """ Computes the differences between the directory and the container
+
+        @param direction: UPLOAD to make the container match the directory,
+            DOWNLOAD for the reverse
+        @return: `SyncPlan`
+        """
+        if direction not in (UPLOAD, DOWNLOAD):
+            raise ValueError('Unknown sync direction: %s' % direction)
+        local = self._local_files()
+        remote = self._remote_objects()
+        if direction == UPLOAD:
+            source, destination = local, remote
+        else:
+            source, destination = remote, local
+        plan = SyncPlan(direction)
+        for name in sorted(set(local) | set(remote)):
+            if name not in destination:
+                plan.new.append(name)
+            elif name not in source:
+                plan.deleted.append(name)
+            elif not self._same(local[name], remote[name]):
+                plan.changed.append(name)
+        return plan
+
+    def run(self, direction=UPLOAD, delete=False, dry_run=False):
+        """ Syncs the directory and the container
+
+        @param direction: UPLOAD or DOWNLOAD
+        @param delete: also delete what no longer exists on the source side
+        @param dry_run: only log what would be done
+        @raises: ResponseError
+        @return: the executed `SyncPlan`
+        """
+        plan = self.plan(direction)
+        if dry_run:
+            for action, name in plan.actions(delete):
+                logger.info("Would %s %s", action, name)
+            return plan
+        try:
+            for _ in imap_unordered(self._execute, plan.actions(delete),
+                                    workers=self.workers):
+                pass
+        finally:
+            self.state.save()
+        return plan
+
+    def _local_path(self, name):
+        parts = name[len(self.prefix):].split(self.delimiter)
+        return os.path.join(self.directory, *parts)
+
+    def _local_files(self):
+        """ Returns {object name: local path} for every local file """
+        files = {}
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if path.endswith('.part') or self._is_state_file(path):
+                    continue
+                rel = os.path.relpath(path, self.directory)
+                files[self.prefix + rel.replace(os.sep, self.delimiter)] = path
+        return files
+
+    def _is_state_file(self, path):
+        filename = self.state.filename
+        return filename is not None and \
+            os.path.abspath(path) in (os.path.abspath(filename),
+                                      os.path.abspath(filename) + '.tmp')
+
+    def _remote_objects(self):
+        """ Returns {object name: listing entry} for every remote object """
+        objects = {}
+        for entry in self.container.iter_objects(prefix=self.prefix,
+                                                 lightweight=True):
+            if entry.is_dir():
+                continue
+            path = os.path.abspath(self._local_path(entry.name))
+            if not path.startswith(self.directory + os.sep):
+                logger.warning("Not syncing %s, it maps outside of %s",
+                               entry.name, self.directory)
+                continue
+            objects[entry.name] = entry
+        return objects
+
+    def _same(self, path, entry):
+        if os.path.getsize(path) != entry.bytes:
+            return False
+        return self.state.md5(path, self._key(path)) == entry.hash
+
+    def _key(self, path):
+        return os.path.relpath(path, self.directory)
+
+    def _execute(self, action):
+        action, name = action
+        path = self._local_path(name)
+        if action == UPLOAD:
+            obj = self.container.storage_object(name)
+            obj.load_from_filename(path)
+            self.state.update(path, self._key(path), obj.model['hash'])
+        elif action == DOWNLOAD:
+            parent = os.path.dirname(path)
+            if not os.path.isdir(parent):
+                try:
+                    os.makedirs(parent)
+                except OSError:
+                    # Another worker created it first
+                    if not os.path.isdir(parent):
+                        raise
+            obj = self.container.storage_object(name)
+            obj.save_to_filename(path + '.part')
+            os.rename(path + '.part', path)
+            self.state.update(path, self._key(path), md5_file(path))
+        elif action == DELETE_REMOTE:
+            try:
+                self.container.delete_object(name)
+            except errors.NotFound:
+                pass
+        elif action == DELETE_LOCAL:
+            if os.path.exists(path):
+                os.remove(path)
+            self.state.remove(self._key(path))
+        return action, name
@@ -0,0 +1,206 @@
+"""
+    Auth token caches
+
+    Tokens are cached by auth URL and username, so clients and processes
+    that use the same account can share one token instead of each
+    authenticating on its own. Only one of them refreshes an expired or
+    rejected token while the others wait for the result.
+
+    See COPYING for license information
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from object_storage.utils import json
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TokenCache(object):
+    """
+        Token cache shared by the threads of one process. Caches shared
+        more widely override get(), set() and lock().
+
+        Entries are dicts with the auth_token, the storage_url and the
+        time the token expires at.
+    """
+    def __init__(self, ttl=3600):
+        """ constructor for TokenCache
+
+        @param ttl: seconds a cached token is used for
+        """
+        self.ttl = ttl
+        self._entries = {}
+        self._locks = {}
+        self._mutex = threading.Lock()
+
+    def get(self, key):
+        """ Returns the entry for key or None """
+        return self._entries.get(key)
+
+    def set(self, key, entry):
+        """ Stores the entry for key """
+        self._entries[key] = entry
+
+    def lock(self, key):
+        """ Returns a lock with acquire() and release() that is held while
+            the token for key is refreshed """
+        self._mutex.acquire()
+        try:
+            return self._locks.setdefault(key, threading.Lock())
+        finally:
+            self._mutex.release()
+
+    def key(self, auth):
+        return '%s %s' % (auth.auth_url, auth.username)
+
+    def lookup(self, auth):
+        """ Sets the token and storage URL of auth from the cache
+
+        A cached token that equals the current token of auth is ignored;
+        auth only asks again once that token was rejected.
+
+        @param auth: Authentication instance
+        @return: True if a valid token was found
+        """
+        entry = self.get(self.key(auth))
+        if entry is None or entry['expires'] <= time.time() or \
+                entry['auth_token'] == auth.auth_token:
+            return False
+        auth.auth_token = entry['auth_token']
+        auth.storage_url = entry['storage_url']
+        return True
+
+    def store(self, auth):
+        """ Caches the current token and storage URL of auth """
+        self.set(self.key(auth), {'auth_token': auth.auth_token,
+                                  'storage_url': auth.storage_url,
+                                  'expires': time.time() + self.ttl})
+
+    def authenticate(self, auth, fetch):
+        """ Uses a cached token, or refreshes it while holding the lock
+
+        Callers that wait on the lock pick up the token the holder stored
+        instead of authenticating again.
+
+        @param auth: Authentication instance
+        @param fetch: callable that authenticates against the auth endpoint
+            and sets the token and storage URL of auth
+        """
+        if self.lookup(auth):
+            return
+        lock = self.lock(self.key(auth))
+        lock.acquire()
+        try:
+            if self.lookup(auth):
+                return
+            fetch()
+            self.store(auth)
+        finally:
+            lock.release()
+
+
+class MemoryTokenCache(TokenCache):
+    """ Token cache shared by the threads of one process; the behaviour
+        of TokenCache itself, under a name that says so """
+
+
+class FileLock(object):
+    """
+        Exclusive lock on a file, held with flock(). Separate instances
+        exclude each other, within a process as well as across processes.
+        Where fcntl is not available it only excludes threads.
+    """
+    _fallback = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = None
+
+    def acquire(self):
+        if fcntl is None:
+            self._fallback.acquire()
+            return
+        f = open(self.filename, 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        except Exception:
+            f.close()
+            raise
+        self._file = f
+
+    def release(self):
+        if fcntl is None:
+            self._fallback.release()
+            return
+        f, self._file = self._file, None
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        finally:
+            f.close()
+
+
+class FileTokenCache(TokenCache):
+    """
+        Token cache in a directory, shared by every process of the user.
+
+        Each account gets a JSON file, replaced atomically on update and
+        only readable by the owner, next to the lock file refreshes are
+        serialized on.
+    """
+    def __init__(self, directory=None, ttl=3600):
+        """ constructor for FileTokenCache
+
+        @param directory: where tokens are kept. Defaults to
+            ~/.object_storage/tokens
+        @param ttl: seconds a cached token is used for
+        """
+        super(FileTokenCache, self).__init__(ttl=ttl)
+        self.directory = directory or os.path.join(
+            os.path.expanduser('~'), '.object_storage', 'tokens')
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory, 0700)
+            except OSError:
+                # Another process created it first
+                if not os.path.isdir(self.directory):
+                    raise
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def get(self, key):
+        try:
+            f = open(self._path(key))
+        except IOError:
+            return None
+        try:
+            try:
+                return json.load(f)
+            except ValueError:
+                logger.warning("Ignoring corrupt token cache %s", f.name)
+                return None
+        finally:
+            f.close()
+
+    def set(self, key, entry):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(entry, f)
+        finally:
+            f.close()
+        os.rename(tmp, self._path(key))
+
+    def lock(self, key):
+        return FileLock(self._path(key) + '.lock')
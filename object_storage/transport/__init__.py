@@ -4,14 +4,26 @@
     See COPYING for license information
 """
 import httplib
+import select
+import socket
+import threading
+import time
 from socket import timeout
 from urlparse import urlparse
 
+import urllib
 import urllib2
-import re
 
-from object_storage.errors import ResponseError, NotFound
-from object_storage import consts
+from object_storage.errors import ResponseError, NotFound, TimeoutError
+from object_storage import consts, deadline
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a connection to be opened
+CONNECT_TIMEOUT = 10
+# Seconds to wait for the server to send (or accept) more data
+READ_TIMEOUT = 60
 
 
 class Response(object):
@@ -25,48 +37,327 @@ class Response(object):
     def raise_for_status(self):
         if self.status_code == 404:
             raise NotFound(self.status_code, "Not Found")
+        retry_after = self.headers.get('retry-after')
         if (self.status_code >= 300) and (self.status_code < 400):
             raise ResponseError(self.status_code,
                                 '%s Redirection' % self.status_code)
         elif (self.status_code >= 400) and (self.status_code < 500):
             raise ResponseError(self.status_code,
-                                '%s Client Error' % self.status_code)
+                                '%s Client Error' % self.status_code,
+                                retry_after=retry_after)
         elif (self.status_code >= 500) and (self.status_code < 600):
             raise ResponseError(self.status_code,
-                                '%s Server Error' % self.status_code)
+                                '%s Server Error' % self.status_code,
+                                retry_after=retry_after)
+
+
+def requote_path(path):
+    """ Quotes every segment of a URL path exactly once """
+    parts = path.split('/')
+    parts = (urllib.quote(urllib.unquote(part), safe='') for part in parts)
+    return '/'.join(parts)
+
+
+def connection_key(url):
+    """ Returns the (scheme, netloc) pair connections to url are pooled by """
+    scheme, netloc = urlparse(url)[:2]
+    return scheme.lower(), netloc.lower()
+
+
+def abort_connection(conn):
+    """ Shuts down the socket of a connection that is in use by another
+        thread, so that its blocked reads and writes fail right away """
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        pass
+
+
+def timeout_error(ex=None):
+    """ Returns the error to raise for a request that timed out. It is a
+        DeadlineExceeded once the current deadline has passed. """
+    active = deadline.current()
+    if active is not None and active.expired():
+        return active.error()
+    return TimeoutError(str(ex or '') or 'timed out')
+
+
+def default_connection_factory(scheme, netloc):
+    """ Opens a new httplib connection for the given scheme and netloc """
+    if scheme == 'https':
+        return httplib.HTTPSConnection(netloc)
+    return httplib.HTTPConnection(netloc)
+
+
+def is_connection_dropped(conn):
+    """ Checks whether the server closed an idle connection. An idle socket
+        is only readable once the peer has hung up. """
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return False
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (select.error, ValueError):
+        return True
+
+
+class ConnectionPool(object):
+    """
+        Thread-safe pool of persistent HTTP connections.
+
+        Connections are kept per (scheme, netloc) and each one is handed out
+        to a single caller at a time. No more than `maxsize` connections are
+        open to one host; get() blocks until one is checked back in when the
+        limit is reached. Connections that sat idle for longer than
+        `idle_timeout` seconds are closed instead of being reused.
+    """
+    def __init__(self, maxsize=10, idle_timeout=60, factory=None):
+        """ constructor for ConnectionPool
+
+        @param maxsize: max number of open connections per host
+        @param idle_timeout: seconds an idle connection is kept around
+        @param factory: callable(scheme, netloc) that opens a connection
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.factory = factory or default_connection_factory
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._open = {}
+
+    def get(self, url):
+        """ Checks out a connection for the host of url. Returns a pooled
+            idle connection if there is one, otherwise opens a new one. """
+        key = connection_key(url)
+        self._cond.acquire()
+        try:
+            while True:
+                self._evict_idle(key)
+                idle = self._idle.get(key)
+                if idle:
+                    conn = idle.pop()[1]
+                    if is_connection_dropped(conn):
+                        conn.close()
+                    return conn
+                if self._open.get(key, 0) < self.maxsize:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                self._cond.wait()
+        finally:
+            self._cond.release()
+
+        try:
+            return self.factory(*key)
+        except Exception:
+            self._release_slot(key)
+            raise
+
+    def put(self, url, conn, reusable=True):
+        """ Checks a connection back in. Connections that are not reusable
+            are closed and free up their slot. """
+        key = connection_key(url)
+        if not reusable:
+            conn.close()
+            self._release_slot(key)
+            return
+        self._cond.acquire()
+        try:
+            self._idle.setdefault(key, []).append((time.time(), conn))
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def discard(self, url, conn):
+        """ Closes a checked out connection instead of returning it """
+        self.put(url, conn, reusable=False)
+
+    def clear(self):
+        """ Closes all idle connections """
+        self._cond.acquire()
+        try:
+            for key, idle in self._idle.items():
+                for _, conn in idle:
+                    conn.close()
+                self._open[key] -= len(idle)
+            self._idle = {}
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _evict_idle(self, key):
+        """ Closes connections for key that were idle for too long. Must be
+            called with the lock held. """
+        idle = self._idle.get(key)
+        if not idle or self.idle_timeout is None:
+            return
+        expires = time.time() - self.idle_timeout
+        while idle and idle[0][0] < expires:
+            idle.pop(0)[1].close()
+            self._open[key] -= 1
+
+    def _release_slot(self, key):
+        self._cond.acquire()
+        try:
+            self._open[key] -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
 
 
 class BaseAuthenticatedConnection:
+    pool = None
+    # Incremented on every new token, so that threads can tell whether the
+    # token their request was rejected with has been replaced already.
+    auth_generation = 0
+    # Seconds after which a token is replaced before it expires, or None
+    refresh_interval = None
+    # Seconds before a failed proactive refresh is tried again
+    refresh_retry = 30
+    _refresh_at = None
+    _auth_lock = None
+    # object_storage.retry.RetryPolicy for failed requests, or None
+    retry_policy = None
+    # object_storage.hedge.HedgePolicy for slow reads, or None
+    hedge_policy = None
+    connect_timeout = CONNECT_TIMEOUT
+    read_timeout = READ_TIMEOUT
+    # True where requests return a Deferred or a Future for their result
+    asynchronous = False
+
     def _authenticate(self):
         """ Do authentication and set token and storage_url """
         self.auth_headers = self.auth.auth_headers
         self.token = self.auth.auth_token
         self.storage_url = self.auth.storage_url
+        self.auth_generation += 1
+        if self.refresh_interval is not None:
+            self._refresh_at = time.time() + self.refresh_interval
+
+    def reauthenticate(self, generation):
+        """ Gets a new token after a request was rejected with a 401
+
+        Threads whose requests were rejected at the same time share one
+        refresh: the first one authenticates, the others wait for it and
+        then use its token.
+
+        @param generation: auth_generation the rejected request was sent with
+        """
+        self._auth_lock.acquire()
+        try:
+            if generation == self.auth_generation:
+                self.auth.authenticate()
+                self._authenticate()
+        finally:
+            self._auth_lock.release()
+
+    def _refresh_if_due(self):
+        """ Replaces the token once refresh_interval has passed, so that
+            requests do not run into its expiry. One thread refreshes while
+            the others carry on with the current token. """
+        if self._refresh_at is None or time.time() < self._refresh_at:
+            return
+        if not self._auth_lock.acquire(False):
+            return
+        try:
+            if time.time() < self._refresh_at:
+                return
+            try:
+                self.auth.authenticate()
+            except Exception:
+                logger.warning("Could not refresh the auth token",
+                               exc_info=True)
+                self._refresh_at = time.time() + self.refresh_retry
+                return
+            self._authenticate()
+        finally:
+            self._auth_lock.release()
+
+    def _call_with_retries(self, func, method, data=None):
+        """ Calls func according to retry_policy. Bodies that are read from
+            a file can only be sent once. """
+        if self.retry_policy is None:
+            return func()
+        idempotent = None
+        if hasattr(data, 'read'):
+            idempotent = False
+        return self.retry_policy.call(func, method=method,
+                                      idempotent=idempotent)
+
+    def _timeouts(self, timeout=None):
+        """ Returns the (connect, read) timeouts for a request, cut down to
+            the time left before the current deadline
+
+        @param timeout: seconds for both, or a (connect, read) tuple.
+            Defaults to connect_timeout and read_timeout.
+        @raises DeadlineExceeded: if the deadline has passed already
+        """
+        if timeout is None:
+            connect, read = self.connect_timeout, self.read_timeout
+        elif isinstance(timeout, tuple):
+            connect, read = timeout
+        else:
+            connect = read = timeout
+        return deadline.clamp(connect), deadline.clamp(read)
+
+    def _call_with_hedging(self, func, method, url):
+        """ Calls func(attempt). GET and HEAD requests are hedged according
+            to hedge_policy; attempt is None when they are not. """
+        if self.hedge_policy is None or method not in ('GET', 'HEAD'):
+            return func(None)
+        return self.hedge_policy.call(func, self._operation(method, url))
+
+    def _operation(self, method, url):
+        """ Names a request after its method and the kind of resource, such
+            as 'GET container' for a listing """
+        storage_url = self.storage_url or ''
+        if not url.startswith(storage_url):
+            return '%s other' % method
+        path = url[len(storage_url):].split('?')[0].strip('/')
+        if not path:
+            return '%s account' % method
+        if '/' not in path:
+            return '%s container' % method
+        return '%s object' % method
 
     def get_headers(self):
         """ Get default headers for this connection """
         return dict([('User-Agent', consts.USER_AGENT)] +
                     self.auth_headers.items())
 
-    def chunk_upload(self, method, url, size=None, headers=None):
+    def chunk_upload(self, method, url, size=None, headers=None,
+                     timeout=None):
         """ Returns new ChunkedConnection """
         headers = headers or {}
         headers.update(self.get_headers())
         return ChunkedUploadConnection(self, method, url, size=size,
-                                       headers=headers)
+                                       headers=headers,
+                                       timeouts=self._timeouts(timeout))
 
-    def chunk_download(self, url, chunk_size=10 * 1024):
+    def chunk_download(self, url, chunk_size=10 * 1024, timeout=None,
+                       headers=None):
         """ Returns new ChunkedConnection """
-        headers = self.get_headers()
+        headers = dict(headers or {}, **self.get_headers())
         req = urllib2.Request(url)
         for k, v in headers.iteritems():
             req.add_header(k, v)
-        r = urllib2.urlopen(req)
-        while True:
-            buff = r.read(chunk_size)
-            if not buff:
-                break
-            yield buff
+        # urllib2 has a single timeout for connecting and reading
+        read_timeout = self._timeouts(timeout)[1]
+        try:
+            r = urllib2.urlopen(req, timeout=read_timeout)
+            while True:
+                buff = r.read(chunk_size)
+                if not buff:
+                    break
+                yield buff
+        except socket.timeout, ex:
+            raise timeout_error(ex)
+        except urllib2.URLError, ex:
+            if isinstance(ex.reason, socket.timeout):
+                raise timeout_error(ex.reason)
+            raise
 
 
 class BaseAuthentication(object):
@@ -74,11 +365,16 @@ class BaseAuthentication(object):
         Base Authentication class. To be inherited if you want to create
         a new Authentication method. authenticate() should be overwritten.
     """
+    # Seconds to wait for the auth endpoint
+    timeout = READ_TIMEOUT
+
     def __init__(self, auth_url=None,
                  protocol='https',
                  datacenter='dal05',
-                 network='public'):
+                 network='public',
+                 token_cache=None):
         self.auth_url = auth_url
+        self.token_cache = token_cache
         self.protocol = protocol or 'https'
         self.datacenter = datacenter or 'dal05'
         self.network = network or 'public'
@@ -109,6 +405,18 @@ class BaseAuthentication(object):
     def auth_headers(self):
         return {'X-Auth-Token': 'AUTH_TOKEN'}
 
+    def _cached_authenticate(self, fetch):
+        """ Authenticates through the token cache, if there is one
+
+        @param fetch: callable that authenticates against the auth endpoint
+            and sets self.storage_url and self.auth_token
+        """
+        if self.token_cache is None:
+            fetch()
+        else:
+            self.token_cache.authenticate(self, fetch)
+        self.authenticated = True
+
     def authenticate(self):
         """
             Called when the client wants to authenticate. self.storage_url and
@@ -124,10 +432,19 @@ class ChunkedUploadConnection:
         Chunked Connection class.
         send_chunk() will send more data.
         finish() will end the request.
+
+        The connection is borrowed from the pool of the authenticated
+        connection when it has one and is handed back once finish() has read
+        the response. timeouts is a (connect, read) tuple of seconds; the
+        read timeout applies to every send and to the response.
     """
-    def __init__(self, conn, method, url, size=None, headers=None):
+    def __init__(self, conn, method, url, size=None, headers=None,
+                 timeouts=(None, None)):
         self.conn = conn
         self.method = method
+        self.url = url
+        self.timeouts = timeouts
+        self.pool = getattr(conn, 'pool', None)
         self.req = None
         self._chunked_encoding = True
         headers = headers or {}
@@ -142,45 +459,75 @@ class ChunkedUploadConnection:
             del headers['ETag']
 
         scheme, netloc, path, params, query, fragment = urlparse(url)
-        match = re.match('([a-zA-Z0-9\-\.]+):?([0-9]{2,5})?', netloc)
-
-        if match:
-            (host, port) = match.groups()
-        else:
-            ValueError('Invalid URL')
-
-        if not port:
-            if scheme == 'https':
-                port = 443
-            else:
-                port = 80
-
-        port = int(port)
+        if query:
+            path = '%s?%s' % (path, query)
 
-        if scheme == 'https':
-            self.req = httplib.HTTPSConnection(host, port)
-        else:
-            self.req = httplib.HTTPConnection(host, port)
+        reused = self._checkout()
         try:
-            self.req.putrequest('PUT', path)
-            for key, value in headers.iteritems():
-                self.req.putheader(key, value)
-            self.req.endheaders()
+            try:
+                self._putrequest(path, headers)
+            except Exception:
+                if not reused:
+                    raise
+                # Stale keep-alive connection; retry once on a new socket
+                self.req.close()
+                self._putrequest(path, headers)
+        except timeout, err:
+            self._release(reusable=False)
+            raise timeout_error(err)
         except Exception:
+            self._release(reusable=False)
             raise ResponseError(0, 'Disconnected')
 
+    def _putrequest(self, path, headers):
+        """ Sends the request line and headers """
+        connect_timeout, read_timeout = self.timeouts
+        if self.req.sock is None:
+            self.req.timeout = connect_timeout
+            self.req.connect()
+            # Headers and body go out in separate writes; without this a
+            # kept-alive socket stalls on delayed ACKs for every request.
+            self.req.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                     1)
+        self.req.sock.settimeout(read_timeout)
+        self.req.putrequest(self.method, path)
+        for key, value in headers.iteritems():
+            self.req.putheader(key, value)
+        self.req.endheaders()
+
+    def _checkout(self):
+        """ Gets a connection to send the request on. Returns True if it
+            is a kept-alive connection that was used before. """
+        if self.pool is None:
+            self.req = default_connection_factory(*connection_key(self.url))
+        else:
+            self.req = self.pool.get(self.url)
+        return self.req.sock is not None
+
+    def _release(self, reusable=True):
+        """ Returns the connection to the pool, or closes it """
+        if self.req is None:
+            return
+        if self.pool is None:
+            self.req.close()
+        else:
+            self.pool.put(self.url, self.req, reusable=reusable)
+        self.req = None
+
     def send(self, chunk):
         """ Sends a chunk of data. """
         try:
             if self._chunked_encoding:
-                self.req.send("%X\r\n" % len(chunk))
-                self.req.send(chunk)
-                self.req.send("\r\n")
+                # One write per chunk; with TCP_NODELAY the framing would
+                # otherwise go out in packets of its own
+                self.req.send("%X\r\n%s\r\n" % (len(chunk), chunk))
             else:
                 self.req.send(chunk)
         except timeout, err:
-            raise err
+            self._release(reusable=False)
+            raise timeout_error(err)
         except:
+            self._release(reusable=False)
             raise ResponseError(0, 'Disconnected')
 
     def finish(self):
@@ -188,13 +535,16 @@ class ChunkedUploadConnection:
         try:
             if self._chunked_encoding:
                 self.req.send("0\r\n\r\n")
+            res = self.req.getresponse()
+            content = res.read()
         except timeout, err:
-            raise err
+            self._release(reusable=False)
+            raise timeout_error(err)
         except:
+            self._release(reusable=False)
             raise ResponseError(0, 'Disconnected')
 
-        res = self.req.getresponse()
-        content = res.read()
+        self._release(reusable=not res.will_close)
 
         r = Response()
         r.status_code = res.status
@@ -204,6 +554,17 @@ class ChunkedUploadConnection:
         r.raise_for_status()
         return r
 
+    def abort(self):
+        """ Drops the request without finishing it, so that the server
+            discards what was sent """
+        self._release(reusable=False)
+
+    def __del__(self):
+        # An upload dropped without finish() or abort() would otherwise keep
+        # its slot in the pool checked out for good
+        if getattr(self, 'req', None) is not None:
+            self._release(reusable=False)
+
 
 class ChunkedDownloadConnection:
     def __init__(self, conn, method, url, headers=None):
@@ -0,0 +1,858 @@
+"""
+    asyncio connection type. Requires Python 3.7 or later.
+
+    Every request returns an asyncio Future (with the formatter already
+    applied), so client calls can be awaited and thousands of them can
+    share one event loop. Connections are kept alive and pooled per host.
+
+    See COPYING for license information
+"""
+import asyncio
+import logging
+import socket
+import urllib
+import urlparse
+
+from object_storage import errors
+from object_storage.transport import BaseAuthentication, \
+    BaseAuthenticatedConnection, Response, connection_key, requote_path, \
+    timeout_error, CONNECT_TIMEOUT, READ_TIMEOUT
+from object_storage.utils import json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def then(future, callback=None, errback=None, loop=None):
+    """ Returns a Future for callback(result) of future, or for
+        errback(exception) if it failed. Either may return another Future,
+        whose outcome is then used. """
+    loop = loop or future.get_loop()
+    result = loop.create_future()
+
+    def _done(f):
+        if result.done():
+            return
+        if f.cancelled():
+            return result.cancel()
+        exc = f.exception()
+        try:
+            if exc is None:
+                value = callback(f.result()) if callback else f.result()
+            elif errback:
+                value = errback(exc)
+            else:
+                return result.set_exception(exc)
+        except Exception as ex:
+            return result.set_exception(ex)
+        if asyncio.isfuture(value):
+            _chain(value, result)
+        else:
+            result.set_result(value)
+    future.add_done_callback(_done)
+    return result
+
+
+def _chain(source, target):
+    """ Gives target the outcome of source once it is done """
+    def _copy(f):
+        if target.done():
+            return
+        if f.cancelled():
+            target.cancel()
+        elif f.exception() is not None:
+            target.set_exception(f.exception())
+        else:
+            target.set_result(f.result())
+    source.add_done_callback(_copy)
+
+
+def _completed(loop, value=None, exception=None):
+    future = loop.create_future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(value)
+    return future
+
+
+def _observe(future):
+    """ Retrieves the outcome of a Future nobody waits on, so that asyncio
+        doesn't log its exception """
+    if not future.cancelled():
+        future.exception()
+
+
+class HTTPProtocol(asyncio.Protocol):
+    """
+        One keep-alive HTTP/1.1 client connection.
+
+        request() writes a request and returns a Future for the Response.
+        Response bodies are buffered in a list of chunks, or handed to a
+        consumer as they arrive. wait() fails the response when the server
+        stops sending.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.transport = None
+        self.closed = False
+        self.reusable = False
+        self.used = False
+        self._buffer = bytearray()
+        self._state = 'idle'
+        self._response = None
+        self._waiter = None
+        self._consumer = None
+        self._chunks = None
+        self._remaining = None
+        self._paused = False
+        self._drain_waiters = []
+        self._head = False
+        self._read_timeout = None
+        self._received = None
+        self._timer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except (OSError, socket.error):
+                pass
+
+    def request(self, method, path, headers, body=None, consumer=None):
+        """ Sends a request
+
+        @param method: HTTP method
+        @param path: path and query string
+        @param headers: dict of headers, including Host
+        @param body: bytes to send. With None the caller may stream the
+            body with write()
+        @param consumer: callable that is handed each chunk of the
+            response body instead of buffering it
+        @return: Future for the Response
+        """
+        self.used = True
+        self.reusable = False
+        self._waiter = self.loop.create_future()
+        if self.closed:
+            self._waiter.set_exception(
+                errors.ResponseError(0, 'Disconnected'))
+            return self._waiter
+        self._head = method.upper() == 'HEAD'
+        self._consumer = consumer
+        self._chunks = []
+        self._state = 'headers'
+        lines = ['%s %s HTTP/1.1' % (method, path)]
+        for key, value in headers.items():
+            lines.append('%s: %s' % (key, value))
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        if body:
+            data += body
+        self.transport.write(data)
+        return self._waiter
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def wait(self, read_timeout):
+        """ Fails the response of the current request with a TimeoutError
+            once the server sends nothing for read_timeout seconds. Call it
+            once the request, body included, has been written.
+
+        @param read_timeout: seconds, or None to wait forever
+        """
+        self._stop_timer()
+        self._read_timeout = read_timeout
+        self._received = self.loop.time()
+        if read_timeout and self._state != 'idle':
+            self._timer = self.loop.call_later(read_timeout,
+                                               self._check_timeout)
+
+    def _check_timeout(self):
+        self._timer = None
+        if self._state == 'idle':
+            return
+        # The timer is only moved when it goes off, not on every read
+        idle = self.loop.time() - self._received
+        if idle < self._read_timeout:
+            self._timer = self.loop.call_later(self._read_timeout - idle,
+                                               self._check_timeout)
+            return
+        self._fail(timeout_error('Read timed out after %s seconds'
+                                 % self._read_timeout))
+
+    def _stop_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def drain(self):
+        """ Returns a Future that fires once the write buffer has drained
+            below the transport's low watermark """
+        if self.closed:
+            return _completed(self.loop, exception=errors.ResponseError(
+                0, 'Disconnected'))
+        future = self.loop.create_future()
+        if self._paused:
+            self._drain_waiters.append(future)
+        else:
+            future.set_result(None)
+        return future
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+    def data_received(self, data):
+        self._received = self.loop.time()
+        self._buffer.extend(data)
+        try:
+            self._parse()
+        except Exception as ex:
+            self._fail(ex)
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.reusable = False
+        if self._state == 'body' and self._remaining is None:
+            # Body delimited by the end of the connection
+            self._finish()
+        elif self._state != 'idle':
+            self._fail(errors.ResponseError(0, 'Disconnected'))
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_exception(errors.ResponseError(0, 'Disconnected'))
+
+    def close(self):
+        self.closed = True
+        if self.transport is not None:
+            self.transport.close()
+
+    def _fail(self, exc):
+        self._stop_timer()
+        self._state = 'idle'
+        self.reusable = False
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_exception(exc)
+        self.close()
+
+    def _parse(self):
+        while self._buffer:
+            if self._state == 'headers':
+                if not self._parse_headers():
+                    return
+            elif self._state == 'body':
+                if not self._parse_body():
+                    return
+            elif self._state == 'chunk':
+                if not self._parse_chunk():
+                    return
+            else:
+                # Data nobody asked for; the connection can't be trusted
+                return self.close()
+
+    def _parse_headers(self):
+        end = self._buffer.find(b'\r\n\r\n')
+        if end < 0:
+            return False
+        head = bytes(self._buffer[:end]).decode('latin-1')
+        del self._buffer[:end + 4]
+        lines = head.split('\r\n')
+        status_line = lines[0].split(' ', 2)
+        version, status = status_line[0], int(status_line[1])
+        if 100 <= status < 200:
+            return True
+        r = self._response = Response()
+        r.status_code = status
+        r.version = version
+        r.phrase = len(status_line) > 2 and status_line[2] or ''
+        for line in lines[1:]:
+            key, _, value = line.partition(':')
+            r.headers[key.strip().lower()] = value.strip()
+
+        connection = r.headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            self.reusable = connection != 'close'
+        else:
+            self.reusable = connection == 'keep-alive'
+
+        if self._head or status in (204, 304):
+            self._remaining = 0
+        elif 'chunked' in r.headers.get('transfer-encoding', '').lower():
+            self._state = 'chunk'
+            self._remaining = 0
+            return True
+        elif 'content-length' in r.headers:
+            self._remaining = int(r.headers['content-length'])
+        else:
+            self._remaining = None
+            self.reusable = False
+        self._state = 'body'
+        if self._remaining == 0:
+            self._finish()
+        return True
+
+    def _parse_body(self):
+        if self._remaining is None:
+            data = bytes(self._buffer)
+            del self._buffer[:]
+            self._deliver(data)
+            return False
+        data = bytes(self._buffer[:self._remaining])
+        del self._buffer[:len(data)]
+        self._remaining -= len(data)
+        self._deliver(data)
+        if self._remaining == 0:
+            self._finish()
+        return True
+
+    def _parse_chunk(self):
+        if self._remaining > 0:
+            data = bytes(self._buffer[:self._remaining])
+            del self._buffer[:len(data)]
+            self._remaining -= len(data)
+            self._deliver(data)
+            if self._remaining > 0:
+                return False
+            # Chunk data is followed by CRLF
+            self._remaining = -2
+        if self._remaining == -2:
+            if len(self._buffer) < 2:
+                return False
+            del self._buffer[:2]
+            self._remaining = 0
+        end = self._buffer.find(b'\r\n')
+        if end < 0:
+            return False
+        size = int(bytes(self._buffer[:end]).split(b';')[0], 16)
+        if size == 0:
+            # Last chunk, followed by optional trailers and a blank line
+            trailer_end = self._buffer.find(b'\r\n\r\n', end)
+            if trailer_end < 0:
+                return False
+            del self._buffer[:trailer_end + 4]
+            self._finish()
+            return True
+        del self._buffer[:end + 2]
+        self._remaining = size
+        return True
+
+    def _deliver(self, data):
+        if not data:
+            return
+        if self._consumer is None:
+            self._chunks.append(data)
+        else:
+            self._consumer(data)
+
+    def _finish(self):
+        self._stop_timer()
+        self._state = 'idle'
+        r = self._response
+        if self._consumer is None:
+            r.content = b''.join(self._chunks)
+        self._chunks = None
+        self._consumer = None
+        if self._buffer:
+            self.reusable = False
+        if not self.reusable:
+            self.close()
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(r)
+
+
+class ConnectionPool(object):
+    """
+        Keep-alive connections per (scheme, netloc), at most maxsize open
+        at once per host. Callers waiting for a connection are served in
+        order as connections are returned.
+    """
+    def __init__(self, maxsize=10, idle_timeout=60, loop=None, ssl=None,
+                 connect_timeout=CONNECT_TIMEOUT):
+        """ constructor for ConnectionPool
+
+        @param maxsize: max number of connections per host
+        @param idle_timeout: seconds before an idle connection is closed
+        @param loop: event loop; defaults to the current one
+        @param ssl: SSLContext for https connections
+        @param connect_timeout: seconds to wait for a connection, or None
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._loop = loop
+        self.ssl = ssl
+        self._idle = {}
+        self._open = {}
+        self._waiting = {}
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        return self._loop
+
+    def get(self, url):
+        """ Returns a Future for a connection to the host of url """
+        key = connection_key(url)
+        idle = self._idle.setdefault(key, [])
+        while idle:
+            conn, handle = idle.pop()
+            handle.cancel()
+            if not conn.closed:
+                return _completed(self.loop, conn)
+            self._release_slot(key)
+        if self._open.get(key, 0) < self.maxsize:
+            return self._connect(key)
+        future = self.loop.create_future()
+        self._waiting.setdefault(key, []).append(future)
+        return future
+
+    def put(self, url, conn, reusable=True):
+        """ Returns a connection to the pool """
+        key = connection_key(url)
+        if not reusable or conn.closed:
+            conn.close()
+            self._release_slot(key)
+            return
+        waiting = self._waiting.get(key)
+        while waiting:
+            future = waiting.pop(0)
+            if not future.done():
+                return future.set_result(conn)
+        handle = self.loop.call_later(self.idle_timeout, self._expire, key,
+                                      conn)
+        self._idle.setdefault(key, []).append((conn, handle))
+
+    def discard(self, url, conn):
+        """ Closes a connection that can't be reused """
+        self.put(url, conn, reusable=False)
+
+    def clear(self):
+        """ Closes all idle connections """
+        for key, idle in self._idle.items():
+            while idle:
+                conn, handle = idle.pop()
+                handle.cancel()
+                conn.close()
+                self._release_slot(key)
+
+    def _expire(self, key, conn):
+        idle = self._idle.get(key, [])
+        for item in idle:
+            if item[0] is conn:
+                idle.remove(item)
+                conn.close()
+                self._release_slot(key)
+                return
+
+    def _release_slot(self, key):
+        self._open[key] = max(self._open.get(key, 0) - 1, 0)
+        waiting = self._waiting.get(key)
+        while waiting:
+            future = waiting.pop(0)
+            if not future.done():
+                return _chain(self._connect(key), future)
+
+    def _connect(self, key):
+        self._open[key] = self._open.get(key, 0) + 1
+        scheme, netloc = key
+        parsed = urlparse.urlparse('%s://%s' % key)
+        port = parsed.port or DEFAULT_PORTS.get(scheme, 80)
+        ssl = None
+        if scheme == 'https':
+            ssl = self.ssl or True
+        connecting = asyncio.ensure_future(asyncio.wait_for(
+            self.loop.create_connection(lambda: HTTPProtocol(self.loop),
+                                        parsed.hostname, port, ssl=ssl),
+            self.connect_timeout), loop=self.loop)
+
+        def _failed(exc):
+            self._release_slot(key)
+            if isinstance(exc, asyncio.TimeoutError):
+                raise timeout_error('Connecting to %s timed out' % netloc)
+            raise exc
+        return then(connecting, lambda result: result[1], _failed,
+                    loop=self.loop)
+
+
+def _full_url(url, params=None):
+    """ Quotes the path of url and appends the query parameters """
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    if not scheme:
+        raise ValueError("Invalid URL %r: No schema supplied" % url)
+    path = requote_path(path)
+    if params:
+        params = urllib.urlencode(params)
+        query = query and '%s&%s' % (query, params) or params
+    return urlparse.urlunsplit((scheme, netloc, path, query, fragment))
+
+
+def request(pool, method, url, headers=None, data=None, consumer=None,
+            read_timeout=None):
+    """ Makes one request with a pooled connection. A request that fails on
+        a reused connection (closed by the server while idle) is retried
+        once on a new connection.
+
+    @param read_timeout: seconds to wait for the server to send more data
+    @return: Future for the Response
+    """
+    headers = dict(headers or {})
+    scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+    if query:
+        path = '%s?%s' % (path, query)
+    headers.setdefault('Host', netloc)
+    if data is not None and not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    if data is not None or method.upper() in ('PUT', 'POST'):
+        headers['Content-Length'] = str(len(data or b''))
+    if hasattr(consumer, 'write'):
+        consumer = consumer.write
+
+    def _send(conn, retry):
+        reused = conn.used
+        sent = conn.request(method, path, headers, data, consumer)
+        conn.wait(read_timeout)
+
+        def _done(res):
+            pool.put(url, conn, reusable=conn.reusable)
+            return res
+
+        def _failed(exc):
+            pool.discard(url, conn)
+            if retry and reused and isinstance(exc, errors.ResponseError) \
+                    and exc.status == 0:
+                return then(pool.get(url), lambda c: _send(c, False))
+            raise exc
+        return then(sent, _done, _failed)
+    return then(pool.get(url), lambda conn: _send(conn, True))
+
+
+class AuthenticatedConnection(BaseAuthenticatedConnection):
+    """
+        Connection that authenticates when asked to, and re-authenticates
+        and retries once when a request is rejected with a 401.
+
+        Requests to the same host share pooled keep-alive connections.
+    """
+    asynchronous = True
+
+    def __init__(self, auth, pool_size=10, pool_idle_timeout=60, pool=None,
+                 loop=None, retry_policy=None, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, **kwargs):
+        """ constructor for AuthenticatedConnection
+
+        @param auth: Authentication instance
+        @param pool_size: max number of connections per host
+        @param pool_idle_timeout: seconds before an idle connection is closed
+        @param pool: `ConnectionPool` to share with other connections. Its
+            own connect timeout is used instead of connect_timeout.
+        @param loop: event loop; defaults to the current one
+        @param retry_policy: `object_storage.retry.RetryPolicy` for failed
+            requests. Without one, failures are raised right away.
+        @param connect_timeout: seconds to wait for a connection, or None
+        @param read_timeout: seconds to wait for the server to send more
+            data, or None. Uploads only start waiting once their body has
+            been sent.
+        """
+        self.token = None
+        self.storage_url = None
+        self.auth = auth
+        self.retry_policy = retry_policy
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool = pool or ConnectionPool(maxsize=pool_size,
+                                           idle_timeout=pool_idle_timeout,
+                                           loop=loop,
+                                           connect_timeout=connect_timeout)
+        self._authenticating = None
+
+    def authenticate(self):
+        """ Authenticates. Concurrent callers share one auth request.
+
+        @return: Future that fires once authenticated
+        """
+        if self._authenticating is None:
+            def _authenticated(result):
+                self._authenticating = None
+                self._authenticate()
+
+            def _failed(exc):
+                self._authenticating = None
+                raise exc
+            self._authenticating = then(self.auth.authenticate(),
+                                        _authenticated, _failed)
+        return self._authenticating
+
+    def _refresh_token(self, token):
+        """ Authenticates again after a request made with token was
+            rejected, unless another request has refreshed it already
+
+        @return: Future that fires once authenticated
+        """
+        if self.token != token:
+            return _completed(self.pool.loop)
+        return self.authenticate()
+
+    def make_request(self, method, url=None, headers=None, formatter=None,
+                     params=None, data=None, consumer=None, *args, **kwargs):
+        """ Makes a request
+
+        @param consumer: callable or file-like object that is handed the
+            response body chunk by chunk instead of buffering it
+        @return: Future for the formatted Response
+        """
+        url = _full_url(url, params)
+        token = self.token
+
+        def _request(extra_headers):
+            all_headers = dict(headers or {})
+            all_headers.update(extra_headers)
+            all_headers.update(self.get_headers())
+            return then(request(self.pool, method, url, all_headers, data,
+                                consumer, self.read_timeout), _check)
+
+        def _check(res):
+            res.raise_for_status()
+            return res
+
+        def _reauthenticate(exc):
+            if not isinstance(exc, errors.ResponseError) or \
+                    exc.status != 401:
+                raise exc
+            return then(self._refresh_token(token), lambda r: _request({}))
+
+        def _attempt():
+            return then(_request({}), errback=_reauthenticate)
+
+        # A streamed body cannot be taken back from the consumer
+        if self.retry_policy is None or consumer is not None:
+            d = _attempt()
+        else:
+            d = self._with_retries(_attempt, method)
+        if formatter:
+            d = then(d, formatter)
+        return d
+
+    def _with_retries(self, attempt, method):
+        """ Calls attempt() again while its Future fails with an error that
+            retry_policy retries, waiting on the loop in between """
+        state = self.retry_policy.start(method)
+        loop = self.pool.loop
+
+        def _wake(waiter):
+            if not waiter.done():
+                waiter.set_result(None)
+
+        def _failed(exc):
+            delay = state.next_delay(exc)
+            if delay is None:
+                raise exc
+            waiter = loop.create_future()
+            loop.call_later(delay, _wake, waiter)
+            return then(waiter, lambda r: then(attempt(), errback=_failed))
+        return then(attempt(), errback=_failed)
+
+    def chunk_upload(self, method, url, size=None, headers=None):
+        """ Starts a streaming upload
+
+        @return: `ChunkedUpload`
+        """
+        headers = dict(headers or {})
+        headers.update(self.get_headers())
+        token = self.token
+        return ChunkedUpload(self.pool, method, _full_url(url), size=size,
+                             headers=headers, read_timeout=self.read_timeout,
+                             refresh=lambda: self._refresh_token(token))
+
+    def close(self):
+        """ Closes the idle connections of the pool """
+        self.pool.clear()
+
+
+class ChunkedUpload(object):
+    """
+        Streams a request body. send() returns a Future that fires once the
+        connection can take more data; waiting on it keeps memory bounded.
+        finish() returns a Future for the Response.
+
+        The body is not kept, so an upload rejected with a 401 can't be
+        sent again. It still fails, but only after `refresh` has got a new
+        token, so that uploading again succeeds.
+    """
+    def __init__(self, pool, method, url, size=None, headers=None,
+                 read_timeout=None, refresh=None):
+        self.pool = pool
+        self.url = url
+        self.size = size
+        self.read_timeout = read_timeout
+        self.refresh = refresh
+        self.conn = None
+        self.response = None
+        self._released = False
+        headers = dict(headers or {})
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+        if query:
+            path = '%s?%s' % (path, query)
+        headers.setdefault('Host', netloc)
+        if size is None:
+            headers['Transfer-Encoding'] = 'chunked'
+        else:
+            headers['Content-Length'] = str(size)
+
+        def _start(conn):
+            self.conn = conn
+            self.response = conn.request(method, path, headers)
+            return conn
+        self.ready = then(pool.get(url), _start)
+
+    def send(self, data):
+        """ Sends data
+
+        @return: Future that fires when more data can be sent
+        """
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        def _write(conn):
+            if self.size is None:
+                if not data:
+                    return None
+                # One write per chunk, framing included
+                conn.write(('%x\r\n' % len(data)).encode('ascii') + data +
+                           b'\r\n')
+            else:
+                conn.write(data)
+            return conn.drain()
+        return then(self.ready, _write)
+
+    def send_file(self, f, chunk_size=64 * 1024):
+        """ Sends the rest of a file, reading the next chunk only when the
+            connection can take more data
+
+        @return: Future that fires once the file has been sent
+        """
+        done = self.ready.get_loop().create_future()
+
+        def _next(result=None):
+            if done.done():
+                return
+            try:
+                data = f.read(chunk_size)
+            except Exception as ex:
+                return done.set_exception(ex)
+            if not data:
+                return done.set_result(None)
+            then(self.send(data), _next, _failed)
+
+        def _failed(exc):
+            if not done.done():
+                done.set_exception(exc)
+        then(self.ready, _next, _failed)
+        return done
+
+    def finish(self):
+        """ Ends the body
+
+        @return: Future for the Response
+        """
+        def _finish(conn):
+            if self.size is None:
+                conn.write(b'0\r\n\r\n')
+            conn.wait(self.read_timeout)
+            return then(self.response, _done, _failed)
+
+        def _done(res):
+            self._release(self.conn.reusable)
+            if res.status_code == 401 and self.refresh is not None:
+                return then(self.refresh(), lambda r: res.raise_for_status())
+            res.raise_for_status()
+            return res
+
+        def _failed(exc):
+            self._release(False)
+            raise exc
+        return then(self.ready, _finish)
+
+    def abort(self):
+        """ Drops the request without finishing it, so that the server
+            discards what was sent """
+        def _abort(conn):
+            # The caller has the error that made it give up already
+            self.response.add_done_callback(_observe)
+            self._release(False)
+        then(self.ready, _abort, lambda exc: None)
+
+    def _release(self, reusable):
+        """ Hands the connection back to the pool, once """
+        if self.conn is not None and not self._released:
+            self._released = True
+            self.pool.put(self.url, self.conn, reusable=reusable)
+
+
+class Authentication(BaseAuthentication):
+    """
+        Authentication class.
+    """
+    def __init__(self, username, api_key, auth_token=None, pool=None,
+                 *args, **kwargs):
+        super(Authentication, self).__init__(*args, **kwargs)
+        self.username = username
+        self.api_key = api_key
+        self.auth_token = auth_token
+        self.pool = pool or ConnectionPool(maxsize=1)
+        if self.auth_token:
+            self.authenticated = True
+
+    @property
+    def auth_headers(self):
+        return {'X-Auth-Token': self.auth_token}
+
+    def _authenticate(self, response):
+        if response.status_code == 401:
+            raise errors.AuthenticationError('Invalid Credentials')
+        response.raise_for_status()
+        try:
+            storage_options = json.loads(response.content)['storage']
+        except ValueError:
+            raise errors.StorageURLNotFound("Could not parse services JSON.")
+
+        self.auth_token = response.headers['x-auth-token']
+        self.storage_url = self.get_storage_url(storage_options)
+        if not self.storage_url:
+            self.storage_url = response.headers['x-storage-url']
+        if not self.auth_token or not self.storage_url:
+            raise errors.AuthenticationError('Invalid Authentication Response')
+        self.authenticated = True
+        if self.token_cache is not None:
+            self.token_cache.store(self)
+
+    def authenticate(self):
+        """ Does authentication, reusing a cached token when possible. The
+        token cache is only read here, not locked, so that the event loop
+        is never blocked on another process.
+
+        @return: Future that fires once authenticated
+        """
+        if self.token_cache is not None and self.token_cache.lookup(self):
+            self.authenticated = True
+            return _completed(self.pool.loop)
+        headers = {'X-Storage-User': self.username,
+                   'X-Storage-Pass': self.api_key,
+                   'Content-Length': '0'}
+        return then(request(self.pool, 'GET', self.auth_url, headers,
+                            read_timeout=self.timeout),
+                    self._authenticate)
@@ -3,15 +3,20 @@
 
     See COPYING for license information
 """
+import httplib
+import socket
 import urllib
-from object_storage import errors
+from object_storage import deadline, errors
 from object_storage.transport import BaseAuthentication, \
-    BaseAuthenticatedConnection, Response
+    BaseAuthenticatedConnection, ConnectionPool, Response, \
+    abort_connection, connection_key, timeout_error, CONNECT_TIMEOUT, \
+    READ_TIMEOUT
 import httplib2
 
 from object_storage.utils import json
 
 import logging
+import threading
 logger = logging.getLogger(__name__)
 
 
@@ -19,14 +24,44 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
     """
         Connection that will authenticate if it isn't already
         and retry once if an auth error is returned.
+
+        Requests borrow a persistent connection from a per-host pool, so a
+        single instance can be shared by many threads.
     """
-    def __init__(self, auth, debug=False, **kwargs):
+    def __init__(self, auth, debug=False, pool_size=10, pool_idle_timeout=60,
+                 pool=None, refresh_interval=None, retry_policy=None,
+                 hedge_policy=None, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, **kwargs):
+        """ constructor for AuthenticatedConnection
+
+        @param auth: Authentication instance
+        @param debug: turn on httplib2 debugging
+        @param pool_size: max number of connections kept open per host
+        @param pool_idle_timeout: seconds before an idle connection is closed
+        @param pool: ConnectionPool instance to share with other connections
+        @param refresh_interval: seconds after which the token is replaced
+            proactively, before requests are rejected with it
+        @param retry_policy: `object_storage.retry.RetryPolicy` for failed
+            requests. Without one, failures are raised right away.
+        @param hedge_policy: `object_storage.hedge.HedgePolicy` that sends
+            a duplicate of slow GET and HEAD requests
+        @param connect_timeout: seconds to wait for a connection, or None
+        @param read_timeout: seconds to wait for the server to send or
+            accept data, or None
+        """
         if debug:
             httplib2.debuglevel = 4
         self.token = None
         self.storage_url = None
-        self.http = httplib2.Http()
-        self.http.disable_ssl_certificate_validation = True
+        self.refresh_interval = refresh_interval
+        self._auth_lock = threading.Lock()
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool = pool or ConnectionPool(maxsize=pool_size,
+                                           idle_timeout=pool_idle_timeout,
+                                           factory=self._new_connection)
         self.auth = auth
         if not self.auth.authenticated:
             self.auth.authenticate()
@@ -34,38 +69,115 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
 
     def make_request(self, method, url=None, headers=None, formatter=None,
                      params=None, data=None, *args, **kwargs):
-        """ Makes a request """
+        """ Makes a request, retrying failures according to retry_policy
+
+        @param timeout: seconds, or a (connect, read) tuple, to use instead
+            of the timeouts of the connection
+        """
         headers = headers or {}
-        headers.update(self.get_headers())
+        timeout = kwargs.get('timeout')
 
         if params:
             url = "%s?%s" % (url, urllib.urlencode(params))
 
-        def _make_request(headers):
+        def _make_request(headers, hedge):
             logger.debug("%s %s %s" % (method, url, headers))
-            res, content = self.http.request(url, method,
-                                             headers=headers,
-                                             body=data)
+            res, content = self._pooled_request(method, url, headers, data,
+                                                hedge=hedge, timeout=timeout)
             response = Response()
             response.headers = res
             response.status_code = int(res.status)
             response.content = content
             return response
 
-        response = _make_request(headers)
+        def _send(hedge):
+            self._refresh_if_due()
+            generation = self.auth_generation
+            request_headers = dict(headers)
+            request_headers.update(self.get_headers())
+            response = _make_request(request_headers, hedge)
 
-        if response.status_code == 401:
-            self.auth.authenticate()
-            self._authenticate()
-            headers.update(self.auth_headers)
-            response = _make_request(headers)
+            if response.status_code == 401:
+                self.reauthenticate(generation)
+                request_headers.update(self.auth_headers)
+                response = _make_request(request_headers, hedge)
 
-        response.raise_for_status()
+            response.raise_for_status()
+            return response
+
+        def _attempt():
+            return self._call_with_hedging(_send, method, url)
+
+        response = self._call_with_retries(_attempt, method, data)
 
         if formatter:
             return formatter(response)
         return response
 
+    def _pooled_request(self, method, url, headers, body, hedge=None,
+                        timeout=None):
+        """
+            Sends a request over a pooled connection. A connection that was
+            reused and turns out to be stale gets one retry on a new socket.
+            Cancelling the hedge attempt shuts the socket down, which aborts
+            the request.
+        """
+        timeouts = self._timeouts(timeout)
+        conn = self.pool.get(url)
+        reused = conn.sock is not None
+        if hedge is not None:
+            hedge.on_cancel(lambda: abort_connection(conn))
+        try:
+            try:
+                result = self._request(conn, method, url, headers, body,
+                                       timeouts)
+            except socket.timeout, ex:
+                raise timeout_error(ex)
+            except (socket.error, httplib.HTTPException):
+                if not reused or (hedge is not None and hedge.cancelled):
+                    raise
+                conn.close()
+                try:
+                    result = self._request(conn, method, url, headers, body,
+                                           timeouts)
+                except socket.timeout, ex:
+                    raise timeout_error(ex)
+        except Exception:
+            self.pool.discard(url, conn)
+            raise
+        if hedge is not None:
+            hedge.finish()
+            if hedge.cancelled:
+                self.pool.discard(url, conn)
+                return result
+        self.pool.put(url, conn)
+        return result
+
+    def _request(self, conn, method, url, headers, body,
+                 timeouts=(None, None)):
+        """ Runs a single httplib2 request on the given connection. It is
+            connected here, as httplib2 uses one timeout for both. """
+        connect_timeout, read_timeout = timeouts
+        if conn.sock is None:
+            conn.timeout = connect_timeout
+            conn.connect()
+        conn.sock.settimeout(read_timeout)
+        http = httplib2.Http()
+        http.disable_ssl_certificate_validation = True
+        conn_key = '%s:%s' % connection_key(url)
+        http.connections[conn_key] = conn
+        return http.request(url, method, headers=headers, body=body)
+
+    def _new_connection(self, scheme, netloc):
+        """ Opens a new connection for the pool """
+        if scheme == 'https':
+            conn = httplib2.HTTPSConnectionWithTimeout(
+                netloc, disable_ssl_certificate_validation=True)
+        else:
+            conn = httplib2.HTTPConnectionWithTimeout(netloc)
+        conn.set_debuglevel(httplib2.debuglevel)
+        return conn
+
 
 class Authentication(BaseAuthentication):
     """
@@ -84,13 +196,21 @@ class Authentication(BaseAuthentication):
         return {'X-Auth-Token': self.auth_token}
 
     def authenticate(self):
-        """ Does authentication """
+        """ Does authentication, reusing a cached token when possible """
+        self._cached_authenticate(self._fetch_token)
+
+    def _fetch_token(self):
+        """ Gets a new token from the auth endpoint """
         headers = {'X-Storage-User': self.username,
                    'X-Storage-Pass': self.api_key,
                    'Content-Length': '0'}
-        http = httplib2.Http()
+        http = httplib2.Http(timeout=deadline.clamp(self.timeout))
         http.disable_ssl_certificate_validation = True
-        res, content = http.request(self.auth_url, 'GET', headers=headers)
+        try:
+            res, content = http.request(self.auth_url, 'GET',
+                                        headers=headers)
+        except socket.timeout, ex:
+            raise timeout_error(ex)
         response = Response()
         response.headers = res
         response.status_code = int(res.status)
@@ -4,12 +4,15 @@
     See COPYING for license information
 """
 import requests
+import requests.adapters
 from object_storage.transport import BaseAuthentication, \
-    BaseAuthenticatedConnection
-from object_storage import errors
+    BaseAuthenticatedConnection, ConnectionPool, connection_key, \
+    timeout_error, CONNECT_TIMEOUT, READ_TIMEOUT
+from object_storage import deadline, errors
 from object_storage.utils import json
 
 import logging
+import threading
 logger = logging.getLogger(__name__)
 
 
@@ -17,58 +20,147 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
     """
         Connection that will authenticate if it isn't already
         and retry once if an auth error is returned.
+
+        Requests go through one requests.Session, so connections are kept
+        alive and reused. A single instance can be shared by many threads.
     """
-    def __init__(self, auth, **kwargs):
+    def __init__(self, auth, pool_size=10, pool_idle_timeout=60, pool=None,
+                 session=None, refresh_interval=None, retry_policy=None,
+                 hedge_policy=None, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, **kwargs):
+        """ constructor for AuthenticatedConnection
+
+        @param auth: Authentication instance
+        @param pool_size: max number of connections kept open per host
+        @param pool_idle_timeout: seconds before an idle chunk_upload()
+            connection is closed
+        @param pool: ConnectionPool for chunk_upload() to share with other
+            connections
+        @param session: requests.Session to share with other connections
+        @param refresh_interval: seconds after which the token is replaced
+            proactively, before requests are rejected with it
+        @param retry_policy: `object_storage.retry.RetryPolicy` for failed
+            requests. Without one, failures are raised right away.
+        @param hedge_policy: `object_storage.hedge.HedgePolicy` that sends
+            a duplicate of slow GET and HEAD requests. The losing request
+            is not aborted, its response is dropped once it arrives.
+        @param connect_timeout: seconds to wait for a connection, or None
+        @param read_timeout: seconds to wait for the server to send or
+            accept data, or None
+        """
         self.token = None
         self.storage_url = None
+        self.refresh_interval = refresh_interval
+        self._auth_lock = threading.Lock()
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = session or make_session(pool_size)
+        self._host_settings = {}
+        # Used by chunk_upload(), which streams over plain httplib
+        self.pool = pool or ConnectionPool(maxsize=pool_size,
+                                           idle_timeout=pool_idle_timeout)
         self.auth = auth
         self.auth.authenticate()
         self._authenticate()
 
-    def make_request(self, method, url=None, *args, **kwargs):
-        """ Makes a request """
-        _headers = kwargs.get('headers', {})
-        headers = self.get_headers()
-        if _headers:
-            headers.update(_headers)
-        kwargs['headers'] = headers
-
-        if 'verify' not in kwargs:
-            kwargs['verify'] = False
-
-        formatter = None
-        if 'formatter' in kwargs:
-            formatter = kwargs.get('formatter')
-            del kwargs['formatter']
-
-        print method, url, args, kwargs
-        res = requests.request(method, url, *args, **kwargs)
-        if kwargs.get('return_response', True):
-            res = self._check_success(res)
-            if res.status_code == 404:
-                raise errors.NotFound('Not found')
+    def make_request(self, method, url=None, headers=None, formatter=None,
+                     params=None, data=None, *args, **kwargs):
+        """ Makes a request, retrying failures according to retry_policy
+
+        @param timeout: seconds, or a (connect, read) tuple, to use instead
+            of the timeouts of the connection
+        """
+        headers = headers or {}
+        kwargs.pop('return_response', None)
+        timeout = kwargs.pop('timeout', None)
+
+        def _make_request(headers):
+            logger.debug("%s %s", method, url)
+            request = requests.Request(method, url, headers=headers,
+                                       params=params, data=data).prepare()
+            settings = dict(self._settings(url))
+            settings.update(kwargs)
+            settings['timeout'] = self._timeouts(timeout)
             try:
-                res.raise_for_status()
-            except Exception as ex:
-                raise errors.ResponseError(res.status_code, str(ex))
+                return self.session.send(request, **settings)
+            except requests.exceptions.Timeout as ex:
+                raise timeout_error(ex)
+            except requests.exceptions.ConnectionError:
+                raise errors.ResponseError(0, 'Disconnected')
+
+        def _send(hedge):
+            self._refresh_if_due()
+            generation = self.auth_generation
+            request_headers = dict(headers)
+            request_headers.update(self.get_headers())
+            res = _make_request(request_headers)
+            if res.status_code == 401:
+                # Authenticate and try again with a (hopefully) new token
+                res.close()
+                self.reauthenticate(generation)
+                request_headers.update(self.auth_headers)
+                res = _make_request(request_headers)
+            self._raise_for_status(res)
+            return res
+
+        def _attempt():
+            # A streamed body is read by the caller, after the race is over
+            if kwargs.get('stream'):
+                return _send(None)
+            return self._call_with_hedging(_send, method, url)
+
+        res = self._call_with_retries(_attempt, method, data)
 
         if formatter:
             return formatter(res)
         return res
 
-    def _check_success(self, res):
-        """
-            Checks for request success. If a 401 is returned, it will
-            authenticate again and retry the request.
-        """
-        if res.status_code == 401:
+    def chunk_download(self, url, chunk_size=10 * 1024, timeout=None,
+                       headers=None):
+        """ Returns a generator that streams the body of url """
+        res = self.make_request('GET', url, headers=headers, stream=True,
+                                timeout=timeout)
+        try:
+            for chunk in res.iter_content(chunk_size):
+                yield chunk
+        finally:
+            res.close()
+
+    def _settings(self, url):
+        """ Returns the send() settings for url (proxies, verify, ...).
+            Session.request() works these out from the environment on every
+            call, which costs more than the request itself on a fast link,
+            so they are looked up once per host. """
+        key = connection_key(url)
+        if key not in self._host_settings:
+            self._host_settings[key] = self.session.merge_environment_settings(
+                url, {}, None, False, None)
+        return self._host_settings[key]
+
+    def _raise_for_status(self, res):
+        if res.status_code == 404:
+            res.close()
+            raise errors.NotFound('Not found')
+        try:
+            res.raise_for_status()
+        except Exception as ex:
+            res.close()
+            raise errors.ResponseError(
+                res.status_code, str(ex),
+                retry_after=res.headers.get('retry-after'))
 
-            # Authenticate and try again with a (hopefully) new token
-            self._authenticate()
-            res.request.headers.update(self.auth_headers)
-            res.request.send(anyway=True)
-            res = res.request.response
-        return res
+
+def make_session(pool_size=10):
+    """ Returns a requests.Session that keeps up to pool_size connections
+        per host """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 class Authentication(BaseAuthentication):
@@ -88,11 +180,20 @@ class Authentication(BaseAuthentication):
         return {'X-Auth-Token': self.auth_token}
 
     def authenticate(self):
-        """ Does authentication """
+        """ Does authentication, reusing a cached token when possible """
+        self._cached_authenticate(self._fetch_token)
+
+    def _fetch_token(self):
+        """ Gets a new token from the auth endpoint """
         headers = {'X-Storage-User': self.username,
                    'X-Storage-Pass': self.api_key,
                    'Content-Length': '0'}
-        response = requests.get(self.auth_url, headers=headers, verify=False)
+        try:
+            response = requests.get(self.auth_url, headers=headers,
+                                    verify=False,
+                                    timeout=deadline.clamp(self.timeout))
+        except requests.exceptions.Timeout as ex:
+            raise timeout_error(ex)
 
         if response.status_code == 401:
             raise errors.AuthenticationError('Invalid Credentials')
@@ -3,19 +3,26 @@
 
     See COPYING for license information
 """
+from collections import deque
+
 from zope import interface
 
-from object_storage.transport import requote_path
+from object_storage.transport import connection_key, requote_path
 from object_storage.errors import NotFound
 from object_storage.transport import Response, BaseAuthenticatedConnection, \
-    BaseAuthentication
+    BaseAuthentication, timeout_error, CONNECT_TIMEOUT, READ_TIMEOUT
 from object_storage import errors
 
-from twisted.internet import reactor
-from twisted.internet.defer import Deferred
+from twisted.internet import error as net_error, reactor
+from twisted.internet.defer import Deferred, DeferredSemaphore, fail, \
+    succeed
+from twisted.internet.task import deferLater
 from twisted.internet.protocol import Protocol
 from twisted.internet.ssl import ClientContextFactory
-from twisted.web.client import Agent
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, HTTPConnectionPool, ResponseDone, \
+    ResponseFailed, ResponseNeverReceived
+from twisted.web.http import PotentialDataLoss
 from twisted.web.http_headers import Headers
 from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
 
@@ -24,8 +31,24 @@ import urllib
 
 from object_storage.utils import json
 
+# Failures that mean the connection broke before a response came in
+CONNECTION_ERRORS = (net_error.ConnectError, net_error.ConnectionLost,
+                     net_error.TimeoutError, ResponseFailed,
+                     ResponseNeverReceived)
+
+
+def complete_request(resp, callback=None, load_body=True, consumer=None,
+                     timer=None):
+    """ Builds a Response once the body has been received
 
-def complete_request(resp, callback=None, load_body=True):
+    @param resp: twisted.web.iweb.IResponse
+    @param callback: formatter that is handed the Response
+    @param load_body: read the body into Response.content
+    @param consumer: stream the body instead of loading it; a callable
+        that is handed each chunk, a file-like object or a filename to
+        write the body to
+    @param timer: `ReadTimeout` that fails the body when it stalls
+    """
     r = Response()
     r.status_code = resp.code
     r.version = resp.version
@@ -44,13 +67,22 @@ def complete_request(resp, callback=None, load_body=True):
         return r
 
     def build_response(body):
-        r.content = body
+        if consumer is None:
+            r.content = body
         if callback:
             return callback(r)
         return r
 
     finished = Deferred()
-    resp.deliverBody(FullBodyReader(finished))
+    if consumer is None:
+        reader = FullBodyReader(finished)
+    elif isinstance(consumer, basestring):
+        reader = FileBodyReader(finished, consumer)
+    else:
+        reader = StreamingBodyReader(finished, consumer)
+    if timer is not None:
+        reader = TimedBodyReader(reader, timer)
+    resp.deliverBody(reader)
 
     finished.addCallback(build_response)
     return finished
@@ -65,10 +97,48 @@ def print_error(failure):
 
 
 class AuthenticatedConnection(BaseAuthenticatedConnection):
-    def __init__(self, auth, **kwargs):
+    """
+        Connection that sends every request through one Agent backed by a
+        persistent HTTPConnectionPool, so connections are reused across
+        requests instead of being opened for each one.
+
+        No more than `pool_size` requests to one host are in flight at
+        once; later ones wait for one of them to complete. A request holds
+        its slot until its body has been read, and an upload until its
+        response came in.
+    """
+    asynchronous = True
+
+    def __init__(self, auth, pool_size=10, pool_idle_timeout=60, pool=None,
+                 retry_policy=None, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, **kwargs):
+        """ constructor for AuthenticatedConnection
+
+        @param auth: Authentication instance
+        @param pool_size: max number of requests in flight, and of idle
+            connections kept open, per host
+        @param pool_idle_timeout: seconds before an idle connection is closed
+        @param pool: twisted.web.client.HTTPConnectionPool instance to share
+            with other connections. The limit of requests in flight is kept
+            by each connection.
+        @param retry_policy: `object_storage.retry.RetryPolicy` for failed
+            requests. Without one, failures are raised right away.
+        @param connect_timeout: seconds to wait for a connection, or None
+        @param read_timeout: seconds to wait for the server to send more
+            data, or None. Uploads only start waiting once their body has
+            been sent.
+        """
         self.token = None
         self.storage_url = None
         self.auth = auth
+        self.retry_policy = retry_policy
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self._limits = {}
+        self.pool = pool or make_pool(pool_size, pool_idle_timeout)
+        self.agent = Agent(reactor, WebClientContextFactory(),
+                           connectTimeout=connect_timeout, pool=self.pool)
 
     def authenticate(self):
         d = self.auth.authenticate()
@@ -78,11 +148,97 @@ class AuthenticatedConnection(BaseAuthenticatedConnection):
     def make_request(self, method, url=None, headers=None, *args, **kwargs):
         headers = headers or {}
         headers.update(self.get_headers())
-        return make_request(method, url=url, headers=headers, *args, **kwargs)
+        kwargs.setdefault('agent', self.agent)
+        kwargs.setdefault('read_timeout', self.read_timeout)
+        limit = self._limit(url)
+        # Body producers and consumers can only be used once
+        if self.retry_policy is None or kwargs.get('data') is not None or \
+                kwargs.get('consumer') is not None:
+            return limit.run(make_request, method, url, headers, *args,
+                             **kwargs)
+
+        state = self.retry_policy.start(method)
+
+        def _attempt():
+            # The slot is given up while waiting to retry
+            d = limit.run(make_request, method, url, headers, *args,
+                          **kwargs)
+            d.addErrback(_failed)
+            return d
+
+        def _failed(failure):
+            exc = failure.value
+            if failure.check(*CONNECTION_ERRORS):
+                exc = errors.ResponseError(0, 'Disconnected')
+            delay = state.next_delay(exc)
+            if delay is None:
+                return failure
+            return deferLater(reactor, delay, _attempt)
+        return _attempt()
+
+    def _limit(self, url):
+        """ Returns the DeferredSemaphore for requests to the host of url """
+        key = connection_key(url)
+        if key not in self._limits:
+            self._limits[key] = DeferredSemaphore(self.pool_size)
+        return self._limits[key]
+
+    def chunk_upload(self, method, url, size=None, headers=None):
+        """ Starts a streaming upload
+
+        @param method: HTTP method, usually PUT
+        @param url: URL to upload to
+        @param size: size of the body; chunked encoding is used without it
+        @param headers: extra headers to send
+        @return: ChunkedConnection; send data with send() and complete the
+            request with finish()
+        """
+        upload = ChunkedConnection(self, url, headers=headers, size=size,
+                                   method=method)
+        upload.setup()
+        return upload
+
+    def close(self):
+        """ Closes the idle connections of the pool
+
+        @return: Deferred that fires once they are closed
+        """
+        return self.pool.closeCachedConnections()
+
+
+def make_pool(maxsize=10, idle_timeout=60):
+    """ Returns a persistent HTTPConnectionPool
+
+    @param maxsize: max number of idle connections kept open per host
+    @param idle_timeout: seconds before an idle connection is closed
+    """
+    pool = HTTPConnectionPool(reactor, persistent=True)
+    pool.maxPersistentPerHost = maxsize
+    pool.cachedConnectionTimeout = idle_timeout
+    return pool
+
+
+_default_agent = None
+
+
+def default_agent():
+    """ Returns the Agent shared by requests made without a connection,
+        such as authentication """
+    global _default_agent
+    if _default_agent is None:
+        _default_agent = Agent(reactor, WebClientContextFactory(),
+                               connectTimeout=CONNECT_TIMEOUT,
+                               pool=make_pool())
+    return _default_agent
 
 
 def make_request(method, url=None, headers=None, *args, **kwargs):
-    """ Makes a request """
+    """ Makes a request
+
+    @param read_timeout: seconds to wait for the server to send more data.
+        For a body producer with a `finished` Deferred, such as
+        ChunkedStreamProducer, the wait starts once the body has been sent.
+    """
     headers = Headers(dict([(k, [v]) for k, v in headers.items()]))
 
     formatter = None
@@ -102,26 +258,100 @@ def make_request(method, url=None, headers=None, *args, **kwargs):
 
     url = _full_url(url, params)
     body = kwargs.get('data')
+    consumer = kwargs.get('consumer')
+    agent = kwargs.get('agent') or default_agent()
+    read_timeout = kwargs.get('read_timeout')
 
-    # print method, url, headers, body
-
-    contextFactory = WebClientContextFactory()
-    agent = Agent(reactor, contextFactory)
     d = agent.request(
         method,
         url,
         headers,
         body)
 
+    timer = None
+    if read_timeout:
+        timer = ReadTimeout(read_timeout)
+        sent = getattr(body, 'finished', None)
+        if isinstance(sent, Deferred):
+            def _sent(result):
+                timer.start(d.cancel)
+                return result
+            sent.addCallback(_sent)
+        else:
+            timer.start(d.cancel)
+
     load_body = True
     if method.upper() in ['HEAD', 'DELETE']:
         load_body = False
 
-    d.addCallback(complete_request, formatter, load_body=load_body)
+    d.addCallback(complete_request, formatter, load_body=load_body,
+                  consumer=consumer, timer=timer)
     d.addErrback(print_error)
+    d.addBoth(_timed_out, timer)
     return d
 
 
+def _timed_out(result, timer=None):
+    """ Stops the read timer of a request and raises TimeoutError for a
+        request that ran out of time connecting or reading """
+    if timer is not None:
+        timer.finish()
+    if not isinstance(result, Failure):
+        return result
+    if timer is not None and timer.expired:
+        return Failure(timeout_error('Read timed out after %s seconds'
+                                     % timer.seconds))
+    if result.check(net_error.TimeoutError):
+        return Failure(timeout_error(result.value))
+    return result
+
+
+class ReadTimeout(object):
+    """
+        Fails a request when the server sends nothing for `seconds`. While
+        waiting for the response the request is cancelled; while reading
+        the body its transport is stopped.
+    """
+    def __init__(self, seconds, clock=None):
+        self.seconds = seconds
+        self.clock = clock or reactor
+        self.expired = False
+        self.finished = False
+        self._call = None
+        self._cancel = None
+
+    def start(self, cancel):
+        """ (Re)starts the timer
+
+        @param cancel: callable that fails the request
+        """
+        if self.finished:
+            return
+        self._cancel = cancel
+        self.stop()
+        self._call = self.clock.callLater(self.seconds, self._expire)
+
+    def reset(self):
+        """ Restarts the wait after data came in """
+        if self._call is not None and self._call.active():
+            self._call.reset(self.seconds)
+
+    def stop(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def finish(self):
+        """ Stops the timer for good once the request is done """
+        self.finished = True
+        self.stop()
+
+    def _expire(self):
+        self._call = None
+        self.expired = True
+        self._cancel()
+
+
 def _full_url(url, _params={}):
     """Build the actual URL to use."""
 
@@ -159,6 +389,7 @@ class Authentication(BaseAuthentication):
         self.username = username
         self.api_key = api_key
         self.auth_token = auth_token
+        self._waiting = None
         if self.auth_token:
             self.authenticated = True
 
@@ -185,32 +416,137 @@ class Authentication(BaseAuthentication):
                                             "storage URL. Using default.")
         if not self.auth_token or not self.storage_url:
             raise errors.AuthenticationError('Invalid Authentication Response')
+        self.authenticated = True
+        if self.token_cache is not None:
+            self.token_cache.store(self)
 
     def authenticate(self):
-        """ Does authentication """
+        """ Does authentication, reusing a cached token when possible.
+
+        Calls made while a request to the auth endpoint is in flight wait
+        for its result instead of sending another one. The token cache is
+        only read here, not locked, so that the reactor is never blocked
+        on another process.
+
+        @return: Deferred that fires once authenticated
+        """
+        if self.token_cache is not None and self.token_cache.lookup(self):
+            self.authenticated = True
+            return succeed(None)
+        if self._waiting is not None:
+            d = Deferred()
+            self._waiting.append(d)
+            return d
+        self._waiting = []
         headers = {'X-Storage-User': self.username,
                    'X-Storage-Pass': self.api_key,
                    'Content-Length': '0'}
-        d = make_request('GET', self.auth_url, headers=headers)
+        d = make_request('GET', self.auth_url, headers=headers,
+                         read_timeout=self.timeout)
         d.addCallback(self._authenticate)
+        d.addBoth(self._notify_waiting)
         return d
 
+    def _notify_waiting(self, result):
+        waiting, self._waiting = self._waiting, None
+        for d in waiting:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+        return result
+
 
 class WebClientContextFactory(ClientContextFactory):
     def getContext(self, hostname, port):
         return ClientContextFactory.getContext(self)
 
 
+def _body_complete(reason):
+    """ True if the body was received in full """
+    return reason.check(ResponseDone, PotentialDataLoss) is not None
+
+
 class FullBodyReader(Protocol):
+    """ Collects the body as a list of chunks, joined once at the end """
     def __init__(self, finished):
         self.finished = finished
-        self.body = ''
+        self.chunks = []
+
+    def dataReceived(self, data):
+        self.chunks.append(data)
+
+    def connectionLost(self, reason):
+        if not _body_complete(reason):
+            return self.finished.errback(reason)
+        self.finished.callback(''.join(self.chunks))
+
+
+class StreamingBodyReader(Protocol):
+    """
+        Hands every chunk of the body to a consumer as it arrives, so the
+        body is never held in memory. The finished deferred fires with the
+        number of bytes received.
+    """
+    def __init__(self, finished, consumer):
+        """
+        @param finished: Deferred fired once the body is consumed
+        @param consumer: callable or file-like object that is handed
+            each chunk
+        """
+        self.finished = finished
+        self.write = getattr(consumer, 'write', consumer)
+        self.length = 0
+        self.failure = None
+
+    def dataReceived(self, data):
+        if self.failure is not None:
+            return
+        self.length += len(data)
+        try:
+            self.write(data)
+        except Exception:
+            # Stop reading; connectionLost reports this failure
+            self.failure = Failure()
+            self.transport.stopProducing()
+
+    def connectionLost(self, reason):
+        if self.failure is not None:
+            reason = self.failure
+        if not _body_complete(reason):
+            return self.finished.errback(reason)
+        self.finished.callback(self.length)
+
+
+class TimedBodyReader(Protocol):
+    """ Passes the body on to another reader, stopping its transport when
+        no data comes in for the read timeout """
+    def __init__(self, reader, timer):
+        self.reader = reader
+        self.timer = timer
+
+    def connectionMade(self):
+        self.reader.makeConnection(self.transport)
+        self.timer.start(self.transport.stopProducing)
 
     def dataReceived(self, data):
-        self.body += data
+        self.timer.reset()
+        self.reader.dataReceived(data)
+
+    def connectionLost(self, reason):
+        self.timer.stop()
+        self.reader.connectionLost(reason)
+
+
+class FileBodyReader(StreamingBodyReader):
+    """ Writes the body straight to a file """
+    def __init__(self, finished, filename):
+        self.file = open(filename, 'wb')
+        StreamingBodyReader.__init__(self, finished, self.file)
 
     def connectionLost(self, reason):
-        self.finished.callback(self.body)
+        self.file.close()
+        StreamingBodyReader.connectionLost(self, reason)
 
 
 class ChunkedConnection:
@@ -219,15 +555,20 @@ class ChunkedConnection:
         setup() will initiate a HTTP connection.
         send_chunk() will send more data.
         finish() will end the request.
+
+        send_chunk() returns a Deferred that fires once the connection can
+        take more data; waiting on it keeps memory use bounded when the
+        data is produced faster than it can be uploaded.
     """
-    def __init__(self, conn, url, headers=None, size=None):
+    def __init__(self, conn, url, headers=None, size=None, method='PUT',
+                 buffer_size=64 * 1024):
         self.conn = conn
         self.url = url
+        self.method = method
         self.req = None
         self.headers = headers
-        self.started = Deferred()
         self.size = size
-        self.body = ChunkedStreamProducer(self.started, self.size)
+        self.body = ChunkedStreamProducer(buffer_size=buffer_size)
 
     def setup(self, size=None):
         """
@@ -239,61 +580,177 @@ class ChunkedConnection:
         if not self.size:
             self.size = UNKNOWN_LENGTH
         self.body.length = self.size
-        req = self.conn.make_request('PUT', self.url,
-                                     headers=self.headers,
-                                     data=self.body)
-        self.req = req
-        print "ChunkedTwistedConnection: STARTED REQUEST"
+        self.req = self.conn.make_request(self.method, self.url,
+                                          headers=self.headers,
+                                          data=self.body)
+        # Stop the producer's senders if the request fails early
+        self.req.addErrback(self._failed)
+
+    def _failed(self, failure):
+        self.body.stopProducing()
+        return failure
 
     def send_chunk(self, chunk):
-        """ Sends a chunk of data. """
-        print "ChunkedTwistedConnection: send chunk"
+        """ Sends a chunk of data.
+
+        @return: Deferred that fires when more data can be sent
+        """
         return self.body.send(chunk)
 
+    send = send_chunk
+
+    def send_file(self, f, chunk_size=64 * 1024):
+        """ Sends the rest of a file, reading the next chunk only when the
+            connection can take more data.
+
+        @return: Deferred that fires once the file has been sent
+        """
+        d = self.body.send_file(f, chunk_size=chunk_size)
+
+        def _failed(failure):
+            # A failed request stops the producer; it carries the actual error
+            if self.body.stopped:
+                return self.req
+            return failure
+        return d.addErrback(_failed)
+
     def finish(self):
-        """ Finished the request out and receives a response. """
-        self.body.finish()
+        """ Finished the request out and receives a response.
+
+        @return: Deferred that fires with the Response
+        """
+        d = self.body.finish()
+        # On failure the request carries the actual error
+        d.addBoth(lambda _: self.req)
+        return d
+
+    def abort(self):
+        """ Drops the request without finishing it, so that the server
+            discards what was sent """
+        self.body.stopProducing()
+        if self.body.consumer is not None and not self.body.finished.called:
+            # Makes the agent give up the request and its connection
+            self.body.finished.errback(errors.ResponseError(0, 'Disconnected'))
+        # The caller has the error that made it give up already
+        self.req.addErrback(lambda failure: None)
 
 
 class ChunkedStreamProducer(object):
+    """
+        Body producer fed by send() calls.
+
+        The transport pauses the producer when its write buffer is full and
+        resumes it once it has drained. Data sent in between is held here,
+        and the Deferreds returned by send() only fire while fewer than
+        buffer_size bytes are held, so a well-behaved sender never buffers
+        more than that.
+    """
     interface.implements(IBodyProducer)
 
-    def __init__(self, started, length=UNKNOWN_LENGTH):
+    def __init__(self, length=UNKNOWN_LENGTH, buffer_size=64 * 1024):
         self.length = length
+        self.buffer_size = buffer_size
         self.consumer = None
+        self.paused = False
+        self.stopped = False
+        self.finishing = False
+        self._done = None
         self.started = Deferred()
         self.finished = Deferred()
+        self._buffer = deque()
+        self._buffered = 0
+        self._waiting = deque()
 
     def startProducing(self, consumer):
-        print "ChunkedStreamProducer: START PRODUCING"
+        if self.stopped:
+            # Aborted before the request got a connection
+            return fail(errors.ResponseError(0, 'Disconnected'))
         self.consumer = consumer
         self.started.callback(None)
+        self._flush()
         return self.finished
 
-    def _send(self, result, data):
-        print "ChunkedStreamProducer: _SEND"
-        return self.consumer.write(data)
-
     def send(self, data):
-        print "ChunkedStreamProducer: SEND"
+        """ Queues data for the transport
+
+        @return: Deferred that fires when more data can be sent
+        """
+        if self.stopped:
+            return fail(errors.ResponseError(0, 'Disconnected'))
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._flush()
+        if self._ready():
+            return succeed(None)
         d = Deferred()
-        self.started.chainDeferred(d)
-        d.addCallback(self._send, data)
+        self._waiting.append(d)
         return d
 
-    def finish(self):
-        def _finish(result):
-            self.finished.callback(None)
-            return None
+    def send_file(self, f, chunk_size=64 * 1024):
+        """ Sends the rest of a file, reading a chunk only when it can be
+            sent """
         d = Deferred()
-        self.started.chainDeferred(d)
-        d.addCallback(_finish)
+
+        def _next(_=None):
+            while not self.stopped:
+                try:
+                    data = f.read(chunk_size)
+                except Exception:
+                    return d.errback()
+                if not data:
+                    return d.callback(None)
+                sent = self.send(data)
+                if not sent.called:
+                    return sent.addCallbacks(_next, d.errback)
+            d.errback(errors.ResponseError(0, 'Disconnected'))
+        _next()
         return d
 
+    def finish(self):
+        """ Ends the body once everything sent so far has been written
+
+        @return: Deferred that fires once the body is complete
+        """
+        self.finishing = True
+        self._done = Deferred()
+        if self.stopped:
+            self._done.errback(errors.ResponseError(0, 'Disconnected'))
+        self._flush()
+        return self._done
+
+    def _ready(self):
+        return not self.paused and self._buffered < self.buffer_size
+
+    def _flush(self):
+        """ Writes buffered data until the transport asks for a pause """
+        if self.consumer is None or self.stopped:
+            return
+        while self._buffer and not self.paused:
+            data = self._buffer.popleft()
+            self._buffered -= len(data)
+            self.consumer.write(data)
+        while self._waiting and self._ready():
+            self._waiting.popleft().callback(None)
+        if self.finishing and not self._buffer and not self.finished.called:
+            self.finished.callback(None)
+            self._done.callback(None)
+
     def pauseProducing(self):
-        print "pause"
-        pass
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self._flush()
 
     def stopProducing(self):
-        print "STOP"
-        pass
+        if self.stopped:
+            return
+        self.stopped = True
+        self._buffer.clear()
+        self._buffered = 0
+        waiting = list(self._waiting)
+        self._waiting.clear()
+        if self._done is not None and not self._done.called:
+            waiting.append(self._done)
+        for d in waiting:
+            d.errback(errors.ResponseError(0, 'Disconnected'))
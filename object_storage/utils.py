@@ -6,6 +6,12 @@
 
 import urllib
 import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 try:
     import json
@@ -21,10 +27,15 @@ except ImportError:
 try:
     from UserDict import DictMixin
 except ImportError:
-    from collections import MutableMapping as DictMixin
+    try:
+        from collections.abc import MutableMapping as DictMixin
+    except ImportError:
+        from collections import MutableMapping as DictMixin
 
+from object_storage import deadline, errors
 
-__all__ = ['json', 'unicode_quote', 'get_path', 'Model']
+__all__ = ['json', 'unicode_quote', 'get_path', 'Model', 'imap_unordered',
+           'call_in_background', 'not_found_as', 'chain', 'on_done']
 
 
 class Model(DictMixin):
@@ -37,6 +48,12 @@ class Model(DictMixin):
     def __delitem__(self, key):
         del self.properties[key]
 
+    def __iter__(self):
+        return iter(self.properties)
+
+    def __len__(self):
+        return len(self.properties)
+
     def keys(self):
         return self.properties.keys()
 
@@ -65,3 +82,179 @@ def get_path(parts=None):
         else:
             path = '/'.join(map(unicode_quote, path.split('/')))
     return path
+
+
+def not_found_as(result, value):
+    """
+        Turns a NotFound failure of an asynchronous result into value. The
+        twisted transport returns Deferreds and the asyncio one Futures,
+        which fail with NotFound instead of raising it; other results are
+        returned as they are.
+    """
+    if hasattr(result, 'addErrback'):
+        def _trap(failure):
+            failure.trap(errors.NotFound)
+            return value
+        return result.addErrback(_trap)
+    if hasattr(result, 'get_loop'):
+        from object_storage.transport.asyncioconn import then
+
+        def _errback(exc):
+            if isinstance(exc, errors.NotFound):
+                return value
+            raise exc
+        return then(result, errback=_errback)
+    return result
+
+
+def chain(result, callback, cleanup=None):
+    """
+        Calls callback with the value of result once it is available and
+        returns what it returns, asynchronously if result is a Deferred or a
+        Future. cleanup() is called if result fails, and the failure is
+        passed on. Other results are handed to callback straight away.
+    """
+    if hasattr(result, 'addCallbacks'):
+        def _failed(failure):
+            if cleanup is not None:
+                cleanup()
+            return failure
+        return result.addCallbacks(callback, _failed)
+    if hasattr(result, 'get_loop'):
+        from object_storage.transport.asyncioconn import then
+
+        def _errback(exc):
+            if cleanup is not None:
+                cleanup()
+            raise exc
+        return then(result, callback, _errback)
+    return callback(result)
+
+
+def on_done(result, func):
+    """
+        Calls func() once result is available, whether it succeeded or not,
+        and returns result. Results that are not a Deferred or a Future are
+        available already.
+    """
+    if hasattr(result, 'addBoth'):
+        def _done(value):
+            func()
+            return value
+        return result.addBoth(_done)
+    if hasattr(result, 'get_loop'):
+        result.add_done_callback(lambda f: func())
+        return result
+    func()
+    return result
+
+
+def call_in_background(func, *args, **kwargs):
+    """
+        Starts func(*args, **kwargs) on a separate thread. Returns a callable
+        that waits for the call to finish and returns its result, or re-raises
+        its exception. func runs under the deadline of the caller.
+    """
+    func = deadline.bind(func)
+    outcome = []
+
+    def _run():
+        try:
+            outcome.append((True, func(*args, **kwargs)))
+        except Exception:
+            outcome.append((False, sys.exc_info()))
+
+    thread = threading.Thread(target=_run)
+    thread.setDaemon(True)
+    thread.start()
+
+    def _wait():
+        thread.join()
+        ok, value = outcome[0]
+        if not ok:
+            raise value[0], value[1], value[2]
+        return value
+    return _wait
+
+
+_DONE = object()
+
+
+def imap_unordered(func, iterable, workers=4, backlog=None):
+    """
+        Calls func(item) for each item of iterable on `workers` threads and
+        yields the results in the order they complete.
+
+        The iterable is consumed on its own thread, at most `backlog` items
+        ahead of the workers, so it can be a long-running generator. The
+        first exception raised by func (or by the iterable) stops the pool
+        and is re-raised here once the running calls have returned. Both
+        run under the `object_storage.deadline.Deadline` of the caller.
+    """
+    backlog = backlog or workers * 2
+    func = deadline.bind(func)
+    tasks = queue.Queue(backlog)
+    results = queue.Queue(backlog)
+    stop = threading.Event()
+
+    def _put(q, item):
+        while not stop.isSet():
+            try:
+                q.put(item, True, 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(q):
+        while not stop.isSet():
+            try:
+                return q.get(True, 0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _feed():
+        try:
+            for item in iterable:
+                if not _put(tasks, item):
+                    return
+        except Exception:
+            _put(results, (False, sys.exc_info()))
+        for _ in range(workers):
+            _put(tasks, _DONE)
+
+    def _work():
+        while True:
+            item = _get(tasks)
+            if item is _DONE:
+                break
+            try:
+                result = (True, func(item))
+            except Exception:
+                result = (False, sys.exc_info())
+            if not _put(results, result):
+                return
+        _put(results, _DONE)
+
+    threads = [threading.Thread(target=deadline.bind(_feed))]
+    threads += [threading.Thread(target=_work) for _ in range(workers)]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+
+    finished = 0
+    try:
+        while finished < workers:
+            result = results.get()
+            if result is _DONE:
+                finished += 1
+                continue
+            ok, value = result
+            if not ok:
+                raise value[0], value[1], value[2]
+            yield value
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
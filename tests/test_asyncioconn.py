@@ -0,0 +1,370 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import io
+
+from mock import Mock
+
+try:
+    import asyncio
+    from object_storage.errors import NotFound, ResponseError, TimeoutError
+    from object_storage.retry import RetryPolicy
+    from object_storage.tokencache import MemoryTokenCache
+    from object_storage.transport import asyncioconn
+except (ImportError, SyntaxError):
+    asyncioconn = None
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        self.closed = True
+
+    def get_extra_info(self, name):
+        return None
+
+
+@unittest.skipIf(asyncioconn is None, 'asyncio is not available')
+class HTTPProtocolTest(unittest.TestCase):
+    def _request(self, method, *chunks, **kwargs):
+        response = self.conn.request(method, '/c/o', {'Host': 'host'},
+                                     **kwargs)
+        for chunk in chunks:
+            self.conn.data_received(chunk)
+        return response
+
+    def test_request(self):
+        self.conn.request('PUT', '/c/o', {'Host': 'host'}, b'body')
+        self.assertEqual(self.transport.written,
+                         [b'PUT /c/o HTTP/1.1\r\nHost: host\r\n\r\nbody'])
+
+    def test_content_length(self):
+        response = self._request('GET', b'HTTP/1.1 200 OK\r\nETag: x\r\n',
+                                 b'Content-Length: 5\r\n\r\nab', b'cde')
+        res = response.result()
+        self.assertEqual((res.status_code, res.phrase, res.content),
+                         (200, 'OK', b'abcde'))
+        self.assertEqual(res.headers['etag'], 'x')
+        self.assertTrue(self.conn.reusable)
+        self.assertFalse(self.transport.closed)
+
+    def test_chunked(self):
+        response = self._request(
+            'GET', b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n',
+            b'3\r\nabc\r\n2', b'\r\nde\r\n0\r\n', b'\r\n')
+        self.assertEqual(response.result().content, b'abcde')
+        self.assertTrue(self.conn.reusable)
+
+    def test_read_until_close(self):
+        response = self._request('GET', b'HTTP/1.0 200 OK\r\n\r\nabc')
+        self.assertFalse(response.done())
+        self.conn.connection_lost(None)
+        self.assertEqual(response.result().content, b'abc')
+        self.assertFalse(self.conn.reusable)
+
+    def test_head(self):
+        response = self._request(
+            'HEAD', b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n')
+        self.assertEqual(response.result().content, b'')
+        self.assertTrue(self.conn.reusable)
+
+    def test_connection_close(self):
+        self._request('GET', b'HTTP/1.1 204 No Content\r\n'
+                      b'Connection: close\r\n\r\n')
+        self.assertFalse(self.conn.reusable)
+        self.assertTrue(self.transport.closed)
+
+    def test_consumer(self):
+        chunks = []
+        response = self._request(
+            'GET', b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nab', b'cd',
+            consumer=chunks.append)
+        self.assertEqual(chunks, [b'ab', b'cd'])
+        self.assertEqual(response.result().content, None)
+
+    def test_disconnect(self):
+        response = self._request('GET', b'HTTP/1.1 200 OK\r\n')
+        self.conn.connection_lost(None)
+        self.assertRaises(ResponseError, response.result)
+
+    def test_read_timeout(self):
+        response = self._request('GET', b'HTTP/1.1 200 OK\r\n')
+        self.conn.wait(0.1)
+        self.loop.run_until_complete(asyncio.sleep(0.06))
+        self.conn.data_received(b'Content-Length: 2\r\n')
+        self.loop.run_until_complete(asyncio.sleep(0.06))
+        self.assertFalse(response.done())
+        self.assertRaises(TimeoutError, self.loop.run_until_complete,
+                          response)
+        self.assertTrue(self.transport.closed)
+
+    def test_response_stops_timer(self):
+        response = self._request('GET')
+        self.conn.wait(0.01)
+        self.conn.data_received(b'HTTP/1.1 204 No Content\r\n\r\n')
+        self.loop.run_until_complete(asyncio.sleep(0.02))
+        self.assertEqual(response.result().status_code, 204)
+        self.assertFalse(self.transport.closed)
+
+    def test_drain(self):
+        self.conn.pause_writing()
+        drained = self.conn.drain()
+        self.assertFalse(drained.done())
+        self.conn.resume_writing()
+        self.assertTrue(drained.done())
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.transport = FakeTransport()
+        self.conn = asyncioconn.HTTPProtocol(self.loop)
+        self.conn.connection_made(self.transport)
+
+    def tearDown(self):
+        self.loop.close()
+
+
+class FakePool(object):
+    """ Pool of protocols answering each request with the next response """
+    def __init__(self, loop, responses):
+        self.loop = loop
+        self.responses = responses
+        self.requests = []
+        self.returned = []
+
+    def get(self, url):
+        conn = asyncioconn.HTTPProtocol(self.loop)
+        conn.connection_made(FakeTransport())
+        request = conn.request
+
+        def _request(method, path, headers, body=None, consumer=None):
+            self.requests.append((method, path, headers))
+            response = request(method, path, headers, body, consumer)
+            conn.data_received(self.responses.pop(0))
+            return response
+        conn.request = _request
+        return asyncioconn._completed(self.loop, conn)
+
+    def put(self, url, conn, reusable=True):
+        self.returned.append(reusable)
+
+    def discard(self, url, conn):
+        self.put(url, conn, False)
+
+
+class FakeAuth(object):
+    def __init__(self, loop):
+        self.loop = loop
+        self.calls = 0
+        self.auth_headers = {'X-Auth-Token': 'old'}
+        self.auth_token = 'old'
+        self.storage_url = 'http://host/v1/AUTH'
+
+    def authenticate(self):
+        self.calls += 1
+        self.auth_headers = {'X-Auth-Token': 'new'}
+        self.auth_token = 'new'
+        return asyncioconn._completed(self.loop)
+
+
+@unittest.skipIf(asyncioconn is None, 'asyncio is not available')
+class AuthenticatedConnectionTest(unittest.TestCase):
+    def _connection(self, *responses):
+        pool = FakePool(self.loop, list(responses))
+        conn = asyncioconn.AuthenticatedConnection(FakeAuth(self.loop),
+                                                   pool=pool)
+        conn._authenticate()
+        return conn
+
+    def test_formatter(self):
+        conn = self._connection(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                                b'\r\nhi')
+        d = conn.make_request('GET', 'http://host/c o', params={'a': 1},
+                              formatter=lambda res: res.content)
+        self.assertEqual(self.loop.run_until_complete(d), b'hi')
+        method, path, headers = conn.pool.requests[0]
+        self.assertEqual(path, '/c%20o?a=1')
+        self.assertEqual(headers['X-Auth-Token'], 'old')
+        self.assertEqual(conn.pool.returned, [True])
+
+    def test_reauthenticates(self):
+        conn = self._connection(
+            b'HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\n\r\n',
+            b'HTTP/1.1 204 No Content\r\n\r\n')
+        res = self.loop.run_until_complete(
+            conn.make_request('DELETE', 'http://host/c/o'))
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(conn.auth.calls, 1)
+        self.assertEqual(conn.pool.requests[1][2]['X-Auth-Token'], 'new')
+
+    def test_not_found(self):
+        conn = self._connection(b'HTTP/1.1 404 Not Found\r\n'
+                                b'Content-Length: 0\r\n\r\n')
+        self.assertRaises(NotFound, self.loop.run_until_complete,
+                          conn.make_request('HEAD', 'http://host/c/o'))
+
+    def test_retry_policy(self):
+        conn = self._connection(
+            b'HTTP/1.1 503 Unavailable\r\nRetry-After: 0\r\n'
+            b'Content-Length: 0\r\n\r\n',
+            b'HTTP/1.1 204 No Content\r\n\r\n')
+        conn.retry_policy = RetryPolicy()
+        res = self.loop.run_until_complete(
+            conn.make_request('HEAD', 'http://host/c/o'))
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(conn.retry_policy.counts['retries'], 1)
+
+    def test_chunk_upload(self):
+        conn = self._connection(b'HTTP/1.1 201 Created\r\n'
+                                b'Content-Length: 0\r\n\r\n')
+        upload = conn.chunk_upload('PUT', 'http://host/c/o')
+        self.loop.run_until_complete(upload.send(b'hello'))
+        res = self.loop.run_until_complete(upload.finish())
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(upload.conn.transport.written[1:],
+                         [b'5\r\nhello\r\n', b'0\r\n\r\n'])
+        headers = conn.pool.requests[0][2]
+        self.assertEqual(headers['Transfer-Encoding'], 'chunked')
+
+    def test_chunk_upload_reauthenticates(self):
+        conn = self._connection(
+            b'HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\n\r\n',
+            b'HTTP/1.1 201 Created\r\nContent-Length: 0\r\n\r\n')
+        upload = conn.chunk_upload('PUT', 'http://host/c/o', size=5)
+        self.loop.run_until_complete(upload.send(b'hello'))
+        with self.assertRaises(ResponseError) as caught:
+            self.loop.run_until_complete(upload.finish())
+        self.assertEqual(caught.exception.status, 401)
+        self.assertEqual(conn.auth.calls, 1)
+        upload = conn.chunk_upload('PUT', 'http://host/c/o', size=5)
+        self.loop.run_until_complete(upload.send(b'hello'))
+        self.loop.run_until_complete(upload.finish())
+        self.assertEqual(conn.pool.requests[1][2]['X-Auth-Token'], 'new')
+        self.assertEqual(conn.auth.calls, 1)
+
+    def test_exists(self):
+        from object_storage.client import Client
+        conn = self._connection(
+            b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n',
+            b'HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n')
+        client = Client('user', 'key', connection=conn)
+        obj = client['c']['o']
+        self.assertFalse(self.loop.run_until_complete(obj.exists()))
+        self.assertTrue(self.loop.run_until_complete(client['c'].exists()))
+
+    def test_send(self):
+        obj = self._object(b'HTTP/1.1 201 Created\r\n'
+                           b'Etag: 5d41402abc4b2a76b9719d911017c592\r\n'
+                           b'Content-Length: 0\r\n\r\n')
+        obj.upload_chunk_size = 3
+        self.assertTrue(self.loop.run_until_complete(
+            obj.send(io.BytesIO(b'hello'))) is obj)
+        self.assertEqual(obj.model['size'], 5)
+        self.assertEqual(obj.client.conn.pool.returned, [True])
+
+    def test_send_read_error(self):
+        obj = self._object(b'HTTP/1.1 201 Created\r\n'
+                           b'Content-Length: 0\r\n\r\n')
+        data = Mock(spec=['read'])
+        data.read.side_effect = IOError()
+        with self.assertRaises(IOError):
+            self.loop.run_until_complete(obj.send(data))
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(obj.client.conn.pool.returned, [False])
+
+    def test_open_not_supported(self):
+        obj = self._object()
+        self.assertRaises(NotImplementedError, obj.open, 'wb')
+
+    def _object(self, *responses):
+        from object_storage.client import Client
+        client = Client('user', 'key', connection=self._connection(*responses))
+        return client['c']['o']
+
+    def test_token_cache(self):
+        cache = MemoryTokenCache()
+        pool = FakePool(self.loop, [
+            b'HTTP/1.1 200 OK\r\nX-Auth-Token: T\r\n'
+            b'X-Storage-Url: http://host/v1/AUTH\r\nContent-Length: 46\r\n'
+            b'\r\n{"storage": {"default": "a", "a": "http://s"}}'])
+        auths = [asyncioconn.Authentication('user', 'key', pool=pool,
+                                            auth_url='http://auth/',
+                                            token_cache=cache)
+                 for _ in range(2)]
+        for auth in auths:
+            self.loop.run_until_complete(auth.authenticate())
+        self.assertEqual(len(pool.requests), 1)
+        self.assertEqual((auths[1].auth_token, auths[1].storage_url),
+                         ('T', 'http://s'))
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+
+@unittest.skipIf(asyncioconn is None, 'asyncio is not available')
+class ConnectionPoolTest(unittest.TestCase):
+    def test_reuses_connections(self):
+        conn = self.loop.run_until_complete(self.pool.get('http://host/a'))
+        self.pool.put('http://host/b', conn)
+        again = self.loop.run_until_complete(self.pool.get('http://host/'))
+        self.assertTrue(again is conn)
+        self.assertEqual(len(self.connects), 1)
+
+    def test_waits_when_exhausted(self):
+        conn = self.loop.run_until_complete(self.pool.get('http://host/'))
+        waiting = self.pool.get('http://host/')
+        self.assertFalse(waiting.done())
+        self.pool.put('http://host/', conn)
+        self.assertTrue(waiting.result() is conn)
+
+    def test_discard_opens_new_connection(self):
+        conn = self.loop.run_until_complete(self.pool.get('http://host/'))
+        waiting = self.pool.get('http://host/')
+        self.pool.discard('http://host/', conn)
+        self.assertTrue(conn.closed)
+        self.assertFalse(self.loop.run_until_complete(waiting) is conn)
+        self.assertEqual(len(self.connects), 2)
+
+    def test_connect_timeout(self):
+        self.loop.create_connection = \
+            lambda factory, host, port, ssl=None: self.loop.create_future()
+        self.pool.connect_timeout = 0.01
+        self.assertRaises(TimeoutError, self.loop.run_until_complete,
+                          self.pool.get('http://host/'))
+        self.assertEqual(self.pool._open[('http', 'host')], 0)
+
+    def test_closed_connections_skipped(self):
+        conn = self.loop.run_until_complete(self.pool.get('http://host/'))
+        self.pool.put('http://host/', conn)
+        conn.closed = True
+        again = self.loop.run_until_complete(self.pool.get('http://host/'))
+        self.assertFalse(again is conn)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.pool = asyncioconn.ConnectionPool(maxsize=1, loop=self.loop)
+        self.connects = []
+
+        def _create_connection(factory, host, port, ssl=None):
+            self.connects.append((host, port, ssl))
+            conn = factory()
+            conn.connection_made(FakeTransport())
+            return asyncioconn._completed(self.loop, (None, conn))
+        self.loop.create_connection = _create_connection
+
+    def tearDown(self):
+        self.pool.clear()
+        self.loop.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+from mock import Mock
+
+from object_storage.bulk import BulkDeleter
+from object_storage.errors import NotFound, ResponseError
+from object_storage.storage_object import StorageObjectEntry
+from object_storage.utils import json
+
+
+class BulkDeleterTest(unittest.TestCase):
+    def test_delete(self):
+        self.client.delete_object.side_effect = [True, NotFound(404, ''),
+                                                 True]
+        progress = Mock()
+        deleter = BulkDeleter(self.client, workers=1, use_bulk=False,
+                              progress=progress)
+        counts = deleter.delete(self.objects)
+        self.assertEqual(counts, {'deleted': 2, 'not_found': 1, 'failed': 0})
+        self.assertEqual(progress.call_count, 3)
+        self.client.delete_object.assert_any_call('CONTAINER', 'a')
+
+    def test_retries_server_errors(self):
+        self.client.delete_object.side_effect = [ResponseError(503, ''),
+                                                 ResponseError(0, ''), True]
+        deleter = BulkDeleter(self.client, use_bulk=False, backoff=0)
+        self.assertEqual(deleter.delete(self.objects[:1]),
+                         {'deleted': 1, 'not_found': 0, 'failed': 0})
+        self.assertEqual(self.client.delete_object.call_count, 3)
+
+    def test_gives_up(self):
+        self.client.delete_object.side_effect = ResponseError(500, '')
+        deleter = BulkDeleter(self.client, use_bulk=False, backoff=0,
+                              retries=2)
+        self.assertEqual(deleter.delete(self.objects[:1]),
+                         {'deleted': 0, 'not_found': 0, 'failed': 1})
+        self.assertEqual(self.client.delete_object.call_count, 3)
+
+    def test_client_errors_not_retried(self):
+        self.client.delete_object.side_effect = ResponseError(409, '')
+        deleter = BulkDeleter(self.client, use_bulk=False, backoff=0)
+        self.assertEqual(deleter.delete(self.objects[:1])['failed'], 1)
+        self.assertEqual(self.client.delete_object.call_count, 1)
+
+    def test_bulk_delete(self):
+        self.client.get_capabilities.return_value = {
+            'bulk_delete': {'max_deletes_per_request': 2}}
+        responses = [
+            {'Number Deleted': 1, 'Number Not Found': 0,
+             'Errors': [['/CONTAINER/b', '409 Conflict']]},
+            {'Number Deleted': 0, 'Number Not Found': 0,
+             'Errors': [['/CONTAINER/c', '404 Not Found']]}]
+
+        def _make_request(method, params=None, headers=None, data=None,
+                          formatter=None):
+            res = Mock()
+            res.content = json.dumps(responses.pop(0))
+            return formatter(res)
+        self.client.make_request.side_effect = _make_request
+        deleter = BulkDeleter(self.client, workers=1)
+        counts = deleter.delete(self.objects)
+        self.assertEqual(counts, {'deleted': 2, 'not_found': 1, 'failed': 0})
+        bodies = [c[1]['data'] for c in
+                  self.client.make_request.call_args_list]
+        self.assertEqual(sorted(bodies[0].split('\n')),
+                         ['/CONTAINER/a', '/CONTAINER/b'])
+        self.assertEqual(bodies[1], '/CONTAINER/c')
+        # The conflicting object is retried on its own
+        self.client.delete_object.assert_called_once_with('CONTAINER', 'b')
+
+    def test_bulk_unsupported(self):
+        self.assertEqual(BulkDeleter(self.client)._bulk_size(), 0)
+        self.assertRaises(Exception, BulkDeleter(self.client,
+                                                 use_bulk=True)._bulk_size)
+
+    def setUp(self):
+        self.client = Mock()
+        self.client.get_capabilities.return_value = {}
+        self.objects = [StorageObjectEntry('CONTAINER', name)
+                        for name in ['a', 'b', 'c']]
+
+
+if __name__ == "__main__":
+    unittest.main()
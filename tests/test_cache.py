@@ -0,0 +1,456 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from mock import Mock
+
+from object_storage.bulk import BulkDeleter
+from object_storage.cache import BlockCache, ContentCache, MetadataCache
+from object_storage.client import Client
+from object_storage.errors import ResponseError
+from object_storage.transport import Response
+
+BASE = 'http://storage/v1/AUTH'
+
+
+class MetadataCacheTest(unittest.TestCase):
+    def test_get_set(self):
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.set('a', {'etag': 'x'})
+        headers = self.cache.get('a')
+        self.assertEqual(headers, {'etag': 'x'})
+        headers['etag'] = 'changed'
+        self.assertEqual(self.cache.get('a'), {'etag': 'x'})
+        self.assertEqual(self.cache.counts,
+                         {'hits': 2, 'misses': 1, 'evictions': 0})
+
+    def test_ttl(self):
+        cache = MetadataCache(ttl=-1)
+        cache.set('a', {})
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru(self):
+        for key in 'abc':
+            self.cache.set(key, {})
+        self.cache.get('a')
+        self.cache.set('d', {})
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertNotEqual(self.cache.get('a'), None)
+        self.assertEqual(self.cache.counts['evictions'], 1)
+
+    def test_invalidate(self):
+        for key in ['c', 'c/o', 'c/p', 'co']:
+            self.cache.set(key, {})
+        self.cache.invalidate('c/o')
+        self.assertEqual(self.cache.get('c/o'), None)
+        self.cache.invalidate('c', prefix=True)
+        self.assertEqual(len(self.cache), 1)
+        self.assertNotEqual(self.cache.get('co'), None)
+
+    def test_stale_set_dropped(self):
+        version = self.cache.version
+        self.cache.invalidate('a')
+        self.cache.set('a', {}, version=version)
+        self.assertEqual(self.cache.get('a'), None)
+
+    def setUp(self):
+        self.cache = MetadataCache(maxsize=3)
+
+
+class ContentCacheTest(unittest.TestCase):
+    def _fetch(self, content='content', etag='v1'):
+        """ Returns a fetch callable for a server holding content """
+        calls = []
+
+        def _fetch(if_none_match):
+            calls.append(if_none_match)
+            if if_none_match == etag:
+                return None
+            return {'ETag': etag}, [content[:3], content[3:]]
+        return _fetch, calls
+
+    def _get(self, cache, fetch, key='http://host/c/o'):
+        headers, chunks = cache.get(key, fetch, chunk_size=4)
+        return headers, ''.join(chunks)
+
+    def test_revalidates_with_etag(self):
+        fetch, calls = self._fetch()
+        self.assertEqual(self._get(self.cache, fetch),
+                         ({'etag': 'v1'}, 'content'))
+        # Another process sharing the directory
+        other = ContentCache(self.tmp)
+        self.assertEqual(self._get(other, fetch),
+                         ({'etag': 'v1'}, 'content'))
+        self.assertEqual(calls, [None, 'v1'])
+        self.assertEqual(other.counts['revalidated'], 1)
+
+    def test_changed(self):
+        fetch, calls = self._fetch()
+        self._get(self.cache, fetch)
+        fetch, calls = self._fetch('new content', etag='v2')
+        self.assertEqual(self._get(self.cache, fetch)[1], 'new content')
+        self.assertEqual(self._get(self.cache, fetch)[1], 'new content')
+        self.assertEqual(calls, ['v1', 'v2'])
+        self.assertEqual(self.cache.counts['misses'], 2)
+
+    def test_fresh(self):
+        cache = ContentCache(self.tmp, fresh=60)
+        fetch, calls = self._fetch()
+        self._get(cache, fetch)
+        self.assertEqual(self._get(cache, fetch)[1], 'content')
+        self.assertEqual(calls, [None])
+        self.assertEqual(cache.counts['hits'], 1)
+
+    def test_lru_eviction(self):
+        cache = ContentCache(self.tmp, max_size=200)
+        fetch, calls = self._fetch('x' * 50)
+        for key in ['a', 'b']:
+            self._get(cache, fetch, key)
+        # a was used last, so b goes
+        os.utime(cache._path('b'), (time.time() - 10, time.time()))
+        self._get(cache, fetch, 'c')
+        self.assertTrue(os.path.exists(cache._path('a')))
+        self.assertFalse(os.path.exists(cache._path('b')))
+        self.assertEqual(cache.counts['evictions'], 1)
+
+    def test_not_stored(self):
+        cache = ContentCache(self.tmp, max_size=5)
+        fetch, calls = self._fetch()
+        self.assertEqual(self._get(cache, fetch)[1], 'content')
+        self.assertEqual(self._get(self.cache,
+                                   lambda etag: ({}, ['abc']), 'b')[1],
+                         'abc')
+        # Abandoned while streaming
+        headers, chunks = self.cache.get('c', fetch)
+        next(chunks)
+        chunks.close()
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_invalidate(self):
+        fetch, calls = self._fetch()
+        self._get(self.cache, fetch)
+        self.cache.invalidate('http://host/c/o')
+        self._get(self.cache, fetch)
+        self.assertEqual(calls, [None, None])
+
+    def test_corrupt(self):
+        fetch, calls = self._fetch()
+        open(self.cache._path('http://host/c/o'), 'wb').write('garbage')
+        self.assertEqual(self._get(self.cache, fetch)[1], 'content')
+        self.assertEqual(calls, [None])
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = ContentCache(self.tmp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+class BlockCacheTest(unittest.TestCase):
+    def _fetch(self, spec, etag=None):
+        """ Serves a Range request of self.content """
+        if etag is not None:
+            self.revalidations.append(spec)
+            if etag == self.etag:
+                return None
+        self.requests.append(spec)
+        first, last = spec[len('bytes='):].split('-')
+        size = len(self.content)
+        if not first:
+            first, last = size - int(last), size - 1
+        first = int(first)
+        last = min(size - 1, int(last)) if last else size - 1
+        return ({'Content-Range': 'bytes %s-%s/%s' % (first, last, size),
+                 'ETag': self.etag},
+                self.content[first:last + 1])
+
+    def _read(self, first, last, cache=None):
+        return (cache or self.cache).read('o', first, last, self._fetch)
+
+    def test_aligned_to_blocks(self):
+        self.assertEqual(self._read(5, 12), self.content[5:13])
+        self.assertEqual(self._read(20, 25), self.content[20:26])
+        self.assertEqual(self._read(2, 28), self.content[2:29])
+        self.assertEqual(self._read(95, None), self.content[95:])
+        self.assertEqual(self._read(None, 3), self.content[-3:])
+        self.assertEqual(self.requests, ['bytes=0-19', 'bytes=20-29',
+                                         'bytes=90-99'])
+        self.assertEqual(self.cache.stats('o'),
+                         {'hits': 4, 'misses': 4, 'requests': 3,
+                          'hit_ratio': 0.5})
+
+    def test_coalesces_misses(self):
+        self._read(0, 0)
+        self._read(25, 25)
+        self.requests = []
+        self.assertEqual(self._read(0, 59), self.content[:60])
+        self.assertEqual(self.requests, ['bytes=10-19', 'bytes=30-59'])
+
+    def test_suffix_first(self):
+        self.assertEqual(self._read(None, 15), self.content[-15:])
+        self.assertEqual(self._read(90, 99), self.content[90:])
+        self.assertEqual(self.requests, ['bytes=-15'])
+
+    def test_sequential_prefetch(self):
+        for offset in range(0, 50, 5):
+            self.assertEqual(self._read(offset, offset + 4),
+                             self.content[offset:offset + 5])
+        self.assertEqual(self.requests, ['bytes=0-9', 'bytes=10-39',
+                                         'bytes=40-69'])
+        self.assertEqual(self.cache.counts['prefetched'], 4)
+
+    def test_lru_budget(self):
+        cache = BlockCache(block_size=10, max_bytes=30)
+        for first in [0, 10, 50, 0, 70]:
+            self._read(first, first + 9, cache)
+        self.requests = []
+        self._read(0, 9, cache)
+        self._read(10, 19, cache)
+        self.assertEqual(self.requests, ['bytes=10-19'])
+        self.assertEqual(cache.counts['evictions'], 2)
+
+    def test_changed_object(self):
+        self._read(0, 19)
+        self.content = self.content.upper()
+        self.etag = 'v2'
+        self.assertEqual(self._read(0, 29), self.content[:30])
+        # Block 2 came from the new version already
+        self.assertEqual(self.requests[-2:], ['bytes=20-29', 'bytes=0-19'])
+        self.cache.invalidate('o')
+        self._read(0, 9)
+        self.assertEqual(self.requests[-1], 'bytes=0-9')
+
+    def test_fresh(self):
+        self._read(0, 19)
+        self._read(5, 15)
+        self.assertEqual(self.revalidations, [])
+        self.content = self.content.upper()
+        self.etag = 'v2'
+        # Blocks are served as they are within the freshness window
+        self.assertEqual(self._read(5, 15), self.content[5:16].lower())
+
+    def test_revalidates(self):
+        cache = BlockCache(block_size=10, fresh=0)
+        self._read(0, 19, cache)
+        self.assertEqual(self._read(5, 15, cache), self.content[5:16])
+        self.assertEqual(self.revalidations, ['bytes=0-9'])
+        self.assertEqual(self.requests, ['bytes=0-19'])
+        self.content = self.content.upper()
+        self.etag = 'v2'
+        self.assertEqual(self._read(5, 15, cache), self.content[5:16])
+        self.assertEqual(self.revalidations, ['bytes=0-9', 'bytes=0-9'])
+        self.assertEqual(self.requests, ['bytes=0-19', 'bytes=0-9',
+                                         'bytes=10-19'])
+        self.assertEqual(cache.counts['revalidated'], 1)
+
+    def setUp(self):
+        self.content = ''.join(chr(ord('a') + i % 26) for i in range(100))
+        self.etag = 'v1'
+        self.revalidations = []
+        self.requests = []
+        self.cache = BlockCache(block_size=10, readahead=2)
+
+
+class CachedClientTest(unittest.TestCase):
+    def _heads(self):
+        return [c[0][1] for c in self.conn.make_request.call_args_list
+                if c[0][0] == 'HEAD']
+
+    def test_load_cached(self):
+        self.client.get_object('c', 'o')
+        obj = self.client.get_object('c', 'o')
+        self.assertEqual(obj.properties['size'], 5)
+        self.client.get_container('c')
+        self.client.get_container('c')
+        self.assertEqual(self._heads(), [BASE + '/c/o', BASE + '/c'])
+        self.assertEqual(self.cache.counts['hits'], 2)
+
+    def test_cdn_load_not_cached(self):
+        self.client.storage_object('c', 'o').load(cdn=True)
+        self.client.storage_object('c', 'o').load(cdn=True)
+        self.assertEqual(len(self._heads()), 2)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_mutations_invalidate(self):
+        obj = self.client.get_object('c', 'o')
+        self.client.get_container('c')
+        obj.set_metadata({'a': 'b'})
+        self.client.get_object('c', 'o')
+        self.client.get_container('c')
+        self.assertEqual(len(self._heads()), 4)
+        obj.update({'Content-Type': 'text/plain'})
+        obj.delete()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_copy_invalidates_destination(self):
+        self.client.get_object('c', 'o')
+        self.client.get_object('d', 'p')
+        src = self.client.storage_object('c', 'o')
+        src.copy_to(self.client.storage_object('d', 'p'))
+        self.assertEqual(len(self.cache), 1)
+        self.assertNotEqual(self.cache.get(BASE + '/c/o'), None)
+
+    def test_container_delete_invalidates_objects(self):
+        self.client.get_object('c', 'o')
+        self.client.get_object('d', 'p')
+        self.client.delete_container('c')
+        self.assertEqual(self.cache.get(BASE + '/c/o'), None)
+        self.assertNotEqual(self.cache.get(BASE + '/d/p'), None)
+
+    def test_bulk_delete_invalidates_objects(self):
+        for path in [('c', 'o'), ('c', 'p q'), ('d', 'r')]:
+            self.client.get_object(*path)
+        self.conn.make_request.side_effect = \
+            lambda method, url, formatter=None, **kwargs: formatter(
+                Mock(content='{"Number Deleted": 2, "Errors": []}'))
+        self.client.get_capabilities = Mock(return_value={'bulk_delete': {}})
+        BulkDeleter(self.client).delete(
+            [self.client.storage_object('c', 'o'),
+             self.client.storage_object('c', 'p q')])
+        self.assertEqual(self.cache.get(BASE + '/c/o'), None)
+        self.assertEqual(self.cache.get(BASE + '/c/p%20q'), None)
+        self.assertNotEqual(self.cache.get(BASE + '/d/r'), None)
+
+    def test_send_invalidates(self):
+        self.client.get_object('c', 'o')
+        upload = self.conn.chunk_upload.return_value
+        upload.finish.return_value = Mock(headers={'etag': 'x'})
+        self.client.storage_object('c', 'o').send('hello', check_md5=False)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_content_cached(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.client.content_cache = ContentCache(tmp)
+
+        def _make_request(method, url, headers=None, formatter=None,
+                          **kwargs):
+            if (headers or {}).get('If-None-Match') == 'x':
+                raise ResponseError(304, '304 Redirection')
+            res = Response()
+            res.status_code = 200
+            res.headers = {'etag': 'x'}
+            res.content = 'hello'
+            return formatter(res)
+        self.conn.make_request.side_effect = _make_request
+        obj = self.client.storage_object('c', 'o')
+        self.assertEqual(obj.read(), 'hello')
+        self.assertEqual(obj.read(), 'hello')
+        self.assertEqual(''.join(obj.chunk_download()), 'hello')
+        self.assertEqual(self.client.content_cache.counts['revalidated'], 2)
+        # Ranged reads go to the server
+        obj.read(size=2)
+        self.assertEqual(self.conn.make_request.call_count, 4)
+        self.assertEqual(self.conn.make_request.call_args[1]['headers'],
+                         {'Range': 'bytes=0-1'})
+
+        obj.delete()
+        self.assertFalse(os.path.exists(
+            self.client.content_cache._path(BASE + '/c/o')))
+
+    def test_not_modified_response_closed(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.client.content_cache = ContentCache(tmp)
+        responses = []
+
+        def _make_request(method, url, headers=None, formatter=None,
+                          **kwargs):
+            res = Mock(headers={'etag': 'x'}, content='hello',
+                       status_code=200)
+            res.iter_content.return_value = ['hello']
+            if (headers or {}).get('If-None-Match') == 'x':
+                res.status_code = 304
+            responses.append(res)
+            return formatter(res)
+        self.conn.make_request.side_effect = _make_request
+        obj = self.client.storage_object('c', 'o')
+        self.assertEqual(obj.read(), 'hello')
+        self.assertEqual(obj.read(), 'hello')
+        self.assertEqual(responses[1].status_code, 304)
+        responses[1].close.assert_called_once_with()
+
+    def test_ranges_cached(self):
+        self.client.block_cache = BlockCache(block_size=4)
+
+        def _make_request(method, url, headers=None, formatter=None,
+                          **kwargs):
+            res = Response()
+            res.status_code = 206
+            res.headers = {'content-range': 'bytes 0-7/10', 'etag': 'x'}
+            res.content = '01234567'
+            if formatter:
+                return formatter(res)
+            return res
+        self.conn.make_request.side_effect = _make_request
+        obj = self.client.storage_object('c', 'o')
+        self.assertEqual(obj.read(size=3, offset=1), '123')
+        self.assertEqual(obj.read(size=4, offset=2), '2345')
+        self.assertEqual(obj.read(size=2), '01')
+        self.assertEqual(self.conn.make_request.call_count, 1)
+        self.assertEqual(self.conn.make_request.call_args[1]['headers'],
+                         {'Range': 'bytes=0-3'})
+        # Other requests with a Range header go to the server
+        obj.read(size=2, headers={'If-Match': 'x'})
+        self.client.make_request('GET', 'c', headers={'Range': 'bytes=0-1'})
+        self.assertEqual(self.conn.make_request.call_count, 3)
+
+        obj.delete()
+        self.assertEqual(self.client.block_cache.stats(BASE + '/c/o')['hits'],
+                         3)
+        obj.read(size=2)
+        self.assertEqual(self.conn.make_request.call_count, 5)
+
+    def test_ranges_revalidated(self):
+        self.client.block_cache = BlockCache(block_size=4, fresh=0)
+        statuses = [206, 304]
+
+        def _make_request(method, url, headers=None, formatter=None,
+                          **kwargs):
+            res = Response()
+            res.status_code = statuses.pop(0)
+            res.headers = {'content-range': 'bytes 0-3/10', 'etag': 'x'}
+            res.content = '0123'
+            if res.status_code == 304:
+                raise ResponseError(304, 'Not Modified')
+            return formatter(res)
+        self.conn.make_request.side_effect = _make_request
+        obj = self.client.storage_object('c', 'o')
+        self.assertEqual(obj.read(size=2), '01')
+        self.assertEqual(obj.read(size=2, offset=1), '12')
+        self.assertEqual(self.conn.make_request.call_args[1]['headers'],
+                         {'Range': 'bytes=0-3', 'If-None-Match': 'x'})
+
+    def test_range(self):
+        for value, span in [('bytes=0-0', (0, 0)), ('bytes=5-', (5, None)),
+                            ('bytes=-5', (None, 5)), ('bytes=-0', None),
+                            ('bytes=-', None), ('bytes=0-1,4-5', None)]:
+            self.assertEqual(
+                self.client._range((), {'headers': {'Range': value}}), span)
+
+    def setUp(self):
+        self.conn = Mock()
+        self.conn.storage_url = BASE
+
+        def _make_request(method, url, *args, **kwargs):
+            res = Response()
+            res.status_code = 200
+            res.headers = {'content-length': '5', 'etag': 'x'}
+            formatter = kwargs.get('formatter')
+            if formatter:
+                return formatter(res)
+            return res
+        self.conn.make_request.side_effect = _make_request
+        self.cache = MetadataCache()
+        self.client = Client('user', 'key', connection=self.conn,
+                             metadata_cache=self.cache)
+
+if __name__ == "__main__":
+    unittest.main()
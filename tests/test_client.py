@@ -157,6 +157,20 @@ class ClientTest(unittest.TestCase):
                                                              headers=_headers,
                                                              size=_size)
 
+    def test_get_capabilities(self):
+        self.connection.storage_url = 'https://host:8080/v1/AUTH_a'
+        self.connection.make_request.return_value = {'bulk_delete': {}}
+        self.assertEqual(self.client.get_capabilities(), {'bulk_delete': {}})
+        self.client.get_capabilities()
+        self.assertEqual(self.connection.make_request.call_count, 1)
+        self.assertEqual(self.connection.make_request.call_args[0],
+                         ('GET', 'https://host:8080/info'))
+
+    def test_get_capabilities_unsupported(self):
+        self.connection.storage_url = 'https://host/v1/AUTH_a'
+        self.connection.make_request.side_effect = ResponseError(404, '')
+        self.assertEqual(self.client.get_capabilities(), {})
+
     def test_getitem(self):
         _container = Mock()
         self.client.container = Mock(return_value=_container)
@@ -2,9 +2,15 @@ try:
     import unittest2 as unittest
 except ImportError:
     import unittest
-from mock import Mock
+import hashlib
+import os
+import shutil
+import tempfile
+
+from mock import Mock, patch
+from object_storage.utils import json
 from object_storage.container import Container
-from object_storage.storage_object import StorageObject
+from object_storage.storage_object import StorageObject, StorageObjectEntry
 
 
 class ContainerTest(unittest.TestCase):
@@ -24,17 +30,23 @@ class ContainerTest(unittest.TestCase):
     def test_delete_recursive(self):
         self.container.delete_all_objects = Mock()
         self.container.delete(recursive=True)
-        self.container.delete_all_objects.called_once_with()
+        self.container.delete_all_objects.assert_called_once_with()
         self.client.delete_container.called_once_with(self.container.name)
 
     def test_delete_all_objects(self):
         _item1 = Mock()
         _item2 = Mock()
-        self.container.objects = Mock(return_value=[_item1, _item2])
-        self.container.delete_all_objects()
-        self.container.objects.called_once_with()
-        _item1.delete.assert_called_once_with()
-        _item2.delete.assert_called_once_with()
+        self.client.get_capabilities.return_value = {}
+        self.client.delete_object.return_value = True
+        self.container.iter_objects = Mock(return_value=[_item1, _item2])
+        counts = self.container.delete_all_objects(prefix='p')
+        self.container.iter_objects.assert_called_once_with(prefix='p',
+                                                            lightweight=True)
+        self.client.delete_object.assert_any_call(_item1.container,
+                                                  _item1.name)
+        self.client.delete_object.assert_any_call(_item2.container,
+                                                  _item2.name)
+        self.assertEqual(counts, {'deleted': 2, 'not_found': 0, 'failed': 0})
 
     def test_delete_object(self):
         self.container.delete_object('OBJECT')
@@ -47,7 +59,129 @@ class ContainerTest(unittest.TestCase):
         self.client.delete_object.called_once_with(self.container, 'OBJECT')
 
     def test_list(self):
-        pass
+        self._listing([['a', 'b'], ['c']])
+        objects = self.container.objects(limit=2, prefix='p')
+        self.assertEqual(sorted(o.name for o in objects), ['a', 'b'])
+        self.assertEqual(self.client.make_request.call_args[1]['params'],
+                         {'format': 'json', 'limit': 2, 'prefix': 'p'})
+
+    def test_iter_objects(self):
+        self._listing([['a', 'b'], ['c', 'd'], []])
+        for prefetch in (True, False):
+            self.client.make_request.reset_mock()
+            names = [o.name for o in
+                     self.container.iter_objects(prefetch=prefetch)]
+            self.assertEqual(names, ['a', 'b', 'c', 'd'])
+            markers = [c[1]['params'].get('marker') for c in
+                       self.client.make_request.call_args_list]
+            self.assertEqual(markers, [None, 'b', 'd'])
+
+    def test_iter_objects_lightweight(self):
+        self._listing([['a', 'b'], []])
+        objects = list(self.container.iter_objects(lightweight=True))
+        self.assertEqual([o.name for o in objects], ['a', 'b'])
+        self.assertTrue(isinstance(objects[0], StorageObjectEntry))
+        self.assertEqual(objects[0].container, 'CONTAINER')
+
+    def test_iter_objects_short_page(self):
+        self._listing([['a', 'b'], ['c']])
+        names = [o.name for o in self.container.iter_objects(page_size=2)]
+        self.assertEqual(names, ['a', 'b', 'c'])
+        self.assertEqual(self.client.make_request.call_count, 2)
+
+    def test_iter_objects_subdir_marker(self):
+        self._listing([[{'subdir': 'dir/'}], []])
+        objects = list(self.container.iter_objects(base_only=True))
+        self.assertEqual(objects[0].name, 'dir')
+        self.assertTrue(objects[0].is_dir())
+        self.assertEqual(
+            self.client.make_request.call_args[1]['params']['marker'], 'dir/')
+
+    def test_iter(self):
+        self.container.iter_objects = Mock(return_value=iter([1, 2]))
+        self.assertEqual(list(self.container), [1, 2])
+
+    def _listing(self, pages):
+        """ Makes the client return the given listing pages in order """
+        pages = [json.dumps([isinstance(i, dict) and i or {'name': i}
+                             for i in page]) for page in pages]
+
+        def _make_request(method, path, params=None, headers=None,
+                          formatter=None):
+            marker = params.get('marker')
+            index = 0
+            if marker:
+                index = [i for i, p in enumerate(pages)
+                         if '"%s"' % marker in p][0] + 1
+            res = Mock()
+            res.content = pages[index]
+            return formatter(res)
+        self.client.make_request.side_effect = _make_request
+        self.client.storage_object.side_effect = \
+            lambda container, name, headers=None: StorageObject(
+                container, name, headers=headers, client=self.client)
+
+    def _download_directory(self, entries, **kwargs):
+        """ Downloads the given (name, content) pairs into a temp dir """
+        listing = []
+        for name, content in entries:
+            obj = Mock()
+            obj.save_to_filename.side_effect = \
+                lambda filename, content=content: open(
+                    filename, 'wb').write(content)
+            entry = StorageObjectEntry(
+                'CONTAINER', name, bytes=len(content or ''),
+                hash=hashlib.md5(content or '').hexdigest(),
+                content_type=content is None and 'application/directory'
+                or 'text/plain', client=self.client)
+            entry._object = obj
+            listing.append(entry)
+        self.container.iter_objects = Mock(return_value=iter(listing))
+        return self.container.download_directory(self.tmp, **kwargs)
+
+    def test_download_directory(self):
+        self.client.delimiter = '/'
+        counts = self._download_directory([('tree/dir', None),
+                                           ('tree/dir/a', 'aaa'),
+                                           ('tree/b', 'b'),
+                                           ('tree/../escape', 'x')],
+                                          prefix='tree/')
+        self.assertEqual(counts, {'downloaded': 2, 'skipped': 2})
+        self.assertEqual(open(os.path.join(self.tmp, 'dir', 'a')).read(),
+                         'aaa')
+        self.assertEqual(sorted(os.listdir(self.tmp)), ['b', 'dir'])
+        self.container.iter_objects.assert_called_once_with(
+            prefix='tree/', lightweight=True)
+
+    def test_download_directory_skip_unchanged(self):
+        self.client.delimiter = '/'
+        open(os.path.join(self.tmp, 'same'), 'wb').write('same')
+        open(os.path.join(self.tmp, 'changed'), 'wb').write('old')
+        counts = self._download_directory([('same', 'same'),
+                                           ('changed', 'new')])
+        self.assertEqual(counts, {'downloaded': 1, 'skipped': 1})
+        self.assertEqual(open(os.path.join(self.tmp, 'changed')).read(),
+                         'new')
+
+    def test_download_directory_marker_race(self):
+        self.client.delimiter = '/'
+        makedirs = os.makedirs
+
+        def _raced(path):
+            # Another worker creates the directory first
+            makedirs(path)
+            raise OSError(17, 'File exists')
+        with patch('os.makedirs', _raced):
+            counts = self._download_directory([('dir', None)])
+        self.assertEqual(counts, {'downloaded': 0, 'skipped': 1})
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp, 'dir')))
+
+    def test_sync(self):
+        self.client.delimiter = '/'
+        self.container.iter_objects = Mock(return_value=iter([]))
+        open(os.path.join(self.tmp, 'a'), 'w').write('a')
+        plan = self.container.sync(self.tmp, prefix='p/', dry_run=True)
+        self.assertEqual(plan.new, ['p/a'])
 
     def test_search(self, *args, **kwargs):
         self.container.search('query')
@@ -102,6 +236,10 @@ class ContainerTest(unittest.TestCase):
     def setUp(self):
         self.client = Mock()
         self.container = Container('CONTAINER', client=self.client)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,118 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import socket
+import threading
+import time
+
+from mock import Mock
+
+from object_storage import deadline
+from object_storage.deadline import Deadline
+from object_storage.errors import DeadlineExceeded, ResponseError, \
+    TimeoutError
+from object_storage.retry import RetryPolicy
+from object_storage.transport import httplib2conn
+from object_storage.utils import imap_unordered
+
+
+class DeadlineTest(unittest.TestCase):
+    def test_clamp(self):
+        self.assertEqual(deadline.clamp(5), 5)
+        self.assertEqual(deadline.clamp(None), None)
+        with Deadline(1):
+            self.assertTrue(0.9 < deadline.clamp(5) <= 1)
+            self.assertTrue(0.9 < deadline.clamp(None) <= 1)
+            self.assertEqual(deadline.clamp(0.5), 0.5)
+        self.assertEqual(deadline.current(), None)
+
+    def test_nested_cannot_extend(self):
+        with Deadline(1) as outer:
+            with Deadline(10) as inner:
+                self.assertEqual(inner.expires, outer.expires)
+                self.assertTrue(deadline.current() is inner)
+            with Deadline(0.5) as inner:
+                self.assertTrue(inner.expires < outer.expires)
+            self.assertTrue(deadline.current() is outer)
+
+    def test_expired(self):
+        with Deadline(-1):
+            self.assertRaises(DeadlineExceeded, deadline.clamp, 5)
+
+    def test_bind(self):
+        seen = []
+
+        def _remaining():
+            seen.append(deadline.remaining())
+        with Deadline(1):
+            thread = threading.Thread(target=deadline.bind(_remaining))
+        thread.start()
+        thread.join()
+        self.assertTrue(0 < seen[0] <= 1)
+
+    def test_imap_unordered(self):
+        with Deadline(1):
+            left = list(imap_unordered(lambda i: deadline.remaining(),
+                                       range(4), workers=2))
+        self.assertEqual(len(left), 4)
+        self.assertTrue(all(0 < seconds <= 1 for seconds in left))
+
+    def test_retry_stops_at_deadline(self):
+        policy = RetryPolicy(retries=10, backoff=0.5)
+        func = Mock(side_effect=ResponseError(503, ''))
+        with Deadline(0.2):
+            self.assertRaises(ResponseError, policy.call, func)
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(policy.counts['exhausted'], 1)
+
+    def test_deadline_exceeded_not_retried(self):
+        policy = RetryPolicy(backoff=0)
+        func = Mock(side_effect=DeadlineExceeded())
+        self.assertRaises(DeadlineExceeded, policy.call, func)
+        self.assertEqual(func.call_count, 1)
+        self.assertTrue(policy.is_retryable(TimeoutError()))
+
+
+class HungServerTest(unittest.TestCase):
+    """ Requests to a server that accepts connections but never answers """
+    def test_read_timeout(self):
+        conn = self._connection(read_timeout=0.05)
+        start = time.time()
+        self.assertRaises(TimeoutError, conn.make_request, 'GET', self.url)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_per_call_timeout(self):
+        conn = self._connection(read_timeout=None)
+        self.assertRaises(TimeoutError, conn.make_request, 'GET', self.url,
+                          timeout=0.05)
+
+    def test_deadline(self):
+        conn = self._connection(read_timeout=None)
+        start = time.time()
+        with Deadline(0.1):
+            self.assertRaises(DeadlineExceeded, conn.make_request, 'GET',
+                              self.url)
+            self.assertRaises(DeadlineExceeded, conn.make_request, 'GET',
+                              self.url)
+        self.assertTrue(time.time() - start < 1)
+
+    def _connection(self, **kwargs):
+        auth = Mock()
+        auth.authenticated = True
+        auth.auth_headers = {}
+        auth.storage_url = self.url
+        return httplib2conn.AuthenticatedConnection(auth, **kwargs)
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(8)
+        self.url = 'http://127.0.0.1:%d/v1/AUTH' % \
+            self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+if __name__ == "__main__":
+    unittest.main()
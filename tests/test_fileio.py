@@ -0,0 +1,273 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import gc
+import io
+import os
+import threading
+from hashlib import md5
+
+from mock import Mock
+
+from object_storage.errors import ResponseError
+from object_storage.fileio import ObjectReader, ObjectWriter
+from object_storage.storage_object import StorageObject
+
+
+class ObjectReaderTest(unittest.TestCase):
+    def _chunk_download(self, path, chunk_size=None, headers=None):
+        """ Streams self.content like a server answering Range requests """
+        self.ranges.append((headers or {}).get('Range'))
+        start = 0
+        if headers:
+            start = int(headers['Range'][len('bytes='):-1])
+            if start >= len(self.content):
+                raise ResponseError(416, 'Requested Range Not Satisfiable')
+        for offset in range(start, len(self.content), chunk_size):
+            self.sent += 1
+            yield self.content[offset:offset + chunk_size]
+
+    def _head(self, method, path, headers=None, formatter=None):
+        return formatter(Mock(headers={'content-length': '100'}))
+
+    def test_sequential_reads_share_a_response(self):
+        f = self.obj.open(readahead=10)
+        self.assertEqual(f.read(3), self.content[:3])
+        self.assertEqual(f.read(12), self.content[3:15])
+        self.assertEqual(f.read(), self.content[15:])
+        self.assertEqual(f.read(), b'')
+        self.assertEqual(self.ranges, [None])
+        self.assertEqual(self.sent, 10)
+
+    def test_seek(self):
+        f = self.obj.open(readahead=10)
+        f.seek(50)
+        self.assertEqual(f.read(5), self.content[50:55])
+        self.assertEqual(f.tell(), 55)
+        f.seek(-10, os.SEEK_END)
+        self.assertEqual(f.read(), self.content[-10:])
+        f.seek(5)
+        self.assertEqual(f.read(2), self.content[5:7])
+        self.assertEqual(self.ranges, ['bytes=50-', 'bytes=90-', 'bytes=5-'])
+        self.assertEqual(len(self.obj.client.make_request.call_args_list),
+                         1)
+
+    def test_short_forward_seek_reads_through(self):
+        raw = ObjectReader(self.obj, readahead=10)
+        raw.read(2)
+        raw.seek(10)
+        self.assertEqual(raw.read(3), self.content[10:13])
+        raw.seek(3, os.SEEK_CUR)
+        self.assertEqual(raw.read(2), self.content[16:18])
+        self.assertEqual(raw.requests, 1)
+        raw.seek(50)
+        raw.read(1)
+        self.assertEqual(raw.requests, 2)
+
+    def test_readinto(self):
+        raw = ObjectReader(self.obj, readahead=10)
+        buff = bytearray(16)
+        self.assertEqual(raw.readinto(buff), 10)
+        self.assertEqual(raw.readinto(memoryview(buff)[10:]), 6)
+        self.assertEqual(bytes(buff), self.content[:16])
+
+    def test_past_end(self):
+        f = self.obj.open()
+        f.seek(200)
+        self.assertEqual(f.read(), b'')
+        empty = ObjectReader(self.obj)
+        self.content = b''
+        self.assertEqual(empty.read(), b'')
+
+    def test_errors(self):
+        self.assertRaises(ValueError, self.obj.open, 'wt')
+        f = self.obj.open()
+        self.assertRaises(ValueError, f.seek, -1)
+        f.close()
+        self.assertRaises(ValueError, f.read)
+
+    def test_close_closes_response(self):
+        raw = ObjectReader(self.obj, readahead=10)
+        raw.read(1)
+        stream = raw._stream
+        raw.close()
+        self.assertRaises(StopIteration, next, stream)
+
+    def test_text_wrapper(self):
+        self.content = b'line 1\nline 2\n'
+        f = io.TextIOWrapper(self.obj.open(), encoding='utf-8')
+        self.assertEqual(list(f), [u'line 1\n', u'line 2\n'])
+
+    def setUp(self):
+        self.content = bytes(bytearray(ord('a') + i % 26 for i in range(100)))
+        self.ranges = []
+        self.sent = 0
+        client = Mock()
+        client.chunk_download.side_effect = self._chunk_download
+        client.make_request.side_effect = self._head
+        self.obj = StorageObject('container', 'object', client=client)
+
+
+class FakeUpload(object):
+    def __init__(self, test, path):
+        self.test = test
+        self.path = path
+        self.chunks = []
+        self.aborted = False
+
+    def send(self, chunk):
+        self.test.senders.add(threading.current_thread().name)
+        if self.test.failing:
+            raise ResponseError(0, 'Disconnected')
+        self.chunks.append(chunk)
+
+    def finish(self):
+        data = b''.join(self.chunks)
+        self.test.stored['/'.join(self.path)] = data
+        return Mock(headers={'etag': md5(data).hexdigest()})
+
+    def abort(self):
+        self.aborted = True
+
+
+class ObjectWriterTest(unittest.TestCase):
+    def _chunk_upload(self, path, size=None, headers=None):
+        upload = FakeUpload(self, path)
+        self.uploads.append(upload)
+        return upload
+
+    def test_buffers_into_chunks(self):
+        f = self.obj.open('wb', chunk_size=4)
+        for piece in [b'ab', b'cde', bytearray(b'fghij'), b'k']:
+            f.write(piece)
+        self.assertEqual(f.tell(), 11)
+        self.assertEqual(self.stored, {})
+        self.assertTrue(f.close() is self.obj)
+        self.assertEqual(self.uploads[0].chunks, [b'abcd', b'efgh', b'ijk'])
+        self.assertEqual(self.uploads[0].path[0], 'c_segments')
+        # The single segment is copied to the object and deleted
+        self.assertEqual(self.stored, {'c/o': b'abcdefghijk'})
+        self.assertEqual(self.requests[0][0], 'COPY')
+        self.assertEqual(self.obj.model['size'], 11)
+        self.assertFalse(threading.current_thread().name in self.senders)
+
+    def test_small_uploaded_to_object(self):
+        f = self.obj.open('wb', chunk_size=4)
+        f.write(b'abc')
+        f.close()
+        self.assertEqual(self.stored, {'c/o': b'abc'})
+        self.assertEqual(self.requests, [])
+        self.assertEqual(self.obj.model['size'], 3)
+        self.client.invalidate.assert_called_with(['c', 'o'])
+
+    def test_empty(self):
+        with self.obj.open('wb'):
+            pass
+        self.assertEqual(self.stored, {'c/o': b''})
+
+    def test_segmented(self):
+        f = self.obj.open('wb', chunk_size=3, segment_size=4)
+        f.write(b'0123456789')
+        f.close()
+        prefix = self.uploads[0].path[1][:-len('00000000')]
+        self.assertTrue(prefix.startswith('o/'))
+        self.assertEqual(self.stored, {'c_segments/%s00000000' % prefix:
+                                       b'0123',
+                                       'c_segments/%s00000001' % prefix:
+                                       b'4567',
+                                       'c_segments/%s00000002' % prefix:
+                                       b'89'})
+        manifest, = self.client.make_request.call_args_list
+        self.assertEqual(manifest[0][:2], ('PUT', ['c', 'o']))
+        self.assertEqual(manifest[1]['headers']['X-Object-Manifest'],
+                         'c_segments/%s' % prefix)
+        self.assertEqual(self.obj.model['size'], 10)
+
+    def test_exactly_segment_size(self):
+        f = self.obj.open('wb', chunk_size=2, segment_size=4)
+        f.write(b'0123')
+        f.close()
+        self.assertEqual(self.stored, {'c/o': b'0123'})
+        self.assertEqual([method for method, path in self.requests],
+                         ['COPY'])
+
+    def test_abort_keeps_object(self):
+        self.stored['c/o'] = b'old'
+        f = self.obj.open('wb', chunk_size=2, segment_size=4)
+        f.write(b'012345')
+        while len(self.uploads) < 2:
+            f._thread.join(0.01)
+        f.abort()
+        # The finished segment is deleted, the object left alone
+        self.assertEqual(self.stored, {'c/o': b'old'})
+        self.assertTrue(self.uploads[1].aborted)
+
+    def test_dropped_writer_aborts(self):
+        self.stored['c/o'] = b'old'
+        f = self.obj.open('wb', chunk_size=4)
+        f.write(b'ab')
+        del f
+        gc.collect()
+        self.assertEqual(self.stored, {'c/o': b'old'})
+        self.assertEqual(self.uploads, [])
+
+    def test_failure(self):
+        self.failing = True
+        f = self.obj.open('wb', chunk_size=1)
+        f.write(b'a')
+        f._thread.join(0.1)
+        self.assertRaises(ResponseError, f.write, b'b')
+        self.assertRaises(ResponseError, f.close)
+        self.assertTrue(f.closed)
+        self.assertEqual(self.stored, {})
+
+    def test_exception_aborts(self):
+        try:
+            with self.obj.open('wb', chunk_size=1) as f:
+                f.write(b'abc')
+                raise KeyError
+        except KeyError:
+            pass
+        self.assertTrue(self.uploads[0].aborted)
+        self.assertEqual(self.stored, {})
+
+    def test_md5_mismatch(self):
+        self.client.chunk_upload.side_effect = None
+        self.client.chunk_upload.return_value.finish.return_value = Mock(
+            headers={'etag': 'wrong'})
+        f = ObjectWriter(self.obj)
+        f.write(b'abc')
+        self.assertRaises(AssertionError, f.close)
+
+    def test_text_wrapper(self):
+        f = io.TextIOWrapper(self.obj.open('wb'), encoding='utf-8')
+        f.write(u'caf\xe9\n')
+        f.close()
+        self.assertEqual(self.stored, {'c/o': b'caf\xc3\xa9\n'})
+
+    def _make_request(self, method, path, headers=None, formatter=None):
+        self.requests.append((method, '/'.join(path)))
+        if method == 'COPY':
+            self.stored[headers['Destination']] = \
+                self.stored['/'.join(path)]
+        return formatter(Mock(headers={}))
+
+    def setUp(self):
+        self.uploads = []
+        self.stored = {}
+        self.requests = []
+        self.senders = set()
+        self.failing = False
+        client = self.client = Mock()
+        client.chunk_upload.side_effect = self._chunk_upload
+        client.make_request.side_effect = self._make_request
+        client.delete_object.side_effect = \
+            lambda container, name: self.stored.pop('%s/%s' % (container,
+                                                               name))
+        client.storage_object.side_effect = \
+            lambda c, n: StorageObject(c, n, client=client)
+        self.obj = StorageObject('c', 'o', client=client)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import socket
+import threading
+
+from mock import Mock
+
+from object_storage.errors import NotFound, ResponseError
+from object_storage.hedge import Attempt, HedgePolicy, Timer
+from object_storage.transport import abort_connection, httplib2conn
+
+
+class HedgePolicyTest(unittest.TestCase):
+    def _warm_up(self, operation='GET object', seconds=0.001):
+        for _ in range(self.policy.min_samples):
+            self.policy.record(operation, seconds)
+
+    def _slow_first(self):
+        """ Returns func whose first attempt blocks until it is cancelled
+            and whose later attempts answer right away """
+        calls = []
+        cancelled = threading.Event()
+
+        def _func(attempt):
+            calls.append(attempt)
+            if len(calls) == 1:
+                attempt.on_cancel(cancelled.set)
+                cancelled.wait(5)
+                raise socket.error('aborted')
+            return 'hedge'
+        return _func, calls, cancelled
+
+    def test_warm_up_runs_inline(self):
+        func = Mock(return_value='result')
+        self.assertEqual(self.policy.call(func, 'GET object'), 'result')
+        self.assertEqual(self.policy.delay('GET object'), None)
+        self.assertEqual(len(self.policy._latencies['GET object']), 1)
+
+    def test_percentile(self):
+        policy = HedgePolicy(percentile=90)
+        for i in range(100):
+            policy.record('GET object', i / 1000.0)
+        self.assertEqual(policy.delay('GET object'), 0.09)
+        self.assertEqual(policy.delay('HEAD object'), None)
+
+    def test_fast_call_not_hedged(self):
+        self._warm_up()
+        func = Mock(return_value='result')
+        self.assertEqual(self.policy.call(func, 'GET object'), 'result')
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(self.policy.counts['hedged'], 0)
+        # The hedge timer of the call was dropped with it
+        self.assertEqual(self.policy._timer._pending, [])
+
+    def test_slow_call_hedged(self):
+        self._warm_up()
+        self.policy._tokens['GET object'] = 1
+        func, calls, cancelled = self._slow_first()
+        self.assertEqual(self.policy.call(func, 'GET object'), 'hedge')
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(cancelled.wait(5))
+        self.assertTrue(calls[0].cancelled)
+        self.assertEqual(self.policy.counts['hedged'], 1)
+        self.assertEqual(self.policy.counts['hedge_wins'], 1)
+
+    def test_budget(self):
+        self._warm_up()
+        func, calls, cancelled = self._slow_first()
+        # A budget of 0.1 has not earned a single hedge after one call
+        self.policy._timer.call_later(0.05, cancelled.set)
+        self.assertRaises(socket.error, self.policy.call, func, 'GET object')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.policy.counts['hedged'], 0)
+
+    def test_operation_budgets(self):
+        policy = HedgePolicy(budgets={'GET container': 1})
+        policy._earn('GET container')
+        policy._earn('GET object')
+        self.assertTrue(policy._spend('GET container'))
+        self.assertFalse(policy._spend('GET object'))
+        self.assertRaises(ValueError, HedgePolicy, budget=1.5)
+        self.assertRaises(ValueError, HedgePolicy,
+                          budgets={'GET object': 2})
+
+    def test_fast_failure_not_hedged(self):
+        self._warm_up()
+        self.policy._tokens['HEAD object'] = 1
+        self._warm_up('HEAD object')
+        func = Mock(side_effect=NotFound('Not found'))
+        self.assertRaises(NotFound, self.policy.call, func, 'HEAD object')
+        self.assertEqual(func.call_count, 1)
+
+    def test_both_fail(self):
+        self._warm_up()
+        self.policy._tokens['GET object'] = 1
+        release = threading.Event()
+        errors = [ResponseError(503, 'first'), ResponseError(503, 'second')]
+
+        def _func(attempt):
+            error = errors.pop(0)
+            if error.reason == 'first':
+                release.wait(5)
+            else:
+                release.set()
+            raise error
+        try:
+            self.policy.call(_func, 'GET object')
+        except ResponseError, ex:
+            self.assertEqual(ex.reason, 'second')
+        else:
+            self.fail('ResponseError not raised')
+
+    def setUp(self):
+        self.policy = HedgePolicy(min_delay=0.01, max_delay=0.01)
+
+
+class TimerTest(unittest.TestCase):
+    def test_cancel(self):
+        fired = threading.Event()
+        cancel = self.timer.call_later(0.01, fired.set)
+        later = self.timer.call_later(0.02, fired.set)
+        cancel()
+        self.assertEqual(len(self.timer._pending), 1)
+        later()
+        self.assertEqual(self.timer._pending, [])
+        self.assertFalse(fired.wait(0.05))
+
+    def test_earlier_call_wakes_thread(self):
+        fired = threading.Event()
+        self.timer.call_later(60, fired.set)
+        self.timer.call_later(0.01, fired.set)
+        self.assertTrue(fired.wait(5))
+        self.assertEqual(len(self.timer._pending), 1)
+
+    def setUp(self):
+        self.timer = Timer()
+
+
+class AttemptTest(unittest.TestCase):
+    def test_cancel(self):
+        attempt = Attempt()
+        callback = Mock()
+        attempt.on_cancel(callback)
+        attempt.cancel()
+        attempt.cancel()
+        callback.assert_called_once_with()
+        late = Mock()
+        attempt.on_cancel(late)
+        late.assert_called_once_with()
+
+    def test_finished_not_cancelled(self):
+        attempt = Attempt()
+        callback = Mock()
+        attempt.on_cancel(callback)
+        attempt.finish()
+        attempt.cancel()
+        self.assertFalse(callback.called)
+        self.assertFalse(attempt.cancelled)
+
+    def test_abort_connection(self):
+        left, right = socket.socketpair()
+        conn = Mock(sock=left)
+        abort_connection(conn)
+        self.assertEqual(left.recv(1), '')
+        left.close()
+        right.close()
+        abort_connection(Mock(sock=None))
+
+
+class HedgedConnectionTest(unittest.TestCase):
+    def test_operation(self):
+        for url, operation in [
+                ('http://host/v1/AUTH', 'GET account'),
+                ('http://host/v1/AUTH/?format=json', 'GET account'),
+                ('http://host/v1/AUTH/c?format=json', 'GET container'),
+                ('http://host/v1/AUTH/c/dir/o', 'GET object'),
+                ('http://other/info', 'GET other')]:
+            self.assertEqual(self.conn._operation('GET', url), operation)
+
+    def test_only_reads_hedged(self):
+        self.conn._pooled_request = Mock(
+            return_value=(Mock(status=200), 'ok'))
+        self.conn.make_request('GET', 'http://host/v1/AUTH/c/o')
+        self.conn.make_request('PUT', 'http://host/v1/AUTH/c/o')
+        self.assertEqual(self.conn.hedge_policy.counts['calls'], 1)
+        hedges = [c[1]['hedge'] for c in
+                  self.conn._pooled_request.call_args_list]
+        self.assertTrue(isinstance(hedges[0], Attempt))
+        self.assertEqual(hedges[1], None)
+
+    def test_cancelled_connection_discarded(self):
+        pool = Mock()
+        pool.get.return_value = Mock(sock=None)
+        self.conn.pool = pool
+        self.conn._request = Mock(return_value=('res', 'content'))
+        attempt = Attempt()
+        attempt.cancelled = True
+        self.conn._pooled_request('GET', 'http://host/', {}, None,
+                                  hedge=attempt)
+        pool.discard.assert_called_once_with('http://host/',
+                                             pool.get.return_value)
+        self.assertFalse(pool.put.called)
+
+    def setUp(self):
+        auth = Mock()
+        auth.authenticated = True
+        auth.auth_headers = {}
+        auth.storage_url = 'http://host/v1/AUTH'
+        self.conn = httplib2conn.AuthenticatedConnection(
+            auth, pool=Mock(), hedge_policy=HedgePolicy())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import socket
+import time
+
+from mock import Mock, patch
+
+from object_storage.errors import NotFound, ResponseError
+from object_storage.retry import RetryPolicy, parse_retry_after
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_retries_until_success(self):
+        func = Mock(side_effect=[ResponseError(503, ''), socket.timeout(),
+                                 ResponseError(0, 'Disconnected'), 'ok'])
+        self.assertEqual(self.policy.call(func, method='GET'), 'ok')
+        self.assertEqual(func.call_count, 4)
+        self.assertEqual(self.policy.counts['retries'], 3)
+        self.assertEqual(self.policy.counts['calls'], 1)
+        self.assertEqual(len(self.sleeps), 3)
+
+    def test_gives_up(self):
+        func = Mock(side_effect=ResponseError(500, ''))
+        self.assertRaises(ResponseError, self.policy.call, func)
+        self.assertEqual(func.call_count, 4)
+        self.assertEqual(self.policy.counts['exhausted'], 1)
+
+    def test_not_retried(self):
+        for exc in (ResponseError(409, ''), NotFound('Not found'),
+                    ValueError()):
+            func = Mock(side_effect=exc)
+            self.assertRaises(type(exc), self.policy.call, func)
+            self.assertEqual(func.call_count, 1)
+        self.assertEqual(self.policy.counts['exhausted'], 0)
+
+    def test_non_idempotent_not_retried(self):
+        func = Mock(side_effect=ResponseError(503, ''))
+        self.assertRaises(ResponseError, self.policy.call, func,
+                          method='POST')
+        self.assertEqual(func.call_count, 1)
+        func.reset_mock()
+        self.assertRaises(ResponseError, self.policy.call, func,
+                          method='POST', idempotent=True)
+        self.assertEqual(func.call_count, 4)
+
+    def test_decorrelated_jitter(self):
+        policy = RetryPolicy(retries=50, backoff=1, max_backoff=10)
+        state = policy.start('GET')
+        delays = [state.next_delay(ResponseError(500, ''))
+                  for _ in range(50)]
+        previous = 1
+        for delay in delays:
+            self.assertTrue(1 <= delay <= min(10, previous * 3))
+            previous = delay
+        self.assertEqual(policy.counts['backoff'], sum(delays))
+
+    def test_retry_after(self):
+        state = self.policy.start('GET')
+        self.assertEqual(
+            state.next_delay(ResponseError(429, '', retry_after='7')), 7)
+        self.assertEqual(
+            state.next_delay(ResponseError(503, '', retry_after='2')), 2)
+        # Only honored where the status asks for it
+        self.assertTrue(
+            state.next_delay(ResponseError(500, '', retry_after='7')) < 7)
+
+    def test_deadline(self):
+        policy = RetryPolicy(retries=10, deadline=5)
+        state = policy.start('GET')
+        self.assertEqual(
+            state.next_delay(ResponseError(503, '', retry_after='4')), 4)
+        self.assertEqual(
+            state.next_delay(ResponseError(503, '', retry_after='6')), None)
+        self.assertEqual(policy.counts['exhausted'], 1)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertEqual(parse_retry_after('-1'), 0)
+        self.assertEqual(parse_retry_after(None), None)
+        self.assertEqual(parse_retry_after('soon'), None)
+        now = time.mktime((2015, 10, 21, 7, 28, 0, 0, 0, 0)) - time.timezone
+        self.assertEqual(
+            parse_retry_after('Wed, 21 Oct 2015 07:28:30 GMT', now=now), 30)
+
+    def setUp(self):
+        self.policy = RetryPolicy(backoff=0.1)
+        self.sleeps = []
+        patcher = patch.object(self.policy, 'sleep', self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,8 +2,31 @@ try:
     import unittest2 as unittest
 except ImportError:
     import unittest
+import hashlib
+import os
+import shutil
+import tempfile
+
 from mock import Mock
-from object_storage.storage_object import StorageObject
+from object_storage.errors import ResponseError
+from object_storage.storage_object import StorageObject, \
+    StorageObjectEntry, StorageObjectModel
+from object_storage.transport import Response
+
+
+class FakeUpload(object):
+    def __init__(self, uploads, path, etag=None):
+        self.data = uploads[tuple(path)] = []
+        self.etag = etag
+
+    def send(self, data):
+        self.data.append(data)
+
+    def finish(self):
+        res = Response()
+        res.headers = {
+            'etag': self.etag or hashlib.md5(''.join(self.data)).hexdigest()}
+        return res
 
 
 class ClientTest(unittest.TestCase):
@@ -49,6 +72,14 @@ class ClientTest(unittest.TestCase):
                                                    self.obj.name,
                                                    headers=None)
 
+    def test_delete_recursive(self):
+        self.client.delimiter = '/'
+        self.obj.delete(recursive=True, workers=2)
+        self.client.container.assert_called_once_with('CONTAINER')
+        self.client.container().delete_all_objects.assert_called_once_with(
+            prefix='NAME/', workers=2)
+        self.client.delete_object.assert_called_once_with('CONTAINER', 'NAME')
+
     def test_read(self):
         _result = Mock()
         self.obj.make_request = Mock(return_value=_result)
@@ -74,6 +105,178 @@ class ClientTest(unittest.TestCase):
         self.assertEqual(self.obj.make_request.call_args[1]['headers'],
                          {'Range': 'bytes=2222-'})
 
+        self.obj.read(size=1111, offset=0)
+        self.assertEqual(self.obj.make_request.call_args[1]['headers'],
+                         {'Range': 'bytes=0-1110'})
+
+    def _parallel_download(self, data, etag):
+        def _read(size=None, offset=None):
+            return data[offset:offset + size]
+        self.obj.load = Mock()
+        self.obj.model = StorageObjectModel(
+            self.obj, 'CONTAINER', 'NAME',
+            {'content-length': len(data), 'etag': etag})
+        self.obj.read = Mock(side_effect=_read)
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        self.obj.save_to_filename(filename, workers=3, range_size=10)
+        return filename
+
+    def test_save_to_filename_parallel(self):
+        data = ''.join(chr(i) for i in range(256)) * 3
+        filename = self._parallel_download(data, hashlib.md5(data).hexdigest())
+        self.assertEqual(open(filename, 'rb').read(), data)
+        self.assertEqual(self.obj.read.call_count, 77)
+        self.obj.read.assert_any_call(size=8, offset=760)
+
+    def test_save_to_filename_parallel_bad_md5(self):
+        self.assertRaises(AssertionError, self._parallel_download,
+                          'x' * 100, 'bad-etag')
+
+    def _send_segmented(self, data, etag=None, failing=None, **kwargs):
+        uploads = self.uploads = {}
+        self.client.storage_object.side_effect = \
+            lambda container, name, headers=None: StorageObject(
+                container, name, client=self.client)
+
+        def _chunk_upload(path, size=None, headers=None):
+            if failing is not None and \
+                    path[1].endswith('/%08d' % (failing, )):
+                raise ResponseError(500, 'Internal Server Error')
+            return FakeUpload(uploads, path, etag)
+        self.client.chunk_upload.side_effect = _chunk_upload
+
+        def _make_request(method, path, headers=None, formatter=None):
+            res = Response()
+            res.headers = {'etag': 'd41d8cd98f00b204e9800998ecf8427e'}
+            return formatter(res)
+        self.client.make_request.side_effect = _make_request
+        self.obj.send_segmented(data, segment_size=10, workers=3, **kwargs)
+        return uploads
+
+    def _check_segments(self, data, uploads):
+        self.assertEqual(len(uploads), 3)
+        names = sorted(uploads)
+        self.assertEqual(names[0][0], 'CONTAINER_segments')
+        self.assertTrue(names[0][1].startswith('NAME/'))
+        self.assertTrue(names[0][1].endswith('/10/00000000'))
+        self.assertEqual(''.join(''.join(uploads[n]) for n in names), data)
+
+        headers = self.client.make_request.call_args[1]['headers']
+        self.assertEqual(headers['X-Object-Manifest'],
+                         'CONTAINER_segments/%s' % names[0][1][:-8])
+        self.assertEqual(self.obj.model['manifest'],
+                         headers['X-Object-Manifest'])
+        self.assertEqual(self.obj.model['size'], len(data))
+        self.assertEqual(self.obj.model['hash'], None)
+
+    def test_send_read_error_aborts(self):
+        data = Mock(spec=['read'])
+        data.read.side_effect = IOError()
+        upload = self.client.chunk_upload.return_value = Mock(
+            spec=['send', 'finish', 'abort'])
+        self.assertRaises(IOError, self.obj.send, data)
+        upload.abort.assert_called_once_with()
+
+    def test_send_segmented_stream(self):
+        data = 'abcdefghijklmnopqrstuvwxy'
+        self._check_segments(data, self._send_segmented(data))
+
+    def test_send_segmented_file(self):
+        data = 'abcdefghijklmnopqrstuvwxy'
+        fd, filename = tempfile.mkstemp()
+        os.write(fd, data)
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        f = open(filename, 'rb')
+        self._check_segments(data, self._send_segmented(f))
+        f.close()
+
+    def test_send_segmented_checks_md5(self):
+        self.assertRaises(AssertionError, self._send_segmented,
+                          'abcdefghijklmnopqrstuvwxy', etag='bad-etag')
+        self.assertFalse(self.client.make_request.called)
+        # The mismatched segments were stored all the same
+        self.assertEqual(self._deleted_segments(), sorted(self.uploads))
+
+    def test_send_segmented_failure_deletes_segments(self):
+        self.assertRaises(ResponseError, self._send_segmented,
+                          'abcdefghijklmnopqrstuvwxy', failing=1)
+        self.assertFalse(self.client.make_request.called)
+        self.assertTrue(self.uploads)
+        self.assertEqual(self._deleted_segments(), sorted(self.uploads))
+
+    def _deleted_segments(self):
+        return sorted(c[0] for c in self.client.delete_object.call_args_list)
+
+    def _upload_directory(self, directory='tree', workdir=None, **kwargs):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(root)
+        os.makedirs('tree/sub')
+        for name, data in [('tree/small', 'a'), ('tree/sub/large', 'b' * 10),
+                           ('tree/medium', 'c' * 5)]:
+            open(name, 'wb').write(data)
+
+        if workdir:
+            os.chdir(workdir)
+
+        uploads = {}
+        self.client.chunk_upload.side_effect = \
+            lambda path, size=None, headers=None: FakeUpload(uploads, path)
+        counts = self.obj.upload_directory(directory, **kwargs)
+        return counts, uploads
+
+    def test_upload_directory(self):
+        counts, uploads = self._upload_directory(workers=1)
+        self.assertEqual(counts, {'uploaded': 4, 'skipped': 0})
+        self.assertEqual([c[0][0][1] for c in
+                          self.client.chunk_upload.call_args_list],
+                         ['tree/sub/large', 'tree/medium', 'tree/small'])
+        self.assertEqual(uploads[('CONTAINER', 'tree/sub/large')],
+                         ['b' * 10])
+        self.assertEqual(self.client.make_request.call_args[0][:2],
+                         ('PUT', ['CONTAINER', 'tree/sub']))
+
+    def test_upload_directory_skip_unchanged(self):
+        listing = [
+            StorageObjectEntry('CONTAINER', 'tree/sub'),
+            StorageObjectEntry('CONTAINER', 'tree/small', bytes=1,
+                               hash=hashlib.md5('a').hexdigest()),
+            StorageObjectEntry('CONTAINER', 'tree/medium', bytes=5,
+                               hash='changed')]
+        self.client.container().iter_objects.return_value = listing
+        counts, uploads = self._upload_directory(skip_unchanged=True)
+        self.assertEqual(counts, {'uploaded': 2, 'skipped': 2})
+        self.assertEqual(sorted(uploads), [('CONTAINER', 'tree/medium'),
+                                           ('CONTAINER', 'tree/sub/large')])
+        self.client.container().iter_objects.assert_called_once_with(
+            prefix='tree/', lightweight=True)
+
+    def test_upload_working_directory_skip_unchanged(self):
+        listing = [
+            StorageObjectEntry('CONTAINER', 'sub'),
+            StorageObjectEntry('CONTAINER', 'small', bytes=1,
+                               hash=hashlib.md5('a').hexdigest())]
+        self.client.container().iter_objects.return_value = listing
+        counts, uploads = self._upload_directory('.', workdir='tree',
+                                                 skip_unchanged=True)
+        self.assertEqual(counts, {'uploaded': 2, 'skipped': 2})
+        self.assertEqual(sorted(uploads), [('CONTAINER', 'medium'),
+                                           ('CONTAINER', 'sub/large')])
+        self.client.container().iter_objects.assert_called_once_with(
+            prefix=None, lightweight=True)
+
+    def test_download_directory(self):
+        self.client.delimiter = '/'
+        self.obj.download_directory('out', workers=2)
+        self.client.container.assert_called_once_with('CONTAINER')
+        self.client.container().download_directory.assert_called_once_with(
+            'out', prefix='NAME/', workers=2)
+
     def test_copy_to(self):
         _make_request = Mock()
         self.obj._make_request = _make_request
@@ -118,5 +321,45 @@ class ClientTest(unittest.TestCase):
         self.client = Mock()
         self.obj = StorageObject('CONTAINER', 'NAME', client=self.client)
 
+
+class StorageObjectEntryTest(unittest.TestCase):
+    def test_from_listing(self):
+        self.assertEqual(self.entry.name, 'dir/NAME')
+        self.assertEqual(self.entry.size, 10)
+        self.assertEqual(len(self.entry), 10)
+        self.assertEqual(self.entry.hash, 'HASH')
+        self.assertEqual(self.entry.path, 'CONTAINER/dir/NAME')
+        self.assertFalse(self.entry.is_dir())
+        self.assertFalse(hasattr(self.entry, '__dict__'))
+        self.assertFalse(self.client.storage_object.called)
+
+    def test_url(self):
+        self.client.get_url.return_value = 'URL'
+        self.assertEqual(self.entry.url, 'URL')
+        self.client.get_url.assert_called_once_with(['CONTAINER', 'dir/NAME'])
+
+    def test_upgrade(self):
+        obj = self.client.storage_object.return_value
+        self.assertTrue(self.entry.delete is obj.delete)
+        self.assertTrue(self.entry.meta is obj.meta)
+        self.assertTrue(self.entry.get_object() is obj)
+        self.client.storage_object.assert_called_once_with(
+            'CONTAINER', 'dir/NAME',
+            headers={'bytes': 10, 'hash': 'HASH',
+                     'content_type': 'text/plain',
+                     'last_modified': '2012-01-01T00:00:00'})
+
+    def test_missing_private_attribute(self):
+        self.assertRaises(AttributeError, getattr, self.entry, '_missing')
+
+    def setUp(self):
+        self.client = Mock()
+        self.entry = StorageObjectEntry.from_listing(
+            'CONTAINER', {'name': 'dir/NAME', 'bytes': 10, 'hash': 'HASH',
+                          'content_type': 'text/plain',
+                          'last_modified': '2012-01-01T00:00:00'},
+            client=self.client)
+
+
 if __name__ == "__main__":
     unittest.main()
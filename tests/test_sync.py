@@ -0,0 +1,110 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import hashlib
+import os
+import shutil
+import tempfile
+
+from mock import Mock
+
+from object_storage.storage_object import StorageObjectEntry
+from object_storage.sync import Sync, SyncState, UPLOAD, DOWNLOAD
+
+
+class SyncTest(unittest.TestCase):
+    def test_plan_upload(self):
+        plan = Sync(self.container, self.tmp, prefix='p/').plan(UPLOAD)
+        self.assertEqual(plan.new, ['p/dir/new'])
+        self.assertEqual(plan.changed, ['p/changed'])
+        self.assertEqual(plan.deleted, ['p/remote'])
+        self.container.iter_objects.assert_called_once_with(
+            prefix='p/', lightweight=True)
+
+    def test_plan_download(self):
+        plan = Sync(self.container, self.tmp, prefix='p/').plan(DOWNLOAD)
+        self.assertEqual(plan.new, ['p/remote'])
+        self.assertEqual(plan.changed, ['p/changed'])
+        self.assertEqual(plan.deleted, ['p/dir/new'])
+
+    def test_dry_run(self):
+        plan = Sync(self.container, self.tmp, prefix='p/').run(
+            UPLOAD, delete=True, dry_run=True)
+        self.assertEqual(len(plan), 3)
+        self.assertFalse(self.container.storage_object.called)
+        self.assertFalse(self.container.delete_object.called)
+        self.assertTrue('upload new: p/dir/new' in str(plan))
+
+    def test_run_upload(self):
+        objs = {}
+
+        def _storage_object(name):
+            obj = objs[name] = Mock()
+            obj.model = {'hash': 'uploaded'}
+            return obj
+        self.container.storage_object.side_effect = _storage_object
+        Sync(self.container, self.tmp, prefix='p/').run(UPLOAD, delete=True)
+        self.assertEqual(sorted(objs), ['p/changed', 'p/dir/new'])
+        objs['p/dir/new'].load_from_filename.assert_called_once_with(
+            os.path.join(self.tmp, 'dir', 'new'))
+        self.container.delete_object.assert_called_once_with('p/remote')
+
+    def test_run_download(self):
+        def _storage_object(name):
+            obj = Mock()
+            obj.save_to_filename.side_effect = \
+                lambda filename: open(filename, 'w').write(name)
+            return obj
+        self.container.storage_object.side_effect = _storage_object
+        Sync(self.container, self.tmp, prefix='p/').run(DOWNLOAD,
+                                                        delete=True)
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         ['changed', 'dir', 'remote', 'same'])
+        self.assertEqual(os.listdir(os.path.join(self.tmp, 'dir')), [])
+        self.assertEqual(open(os.path.join(self.tmp, 'remote')).read(),
+                         'p/remote')
+
+    def test_state_file_skips_md5(self):
+        state_file = os.path.join(self.tmp, '.sync-state')
+        sync = Sync(self.container, self.tmp, prefix='p/',
+                    state_file=state_file)
+        sync.run(UPLOAD, dry_run=True)
+        sync.state.save()
+
+        state = SyncState(state_file)
+        self.assertEqual(state.files['same']['hash'],
+                         hashlib.md5('same').hexdigest())
+        state.files['same']['hash'] = 'cached'
+        state.save()
+        plan = Sync(self.container, self.tmp, prefix='p/',
+                    state_file=state_file).plan(UPLOAD)
+        self.assertEqual(plan.changed, ['p/changed', 'p/same'])
+        self.assertEqual(plan.new, ['p/dir/new'])
+
+    def test_invalid_direction(self):
+        self.assertRaises(ValueError, Sync(self.container, self.tmp).plan,
+                          'sideways')
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmp, 'dir'))
+        for name, content in (('same', 'same'), ('changed', 'local'),
+                              ('dir/new', 'new')):
+            open(os.path.join(self.tmp, name), 'w').write(content)
+        self.container = Mock()
+        self.container.client.delimiter = '/'
+        listing = [
+            StorageObjectEntry('C', 'p/dir', content_type='text/directory'),
+            StorageObjectEntry('C', 'p/same', bytes=4,
+                               hash=hashlib.md5('same').hexdigest()),
+            StorageObjectEntry('C', 'p/changed', bytes=5, hash='other'),
+            StorageObjectEntry('C', 'p/remote', bytes=1, hash='x'),
+            StorageObjectEntry('C', 'p/../escape', bytes=1, hash='x')]
+        self.container.iter_objects.side_effect = lambda **kw: iter(listing)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+from mock import Mock, patch
+
+from object_storage.tokencache import FileTokenCache, MemoryTokenCache, \
+    TokenCache
+from object_storage.transport import httplib2conn
+
+
+class FakeAuth(object):
+    auth_url = 'https://auth/v1.0'
+    username = 'user'
+
+    def __init__(self):
+        self.auth_token = None
+        self.storage_url = None
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        time.sleep(0.01)
+        self.auth_token = 'token%d' % self.fetches
+        self.storage_url = 'https://storage/v1/AUTH_user'
+
+
+class MemoryTokenCacheTest(unittest.TestCase):
+    def make_cache(self, ttl=3600):
+        return MemoryTokenCache(ttl=ttl)
+
+    def worker_cache(self, cache):
+        return cache
+
+    def test_reuses_token(self):
+        cache = self.make_cache()
+        first, second = FakeAuth(), FakeAuth()
+        cache.authenticate(first, first.fetch)
+        self.worker_cache(cache).authenticate(second, second.fetch)
+        self.assertEqual((first.fetches, second.fetches), (1, 0))
+        self.assertEqual(second.auth_token, 'token1')
+        self.assertEqual(second.storage_url, first.storage_url)
+
+    def test_rejected_token_refreshed(self):
+        cache = self.make_cache()
+        auth = FakeAuth()
+        cache.authenticate(auth, auth.fetch)
+        cache.authenticate(auth, auth.fetch)
+        self.assertEqual(auth.auth_token, 'token2')
+
+    def test_refreshed_token_picked_up(self):
+        cache = self.make_cache()
+        first, second = FakeAuth(), FakeAuth()
+        cache.authenticate(first, first.fetch)
+        cache.authenticate(second, second.fetch)
+        # first's token was rejected and refreshed; second's is now rejected
+        cache.authenticate(first, first.fetch)
+        cache.authenticate(second, second.fetch)
+        self.assertEqual(second.fetches, 0)
+        self.assertEqual(second.auth_token, 'token2')
+
+    def test_expired(self):
+        cache = self.make_cache(ttl=-1)
+        first, second = FakeAuth(), FakeAuth()
+        cache.authenticate(first, first.fetch)
+        cache.authenticate(second, second.fetch)
+        self.assertEqual(second.fetches, 1)
+
+    def test_single_flight(self):
+        cache = self.make_cache()
+        auths = [FakeAuth() for _ in range(8)]
+        threads = [threading.Thread(
+            target=self.worker_cache(cache).authenticate,
+            args=(auth, auth.fetch)) for auth in auths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(auth.fetches for auth in auths), 1)
+        self.assertEqual(set(auth.auth_token for auth in auths),
+                         set(['token1']))
+
+    def test_failed_fetch_releases_lock(self):
+        cache = self.make_cache()
+        auth = FakeAuth()
+        self.assertRaises(ValueError, cache.authenticate, auth,
+                          Mock(side_effect=ValueError))
+        cache.authenticate(auth, auth.fetch)
+        self.assertEqual(auth.auth_token, 'token1')
+
+
+class TokenCacheTest(MemoryTokenCacheTest):
+    def make_cache(self, ttl=3600):
+        return TokenCache(ttl=ttl)
+
+
+class FileTokenCacheTest(MemoryTokenCacheTest):
+    def make_cache(self, ttl=3600):
+        return FileTokenCache(self.tmp, ttl=ttl)
+
+    def worker_cache(self, cache):
+        # Every worker opens the cache itself, like separate processes do
+        return FileTokenCache(self.tmp)
+
+    def test_private(self):
+        auth = FakeAuth()
+        cache = self.make_cache()
+        cache.authenticate(auth, auth.fetch)
+        mode = os.stat(cache._path(cache.key(auth))).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0600)
+
+    def test_corrupt(self):
+        auth = FakeAuth()
+        cache = self.make_cache()
+        open(cache._path(cache.key(auth)), 'w').write('{')
+        cache.authenticate(auth, auth.fetch)
+        self.assertEqual(auth.fetches, 1)
+        self.assertEqual(cache.get(cache.key(auth))['auth_token'], 'token1')
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+
+class CachedAuthenticationTest(unittest.TestCase):
+    def test_uses_cache(self):
+        cache = MemoryTokenCache()
+        auths = [httplib2conn.Authentication('user', 'key',
+                                             auth_url='https://auth/v1.0',
+                                             token_cache=cache)
+                 for _ in range(2)]
+        fetch = Mock(side_effect=lambda: setattr(auths[0], 'auth_token',
+                                                 'T'))
+        with patch.object(httplib2conn.Authentication, '_fetch_token', fetch):
+            for auth in auths:
+                auth.authenticate()
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(auths[1].auth_token, 'T')
+        self.assertTrue(auths[1].authenticated)
+
+    def test_without_cache(self):
+        auth = httplib2conn.Authentication('user', 'key',
+                                           auth_url='https://auth/v1.0')
+        with patch.object(httplib2conn.Authentication,
+                          '_fetch_token') as fetch:
+            auth.authenticate()
+            auth.authenticate()
+        self.assertEqual(fetch.call_count, 2)
+
+if __name__ == "__main__":
+    unittest.main()
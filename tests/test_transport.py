@@ -0,0 +1,433 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import socket
+import threading
+import time
+from StringIO import StringIO
+
+import httplib2
+import requests
+from mock import Mock, patch
+from object_storage.deadline import Deadline
+from object_storage.errors import DeadlineExceeded, NotFound, \
+    ResponseError, TimeoutError
+from object_storage.retry import RetryPolicy
+from object_storage.transport import ChunkedUploadConnection, \
+    ConnectionPool, connection_key, is_connection_dropped, requote_path
+from object_storage.transport import httplib2conn, requestsconn
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_connection_key(self):
+        self.assertEqual(connection_key('https://Host:8080/v1/a?b=c'),
+                         ('https', 'host:8080'))
+
+    def test_requote_path(self):
+        self.assertEqual(requote_path('/v1/a b/c%20d/e%2Ff'),
+                         '/v1/a%20b/c%20d/e%2Ff')
+
+    def test_reuses_connections(self):
+        conn = self.pool.get('http://host/path')
+        self.pool.put('http://host/other', conn)
+        self.assertTrue(self.pool.get('http://host/') is conn)
+        self.factory.assert_called_once_with('http', 'host')
+
+    def test_per_host(self):
+        conn = self.pool.get('http://host1/')
+        self.pool.put('http://host1/', conn)
+        self.pool.get('http://host2/')
+        self.assertEqual(self.factory.call_count, 2)
+
+    def test_discard(self):
+        conn = self.pool.get('http://host/')
+        self.pool.discard('http://host/', conn)
+        conn.close.assert_called_once_with()
+        self.assertFalse(self.pool.get('http://host/') is conn)
+
+    def test_idle_eviction(self):
+        self.pool.idle_timeout = 0
+        conn = self.pool.get('http://host/')
+        self.pool.put('http://host/', conn)
+        time.sleep(0.01)
+        self.assertFalse(self.pool.get('http://host/') is conn)
+        conn.close.assert_called_once_with()
+
+    def test_blocks_when_exhausted(self):
+        conns = [self.pool.get('http://host/') for _ in range(2)]
+        result = []
+        t = threading.Thread(
+            target=lambda: result.append(self.pool.get('http://host/')))
+        t.start()
+        time.sleep(0.05)
+        self.assertEqual(result, [])
+        self.pool.put('http://host/', conns[0])
+        t.join(1)
+        self.assertTrue(result[0] is conns[0])
+
+    def test_dropped_connection_reconnects(self):
+        conn = self.pool.get('http://host/')
+        conn.sock, peer = socket.socketpair()
+        self.pool.put('http://host/', conn)
+        self.assertFalse(is_connection_dropped(conn))
+        peer.close()
+        self.assertTrue(is_connection_dropped(conn))
+        self.assertTrue(self.pool.get('http://host/') is conn)
+        conn.close.assert_called_once_with()
+
+    def test_clear(self):
+        conn = self.pool.get('http://host/')
+        self.pool.put('http://host/', conn)
+        self.pool.clear()
+        conn.close.assert_called_once_with()
+
+    def setUp(self):
+        self.factory = Mock(side_effect=lambda scheme, netloc: Mock(sock=None))
+        self.pool = ConnectionPool(maxsize=2, factory=self.factory)
+
+
+class Httplib2ConnectionTest(unittest.TestCase):
+    def test_stale_connection_retried(self):
+        self.conn._request = Mock(side_effect=[socket.error('reset'),
+                                               ('res', 'content')])
+        self.assertEqual(
+            self.conn._pooled_request('GET', 'http://host/', {}, None),
+            ('res', 'content'))
+        self.assertEqual(self.conn._request.call_count, 2)
+        self.pool.put.assert_called_once_with('http://host/', self.socket)
+
+    def test_fresh_connection_not_retried(self):
+        self.socket.sock = None
+        self.conn._request = Mock(side_effect=socket.error('refused'))
+        self.assertRaises(socket.error, self.conn._pooled_request,
+                          'GET', 'http://host/', {}, None)
+        self.assertEqual(self.conn._request.call_count, 1)
+        self.pool.discard.assert_called_once_with('http://host/',
+                                                  self.socket)
+
+    def test_timeout_not_retried(self):
+        self.conn._request = Mock(side_effect=socket.timeout())
+        self.assertRaises(socket.timeout, self.conn._pooled_request,
+                          'GET', 'http://host/', {}, None)
+        self.assertEqual(self.conn._request.call_count, 1)
+
+    def test_timeouts(self):
+        sock = self.socket.sock
+        self.socket.sock = None
+        self.socket.connect.side_effect = lambda: setattr(self.socket,
+                                                          'sock', sock)
+        conn = httplib2conn.AuthenticatedConnection(
+            self.auth, pool=self.pool, connect_timeout=2, read_timeout=7)
+        with patch('httplib2.Http'):
+            conn._request(self.socket, 'GET', 'http://host/', {}, None,
+                          conn._timeouts())
+        self.assertEqual(self.socket.timeout, 2)
+        sock.settimeout.assert_called_once_with(7)
+        self.assertEqual(conn._timeouts(3), (3, 3))
+        self.assertEqual(conn._timeouts((1, None)), (1, None))
+
+    def test_timeout_error(self):
+        self.conn._request = Mock(side_effect=socket.timeout('timed out'))
+        self.assertRaises(TimeoutError, self.conn.make_request, 'GET',
+                          'http://host/')
+        self.pool.discard.assert_called_once_with('http://host/',
+                                                  self.socket)
+
+    def test_deadline_fails_fast(self):
+        self.conn._request = Mock()
+        with Deadline(-1):
+            self.assertRaises(DeadlineExceeded, self.conn.make_request,
+                              'GET', 'http://host/')
+        self.assertFalse(self.conn._request.called)
+
+    def _serve(self, workers):
+        """ Rejects the old token once all workers sent a request with it """
+        arrived = []
+        all_arrived = threading.Event()
+
+        def _pooled_request(method, url, headers, body, hedge=None,
+                            timeout=None):
+            if headers['X-Auth-Token'] == 'old':
+                arrived.append(url)
+                if len(arrived) == workers:
+                    all_arrived.set()
+                all_arrived.wait(5)
+                return Mock(status=401), ''
+            return Mock(status=200), headers['X-Auth-Token']
+        self.conn._pooled_request = _pooled_request
+
+    def _new_token(self):
+        time.sleep(0.01)
+        self.auth.auth_headers = {'X-Auth-Token': 'new'}
+
+    def test_concurrent_401_single_refresh(self):
+        self._serve(workers=4)
+        self.auth.authenticate.side_effect = self._new_token
+        results = []
+
+        def _get():
+            results.append(self.conn.make_request(
+                'GET', 'http://host/', formatter=lambda r: r.content))
+        threads = [threading.Thread(target=_get) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['new'] * 4)
+        self.assertEqual(self.auth.authenticate.call_count, 1)
+        self.assertEqual(self.conn.auth_generation, 2)
+
+    def test_proactive_refresh(self):
+        self.auth.authenticate.side_effect = self._new_token
+        conn = httplib2conn.AuthenticatedConnection(
+            self.auth, pool=self.pool, refresh_interval=60)
+        conn._pooled_request = Mock(return_value=(Mock(status=200), ''))
+        conn.make_request('GET', 'http://host/')
+        self.assertFalse(self.auth.authenticate.called)
+
+        conn._refresh_at = time.time()
+        conn.make_request('GET', 'http://host/')
+        self.assertEqual(self.auth.authenticate.call_count, 1)
+        headers = conn._pooled_request.call_args[0][2]
+        self.assertEqual(headers['X-Auth-Token'], 'new')
+        self.assertTrue(conn._refresh_at > time.time() + 50)
+
+    def test_failed_refresh_keeps_token(self):
+        self.auth.authenticate.side_effect = ResponseError(503, 'Down')
+        conn = httplib2conn.AuthenticatedConnection(
+            self.auth, pool=self.pool, refresh_interval=0)
+        conn._pooled_request = Mock(return_value=(Mock(status=200), ''))
+        conn.make_request('GET', 'http://host/')
+        headers = conn._pooled_request.call_args[0][2]
+        self.assertEqual(headers['X-Auth-Token'], 'old')
+        self.assertTrue(conn._refresh_at > time.time() + 20)
+
+    def test_retry_policy(self):
+        policy = RetryPolicy(backoff=0)
+        conn = httplib2conn.AuthenticatedConnection(
+            self.auth, pool=self.pool, retry_policy=policy)
+        conn._pooled_request = Mock(side_effect=[
+            (httplib2.Response({'status': 503, 'retry-after': '0'}), ''),
+            socket.timeout(), (httplib2.Response({'status': 200}), 'ok')])
+        self.assertEqual(conn.make_request('GET', 'http://host/').content,
+                         'ok')
+        self.assertEqual(policy.counts['retries'], 2)
+
+        conn._pooled_request = Mock(
+            return_value=(httplib2.Response({'status': 503}), ''))
+        self.assertRaises(ResponseError, conn.make_request, 'POST',
+                          'http://host/')
+        self.assertRaises(ResponseError, conn.make_request, 'PUT',
+                          'http://host/', data=StringIO('body'))
+        self.assertEqual(conn._pooled_request.call_count, 2)
+
+    def setUp(self):
+        self.socket = Mock()
+        self.pool = Mock()
+        self.pool.get.return_value = self.socket
+        self.auth = Mock()
+        self.auth.authenticated = True
+        self.auth.auth_headers = {'X-Auth-Token': 'old'}
+        self.conn = httplib2conn.AuthenticatedConnection(self.auth,
+                                                         pool=self.pool)
+
+
+class RequestsConnectionTest(unittest.TestCase):
+    def _response(self, status, content=''):
+        res = Mock()
+        res.status_code = status
+        res.content = content
+        res.iter_content.return_value = iter(['ab', 'c'])
+        if status >= 400:
+            res.raise_for_status.side_effect = Exception(status)
+        return res
+
+    def test_make_request(self):
+        self.session.send.return_value = self._response(200, 'body')
+        res = self.conn.make_request('GET', 'http://host/c/o',
+                                     params={'format': 'json'},
+                                     formatter=lambda r: r.content)
+        self.assertEqual(res, 'body')
+        request = self.session.send.call_args[0][0]
+        self.assertEqual(request.url, 'http://host/c/o?format=json')
+        self.assertEqual(request.headers['X-Auth-Token'], 'old')
+
+    def test_reauthenticates_once(self):
+        self.session.send.side_effect = [self._response(401),
+                                         self._response(204)]
+        res = self.conn.make_request('DELETE', 'http://host/c/o')
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(self.auth.authenticate.call_count, 2)
+        request = self.session.send.call_args[0][0]
+        self.assertEqual(request.headers['X-Auth-Token'], 'new')
+
+    def test_errors(self):
+        self.session.send.return_value = self._response(404)
+        self.assertRaises(NotFound, self.conn.make_request, 'GET',
+                          'http://host/c/o')
+        self.session.send.return_value = self._response(500)
+        self.assertRaises(ResponseError, self.conn.make_request, 'GET',
+                          'http://host/c/o')
+
+    def test_connection_errors(self):
+        self.session.send.side_effect = requests.exceptions.ConnectionError
+        try:
+            self.conn.make_request('GET', 'http://host/c/o')
+        except ResponseError, ex:
+            self.assertEqual(ex.status, 0)
+        else:
+            self.fail('ResponseError not raised')
+        self.session.send.side_effect = requests.exceptions.ReadTimeout
+        self.assertRaises(socket.timeout, self.conn.make_request, 'GET',
+                          'http://host/c/o')
+        self.assertRaises(TimeoutError, self.conn.make_request, 'GET',
+                          'http://host/c/o')
+
+    def test_timeouts(self):
+        self.session.send.return_value = self._response(200)
+        self.conn.make_request('GET', 'http://host/c/o')
+        self.assertEqual(self.session.send.call_args[1]['timeout'], (10, 60))
+        self.conn.make_request('GET', 'http://host/c/o', timeout=(1, 2))
+        self.assertEqual(self.session.send.call_args[1]['timeout'], (1, 2))
+        with Deadline(0.5):
+            self.conn.make_request('GET', 'http://host/c/o')
+        connect, read = self.session.send.call_args[1]['timeout']
+        self.assertTrue(0 < connect <= 0.5 and 0 < read <= 0.5)
+
+    def test_chunk_download_streams(self):
+        res = self._response(200)
+        self.session.send.return_value = res
+        chunks = list(self.conn.chunk_download('http://host/c/o',
+                                               chunk_size=2))
+        self.assertEqual(chunks, ['ab', 'c'])
+        self.assertTrue(self.session.send.call_args[1]['stream'])
+        res.iter_content.assert_called_once_with(2)
+        res.close.assert_called_once_with()
+
+    def test_chunk_download_headers(self):
+        self.session.send.return_value = self._response(206)
+        list(self.conn.chunk_download('http://host/c/o',
+                                      headers={'Range': 'bytes=5-'}))
+        request = self.session.send.call_args[0][0]
+        self.assertEqual(request.headers['Range'], 'bytes=5-')
+
+    def test_environment_settings_cached(self):
+        self.session.send.return_value = self._response(200)
+        self.conn.make_request('GET', 'http://host/a')
+        self.conn.make_request('GET', 'http://host/b')
+        self.assertEqual(self.session.merge_environment_settings.call_count,
+                         1)
+        self.assertEqual(self.session.send.call_args[1]['verify'], False)
+
+    def setUp(self):
+        self.auth = Mock()
+        self.auth.auth_headers = {'X-Auth-Token': 'old'}
+
+        def _authenticate():
+            if self.auth.authenticate.call_count > 1:
+                self.auth.auth_headers = {'X-Auth-Token': 'new'}
+        self.auth.authenticate.side_effect = _authenticate
+        self.session = Mock()
+        self.session.merge_environment_settings.return_value = {
+            'verify': False, 'proxies': {}, 'stream': None, 'cert': None}
+        self.conn = requestsconn.AuthenticatedConnection(
+            self.auth, session=self.session)
+
+
+class ChunkedUploadConnectionTest(unittest.TestCase):
+    def test_uses_pool(self):
+        upload = ChunkedUploadConnection(self.conn, 'PUT',
+                                         'http://host/v1/c/o?q=1', size=5)
+        self.http.putrequest.assert_called_once_with('PUT', '/v1/c/o?q=1')
+        self.http.putheader.assert_called_once_with('Content-Length', '5')
+        upload.send('hello')
+        self.http.send.assert_called_once_with('hello')
+        upload.finish()
+        self.pool.put.assert_called_once_with('http://host/v1/c/o?q=1',
+                                              self.http, reusable=True)
+
+    def test_chunked_framing(self):
+        upload = ChunkedUploadConnection(self.conn, 'PUT', 'http://host/o')
+        upload.send('hello')
+        upload.finish()
+        self.assertEqual([c[0][0] for c in self.http.send.call_args_list],
+                         ['5\r\nhello\r\n', '0\r\n\r\n'])
+
+    def test_abort_discards(self):
+        upload = ChunkedUploadConnection(self.conn, 'PUT', 'http://host/o')
+        upload.send('hello')
+        upload.abort()
+        self.pool.put.assert_called_once_with('http://host/o', self.http,
+                                              reusable=False)
+        self.assertEqual([c[0][0] for c in self.http.send.call_args_list],
+                         ['5\r\nhello\r\n'])
+
+    def test_abandoned_upload_released(self):
+        pool = ConnectionPool(maxsize=1, factory=lambda scheme, netloc: Mock())
+        self.conn.pool = pool
+        ChunkedUploadConnection(self.conn, 'PUT', 'http://host/o')
+        self.assertEqual(pool._open[('http', 'host')], 0)
+
+    def test_closing_response_not_reused(self):
+        self.http.getresponse().will_close = True
+        upload = ChunkedUploadConnection(self.conn, 'PUT', 'http://host/o')
+        upload.finish()
+        self.pool.put.assert_called_once_with('http://host/o', self.http,
+                                              reusable=False)
+
+    def test_send_failure_discards(self):
+        upload = ChunkedUploadConnection(self.conn, 'PUT', 'http://host/o')
+        self.http.send.side_effect = IOError()
+        self.assertRaises(ResponseError, upload.send, 'data')
+        self.pool.put.assert_called_once_with('http://host/o', self.http,
+                                              reusable=False)
+
+    def test_stale_connection_retried(self):
+        self.http.endheaders.side_effect = [IOError(), None]
+        ChunkedUploadConnection(self.conn, 'PUT', 'http://host/o')
+        self.http.close.assert_called_once_with()
+        self.assertEqual(self.http.putrequest.call_count, 2)
+
+    def test_new_connection_sets_nodelay(self):
+        sock = self.http.sock
+        self.http.sock = None
+        self.http.connect.side_effect = lambda: setattr(self.http, 'sock',
+                                                        sock)
+        ChunkedUploadConnection(self.conn, 'PUT', 'http://host/o')
+        sock.setsockopt.assert_called_once_with(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def test_timeouts(self):
+        sock = self.http.sock
+        self.http.sock = None
+        self.http.connect.side_effect = lambda: setattr(self.http, 'sock',
+                                                        sock)
+        upload = ChunkedUploadConnection(self.conn, 'PUT', 'http://host/o',
+                                         timeouts=(2, 7))
+        self.assertEqual(self.http.timeout, 2)
+        sock.settimeout.assert_called_once_with(7)
+        self.http.send.side_effect = socket.timeout()
+        self.assertRaises(TimeoutError, upload.send, 'data')
+
+    def test_fresh_connection_not_retried(self):
+        self.http.sock = None
+        self.http.connect.side_effect = lambda: setattr(self.http, 'sock',
+                                                        Mock())
+        self.http.endheaders.side_effect = IOError()
+        self.assertRaises(ResponseError, ChunkedUploadConnection,
+                          self.conn, 'PUT', 'http://host/o')
+        self.assertEqual(self.http.putrequest.call_count, 1)
+
+    def setUp(self):
+        self.http = Mock()
+        self.http.getresponse().status = 201
+        self.http.getresponse().will_close = False
+        self.http.getresponse().getheaders.return_value = []
+        self.pool = Mock()
+        self.pool.get.return_value = self.http
+        self.conn = Mock()
+        self.conn.pool = self.pool
+
+if __name__ == "__main__":
+    unittest.main()
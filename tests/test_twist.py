@@ -0,0 +1,445 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import hashlib
+import os
+import tempfile
+import time
+from StringIO import StringIO
+
+from mock import Mock, patch
+
+from object_storage.client import Client
+from object_storage.errors import AuthenticationError, TimeoutError
+from object_storage.retry import RetryPolicy
+from object_storage.tokencache import MemoryTokenCache
+
+try:
+    from twisted.internet import error as net_error
+    from twisted.internet.defer import Deferred, fail, maybeDeferred, \
+        succeed
+    from twisted.internet.task import Clock
+    from twisted.python.failure import Failure
+    from twisted.web.client import ResponseDone, ResponseFailed, \
+        ResponseNeverReceived
+    from object_storage.errors import ResponseError
+    from object_storage.transport import twist
+except ImportError:
+    twist = None
+
+
+@unittest.skipIf(twist is None, 'twisted is not installed')
+class TwistedConnectionTest(unittest.TestCase):
+    def test_persistent_pool(self):
+        conn = twist.AuthenticatedConnection(Mock(), pool_size=4,
+                                             pool_idle_timeout=30)
+        self.assertTrue(conn.pool.persistent)
+        self.assertEqual(conn.pool.maxPersistentPerHost, 4)
+        self.assertEqual(conn.pool.cachedConnectionTimeout, 30)
+        self.assertTrue(conn.agent._pool is conn.pool)
+
+    def test_shared_pool(self):
+        pool = Mock()
+        conn = twist.AuthenticatedConnection(Mock(), pool=pool)
+        self.assertTrue(conn.pool is pool)
+        conn.close()
+        pool.closeCachedConnections.assert_called_once_with()
+
+    def test_requests_share_agent(self):
+        conn = twist.AuthenticatedConnection(Mock())
+        conn.auth_headers = {'X-Auth-Token': 'token'}
+        response = Mock(code=204, version=('HTTP', 1, 1), phrase='OK')
+        response.headers.getAllRawHeaders.return_value = []
+        conn.agent = Mock()
+        conn.agent.request.side_effect = lambda *args: succeed(response)
+        for _ in range(2):
+            conn.make_request('DELETE', 'http://host/v1/c/o o')
+        self.assertEqual(conn.agent.request.call_count, 2)
+        self.assertEqual(conn.agent.request.call_args[0][:2],
+                         ('DELETE', 'http://host/v1/c/o%20o'))
+
+    def test_requests_per_host_limited(self):
+        conn = twist.AuthenticatedConnection(Mock(), pool_size=2)
+        conn.auth_headers = {}
+        response = Mock(code=204, version=('HTTP', 1, 1), phrase='OK')
+        response.headers.getAllRawHeaders.return_value = []
+        pending = []
+
+        def _request(method, url, headers, body):
+            pending.append(Deferred())
+            return pending[-1]
+        conn.agent = Mock()
+        conn.agent.request.side_effect = _request
+        for _ in range(3):
+            conn.make_request('DELETE', 'http://host/c/o')
+        conn.make_request('DELETE', 'http://other/c/o')
+        self.assertEqual(conn.agent.request.call_count, 3)
+        pending[0].callback(response)
+        self.assertEqual(conn.agent.request.call_count, 4)
+        self.assertEqual(conn.agent.request.call_args[0][1],
+                         'http://host/c/o')
+
+    def test_chunk_upload(self):
+        conn = twist.AuthenticatedConnection(Mock())
+        conn.auth_headers = {}
+        conn.agent = Mock()
+        conn.agent.request.return_value = Deferred()
+        upload = conn.chunk_upload('PUT', 'http://host/c/o', size=3)
+        method, url, headers, body = conn.agent.request.call_args[0]
+        self.assertEqual((method, url, body.length),
+                         ('PUT', 'http://host/c/o', 3))
+        self.assertTrue(upload.body is body)
+
+    def test_retry_policy(self):
+        conn = twist.AuthenticatedConnection(
+            Mock(), retry_policy=RetryPolicy(backoff=0))
+        conn.auth_headers = {}
+        response = Mock(code=204, version=('HTTP', 1, 1), phrase='OK')
+        response.headers.getAllRawHeaders.return_value = []
+        conn.agent = Mock()
+        conn.agent.request.side_effect = [
+            fail(ResponseNeverReceived([])), succeed(response)]
+        results = []
+        with patch.object(twist, 'deferLater',
+                          lambda clock, delay, f: maybeDeferred(f)):
+            conn.make_request('DELETE', 'http://host/c/o').addCallback(
+                results.append)
+        self.assertEqual(results[0].status_code, 204)
+        self.assertEqual(conn.retry_policy.counts['retries'], 1)
+
+    def test_default_agent(self):
+        self.assertTrue(twist.default_agent() is twist.default_agent())
+
+    def test_connect_timeout(self):
+        conn = twist.AuthenticatedConnection(Mock(), connect_timeout=3)
+        self.assertEqual(conn.agent._endpointFactory._connectTimeout, 3)
+        conn.auth_headers = {}
+        conn.agent = Mock()
+        conn.agent.request.return_value = fail(net_error.TimeoutError())
+        failures = []
+        conn.make_request('GET', 'http://host/c/o').addErrback(
+            failures.append)
+        self.assertTrue(failures[0].check(TimeoutError))
+
+
+@unittest.skipIf(twist is None, 'twisted is not installed')
+class ReadTimeoutTest(unittest.TestCase):
+    def _request(self, method='GET', **kwargs):
+        conn = twist.AuthenticatedConnection(Mock(), read_timeout=10)
+        conn.auth_headers = {}
+        conn.agent = Mock()
+        conn.agent.request.return_value = self.pending
+        d = conn.make_request(method, 'http://host/c/o', **kwargs)
+        d.addCallbacks(self.results.append, self.failures.append)
+        return d
+
+    def test_no_response(self):
+        self._request()
+        self.clock.advance(9)
+        self.assertEqual(self.failures, [])
+        self.clock.advance(1)
+        self.assertTrue(self.failures[0].check(TimeoutError))
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_stalled_body(self):
+        readers = []
+        resp = Mock(code=200, version=('HTTP', 1, 1), phrase='OK')
+        resp.headers.getAllRawHeaders.return_value = []
+        resp.deliverBody.side_effect = readers.append
+        self._request()
+        self.clock.advance(5)
+        self.pending.callback(resp)
+        reader = readers[0]
+        reader.makeConnection(Mock())
+        self.clock.advance(8)
+        reader.dataReceived('a')
+        self.clock.advance(8)
+        self.assertFalse(reader.transport.stopProducing.called)
+        self.clock.advance(2)
+        reader.transport.stopProducing.assert_called_once_with()
+        reader.connectionLost(Failure(ResponseFailed([])))
+        self.assertTrue(self.failures[0].check(TimeoutError))
+
+    def test_response_in_time(self):
+        resp = Mock(code=204, version=('HTTP', 1, 1), phrase='OK')
+        resp.headers.getAllRawHeaders.return_value = []
+        self._request('HEAD', formatter=lambda r: r.status_code)
+        self.clock.advance(9)
+        self.pending.callback(resp)
+        self.assertEqual(self.results, [204])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_upload_waits_for_body(self):
+        body = twist.ChunkedStreamProducer()
+        self._request(data=body)
+        self.clock.advance(30)
+        self.assertEqual(self.failures, [])
+        body.startProducing(FakeConsumer(body, 10))
+        body.finish()
+        self.clock.advance(10)
+        self.assertTrue(self.failures[0].check(TimeoutError))
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = patch.object(twist, 'reactor', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pending = Deferred()
+        self.results = []
+        self.failures = []
+
+
+@unittest.skipIf(twist is None, 'twisted is not installed')
+class BodyReaderTest(unittest.TestCase):
+    def _deliver(self, reader, chunks, reason=None):
+        reader.makeConnection(Mock())
+        for chunk in chunks:
+            reader.dataReceived(chunk)
+        reader.connectionLost(Failure(reason or ResponseDone()))
+        return self.results
+
+    def test_full_body(self):
+        reader = twist.FullBodyReader(self.finished)
+        self.assertEqual(self._deliver(reader, ['a', 'b', 'c']), ['abc'])
+
+    def test_failed_body(self):
+        reader = twist.FullBodyReader(self.finished)
+        self._deliver(reader, ['a'], ResponseFailed([]))
+        self.assertEqual(self.results, [])
+        self.assertTrue(self.failures[0].check(ResponseFailed))
+
+    def test_streaming(self):
+        chunks = []
+        reader = twist.StreamingBodyReader(self.finished, chunks.append)
+        self.assertEqual(self._deliver(reader, ['ab', 'c']), [3])
+        self.assertEqual(chunks, ['ab', 'c'])
+
+    def test_streaming_consumer_error(self):
+        def _fail(chunk):
+            raise ValueError(chunk)
+        reader = twist.StreamingBodyReader(self.finished, _fail)
+        self._deliver(reader, ['a', 'b'])
+        reader.transport.stopProducing.assert_called_once_with()
+        self.assertTrue(self.failures[0].check(ValueError))
+
+    def test_file(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        reader = twist.FileBodyReader(self.finished, filename)
+        self._deliver(reader, ['ab', 'c'])
+        self.assertEqual(open(filename).read(), 'abc')
+
+    def test_complete_request_consumer(self):
+        chunks = []
+        resp = Mock(code=200, version=('HTTP', 1, 1), phrase='OK')
+        resp.headers.getAllRawHeaders.return_value = [('Etag', ['x'])]
+        resp.deliverBody.side_effect = \
+            lambda reader: self._deliver(reader, ['abc'])
+        d = twist.complete_request(resp, consumer=chunks.append)
+        d.addCallback(self.results.append)
+        self.assertEqual(chunks, ['abc'])
+        self.assertEqual(self.results[-1].headers, {'etag': 'x'})
+        self.assertEqual(self.results[-1].content, None)
+
+    def setUp(self):
+        self.results = []
+        self.failures = []
+        self.finished = Deferred()
+        self.finished.addCallbacks(self.results.append, self.failures.append)
+
+
+class FakeConsumer(object):
+    """ Transport that pauses its producer once `limit` bytes are queued """
+    def __init__(self, producer, limit):
+        self.producer = producer
+        self.limit = limit
+        self.data = []
+        self.queued = 0
+
+    def write(self, data):
+        self.data.append(data)
+        self.queued += len(data)
+        if self.queued >= self.limit:
+            self.producer.pauseProducing()
+
+    def drain(self):
+        self.queued = 0
+        self.producer.resumeProducing()
+
+
+@unittest.skipIf(twist is None, 'twisted is not installed')
+class ChunkedStreamProducerTest(unittest.TestCase):
+    def test_buffers_until_started(self):
+        self.assertTrue(self.producer.send('a' * 5).called)
+        self.assertFalse(self.producer.send('b' * 5).called)
+        self.producer.startProducing(self.consumer)
+        self.assertEqual(self.consumer.data, ['aaaaa', 'bbbbb'])
+
+    def test_waits_for_drain(self):
+        self.producer.startProducing(self.consumer)
+        self.assertTrue(self.producer.send('a' * 5).called)
+        first = self.producer.send('b' * 5)
+        self.assertTrue(self.producer.paused)
+        self.assertFalse(first.called)
+        second = self.producer.send('c' * 10)
+        self.assertEqual(self.consumer.data, ['a' * 5, 'b' * 5])
+        self.consumer.drain()
+        self.assertEqual(self.consumer.data[-1], 'c' * 10)
+        self.assertFalse(first.called or second.called)
+        self.consumer.drain()
+        self.assertTrue(first.called and second.called)
+
+    def test_send_file(self):
+        self.producer.startProducing(self.consumer)
+        f = StringIO('x' * 100)
+        done = self.producer.send_file(f, chunk_size=10)
+        self.assertEqual(f.tell(), 10)
+        while not done.called:
+            self.consumer.drain()
+        self.assertEqual(''.join(self.consumer.data), 'x' * 100)
+
+    def test_finish(self):
+        finished = self.producer.startProducing(self.consumer)
+        self.producer.send('a' * 10)
+        self.producer.send('b')
+        done = self.producer.finish()
+        self.assertFalse(finished.called)
+        self.consumer.drain()
+        self.assertTrue(finished.called)
+        self.assertTrue(done.called)
+
+    def test_stop(self):
+        self.producer.startProducing(self.consumer)
+        failures = []
+        # Both sends wait for the paused transport
+        self.producer.send('a' * 10).addErrback(failures.append)
+        self.producer.send('b').addErrback(failures.append)
+        self.assertEqual(failures, [])
+        self.producer.stopProducing()
+        self.assertEqual(len(failures), 2)
+        self.assertTrue(failures[0].check(ResponseError))
+        self.assertTrue(failures[1].check(ResponseError))
+        self.producer.send('c').addErrback(failures.append)
+        self.assertEqual(len(failures), 3)
+
+    def setUp(self):
+        self.producer = twist.ChunkedStreamProducer(buffer_size=8)
+        self.consumer = FakeConsumer(self.producer, 10)
+
+
+@unittest.skipIf(twist is None, 'twisted is not installed')
+class StorageObjectSendTest(unittest.TestCase):
+    def _request(self, method, url, headers, body):
+        consumer = FakeConsumer(body, 1024)
+        self.consumers.append(consumer)
+        resp = Mock(code=201, version=('HTTP', 1, 1), phrase='Created')
+        resp.deliverBody.side_effect = self._deliver
+        d = Deferred()
+
+        def _sent(result):
+            data = ''.join(consumer.data)
+            resp.headers.getAllRawHeaders.return_value = [
+                ('Etag', [hashlib.md5(data).hexdigest()])]
+            d.callback(resp)
+        body.startProducing(consumer).addCallbacks(_sent, d.errback)
+        return d
+
+    def _deliver(self, reader):
+        reader.makeConnection(Mock())
+        reader.connectionLost(Failure(ResponseDone()))
+
+    def test_send(self):
+        self.obj.upload_chunk_size = 4
+        results = []
+        self.obj.send('hello world').addCallback(results.append)
+        self.assertTrue(results[0] is self.obj)
+        self.assertEqual(''.join(self.consumers[0].data), 'hello world')
+        self.assertEqual(self.obj.model['size'], 11)
+
+    def test_send_read_error(self):
+        data = Mock(spec=['read'])
+        data.read.side_effect = IOError()
+        failures = []
+        self.obj.send(data).addErrback(failures.append)
+        self.assertTrue(failures[0].check(IOError))
+        self.assertEqual(self.conn._limit('http://host/v1').tokens,
+                         self.conn.pool_size)
+
+    def test_load_from_filename(self):
+        fd, filename = tempfile.mkstemp()
+        os.write(fd, 'hello')
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        results = []
+        self.obj.load_from_filename(filename).addCallback(results.append)
+        self.assertTrue(results[0] is self.obj)
+        self.assertEqual(''.join(self.consumers[0].data), 'hello')
+
+    def setUp(self):
+        self.conn = twist.AuthenticatedConnection(
+            Mock(storage_url='http://host/v1'))
+        self.conn.auth_headers = {}
+        self.conn.storage_url = 'http://host/v1'
+        self.conn.agent = Mock()
+        self.conn.agent.request.side_effect = self._request
+        self.consumers = []
+        self.obj = Client('user', 'key', connection=self.conn)['c']['o']
+
+
+@unittest.skipIf(twist is None, 'twisted is not installed')
+class AuthenticationTest(unittest.TestCase):
+    def test_concurrent_calls_share_request(self):
+        pending = Deferred()
+        with patch.object(twist, 'make_request',
+                          Mock(return_value=pending)) as make_request:
+            first = self.auth.authenticate()
+            second = self.auth.authenticate()
+        self.assertEqual(make_request.call_count, 1)
+        fired = []
+        second.addCallback(fired.append)
+        pending.callback(self.response)
+        self.assertEqual(fired, [None])
+        self.assertTrue(first.called)
+        self.assertEqual(self.auth.auth_token, 'token')
+        self.assertEqual(self.cache.get(self.cache.key(self.auth))[
+            'auth_token'], 'token')
+
+    def test_failure_reaches_waiters(self):
+        pending = Deferred()
+        with patch.object(twist, 'make_request',
+                          Mock(return_value=pending)):
+            first = self.auth.authenticate()
+            second = self.auth.authenticate()
+        failures = []
+        first.addErrback(failures.append)
+        second.addErrback(failures.append)
+        self.response.status_code = 401
+        pending.callback(self.response)
+        self.assertEqual(len(failures), 2)
+        self.assertTrue(failures[1].check(AuthenticationError))
+
+    def test_cached_token(self):
+        self.cache.set(self.cache.key(self.auth), {
+            'auth_token': 'cached', 'storage_url': 'http://storage',
+            'expires': time.time() + 60})
+        with patch.object(twist, 'make_request') as make_request:
+            self.assertTrue(self.auth.authenticate().called)
+        self.assertFalse(make_request.called)
+        self.assertEqual(self.auth.auth_token, 'cached')
+
+    def setUp(self):
+        self.cache = MemoryTokenCache()
+        self.auth = twist.Authentication('user', 'key',
+                                         auth_url='http://auth/v1.0',
+                                         token_cache=self.cache)
+        self.response = twist.Response()
+        self.response.status_code = 200
+        self.response.headers = {'x-auth-token': 'token',
+                                 'x-storage-url': 'http://storage'}
+        self.response.content = '{"storage": {"default": "public", ' \
+            '"public": "http://storage"}}'
+
+if __name__ == "__main__":
+    unittest.main()
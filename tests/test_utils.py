@@ -0,0 +1,124 @@
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+import threading
+
+from object_storage import errors
+from object_storage.utils import get_path, imap_unordered, \
+    call_in_background, chain, not_found_as, on_done
+
+try:
+    from twisted.internet.defer import fail, succeed
+except ImportError:
+    fail = succeed = None
+
+
+class GetPathTest(unittest.TestCase):
+    def test_list(self):
+        self.assertEqual(get_path(['a b', 'c']), 'a%20b/c')
+
+    def test_string(self):
+        self.assertEqual(get_path('a b/c'), 'a%20b/c')
+
+
+class ImapUnorderedTest(unittest.TestCase):
+    def test_results(self):
+        results = imap_unordered(lambda x: x * 2, range(100), workers=4)
+        self.assertEqual(sorted(results), [x * 2 for x in range(100)])
+
+    def test_runs_concurrently(self):
+        lock = threading.Lock()
+        started = []
+        all_started = threading.Event()
+
+        def _wait(x):
+            lock.acquire()
+            started.append(x)
+            if len(started) == 4:
+                all_started.set()
+            lock.release()
+            all_started.wait(5)
+            return all_started.isSet()
+        self.assertEqual(list(imap_unordered(_wait, range(4), workers=4)),
+                         [True] * 4)
+
+    def test_reraises(self):
+        def _fail(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        self.assertRaises(ValueError, list,
+                          imap_unordered(_fail, range(10), workers=2))
+
+    def test_iterable_error(self):
+        def _items():
+            yield 1
+            raise KeyError()
+        self.assertRaises(KeyError, list,
+                          imap_unordered(lambda x: x, _items(), workers=2))
+
+    def test_bounded_read_ahead(self):
+        consumed = []
+
+        def _items():
+            for i in range(1000):
+                consumed.append(i)
+                yield i
+        results = imap_unordered(lambda x: x, _items(), workers=2, backlog=2)
+        results.next()
+        results.close()
+        self.assertTrue(len(consumed) < 20)
+
+
+class CallInBackgroundTest(unittest.TestCase):
+    def test_result(self):
+        wait = call_in_background(lambda a, b=0: a + b, 1, b=2)
+        self.assertEqual(wait(), 3)
+
+    def test_reraises(self):
+        wait = call_in_background(lambda: {}['missing'])
+        self.assertRaises(KeyError, wait)
+
+
+class NotFoundAsTest(unittest.TestCase):
+    def test_plain_result(self):
+        self.assertEqual(not_found_as(True, False), True)
+
+    @unittest.skipIf(fail is None, 'twisted is not installed')
+    def test_deferred(self):
+        results = []
+        not_found_as(fail(errors.NotFound(404, 'Not Found')),
+                     False).addCallback(results.append)
+        not_found_as(succeed(True), False).addCallback(results.append)
+        not_found_as(fail(errors.ResponseError(500, 'Server Error')),
+                     False).addErrback(results.append)
+        self.assertEqual(results[:2], [False, True])
+        self.assertTrue(results[2].check(errors.ResponseError))
+
+
+class ChainTest(unittest.TestCase):
+    def test_plain_result(self):
+        self.assertEqual(chain(2, lambda r: r * 2), 4)
+        done = []
+        self.assertEqual(on_done(2, lambda: done.append(True)), 2)
+        self.assertEqual(done, [True])
+
+    @unittest.skipIf(fail is None, 'twisted is not installed')
+    def test_deferred(self):
+        results = []
+        cleanups = []
+        chain(succeed(2), lambda r: r * 2,
+              lambda: cleanups.append(1)).addCallback(results.append)
+        chain(fail(IOError()), lambda r: r * 2,
+              lambda: cleanups.append(2)).addErrback(results.append)
+        on_done(fail(IOError()),
+                lambda: cleanups.append(3)).addErrback(results.append)
+        self.assertEqual(results[0], 4)
+        self.assertTrue(results[1].check(IOError))
+        self.assertTrue(results[2].check(IOError))
+        self.assertEqual(cleanups, [2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()